@@ -1,12 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session
-import json
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session, Response, stream_with_context
+import hashlib
+import math
 import os
-import cv2
-import numpy as np
-from io import BytesIO
 import tempfile
-from database import db, StudySession, StoredCoordinate, PolygonSet
-from datetime import datetime
+from database import db, init_db, StudySession, StoredCoordinate
+import polygon_store
+import geometry
+import exports
+import results_query
+import stats
+import submissions
+import telemetry
+import metrics
+from payload_cache import VersionedCache
+from jinja2.utils import htmlsafe_json_dumps
+from stimuli import FrameCache, StimulusRegistry, StimulusNotFound, DEFAULT_STIMULUS, quantize
+from frame_pool import FramePool
+from render_executor import RenderExecutor, Saturated, DeadlineExceeded
+from lazy_import import lazy_import
+from snow_stream import BOUNDARY, StreamLimiter, mjpeg_stream
+
+# numpy and OpenCV load with the first image request, not at startup
+np = lazy_import('numpy')
+image_codec = lazy_import('image_codec')
+noise_kernel = lazy_import('noise_kernel')
+hit_map = lazy_import('hit_map')
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
@@ -26,52 +44,37 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Initialize database
 db.init_app(app)
+metrics.init_app(app)
+
+# Decoded stimulus frames are cached per worker (size in MB) and memory-mapped
+# from SHARED_FRAMES_DIR, so all workers share one copy; set it empty to disable
+stimuli = StimulusRegistry(
+    max_cache_bytes=int(os.environ.get('STIMULUS_CACHE_MB', 256)) * 1024 * 1024,
+    shared_dir=os.environ.get('SHARED_FRAMES_DIR', os.path.join(tempfile.gettempdir(), f'visual-snow-frames-{os.getuid()}'))
+)
 
 # Database helper functions
 def load_coordinates():
-    """Load coordinates from database, converting to old format for compatibility"""
-    coordinates = StoredCoordinate.query.all()
-    return [coord.to_dict() for coord in coordinates]
-
-def save_coordinates(coordinates_list):
-    """Save coordinates to database (for admin interface compatibility)"""
-    # Clear existing coordinates
-    StoredCoordinate.query.delete()
-    
-    # Add new coordinates
-    for coord_data in coordinates_list:
-        coord = StoredCoordinate(
-            id=coord_data.get('id'),
-            label=coord_data.get('label', ''),
-            points=coord_data.get('points', [])
-        )
-        db.session.add(coord)
-    
-    db.session.commit()
-
-def load_polygon_sets():
-    """Load polygon sets from database, converting to old format"""
-    sets = PolygonSet.query.all()
-    result = {}
-    for polygon_set in sets:
-        result[polygon_set.name] = polygon_set.to_dict()
-    return result
-
-def save_polygon_sets(polygon_sets_dict):
-    """Save polygon sets to database"""
-    # Clear existing sets
-    PolygonSet.query.delete()
-    
-    # Add new sets
-    for name, set_data in polygon_sets_dict.items():
-        polygon_set = PolygonSet(
-            name=name,
-            description=set_data.get('description', ''),
-            polygons=set_data.get('polygons', [])
-        )
-        db.session.add(polygon_set)
-    
-    db.session.commit()
+    """Load the active polygon set's coordinates, converting to old format for compatibility"""
+    coordinates = polygon_store.active_coordinates()
+    with metrics.span('serialize'):
+        return [coord.to_dict() for coord in coordinates]
+
+def load_polygon_sets(geometry=True):
+    """Load saved polygon sets from database, converting to old format"""
+    return polygon_store.list_sets(geometry=geometry)
+
+# Study payload cache; other workers' coordinate edits show up within STUDY_CACHE_SECONDS
+study_cache = VersionedCache(polygon_store.current_version, float(os.environ.get('STUDY_CACHE_SECONDS', 2)))
+polygon_store.on_change(study_cache.invalidate)
+
+def coordinates_json():
+    """Active coordinates as an HTML-safe JSON string, cached until they change"""
+    return study_cache.get('coordinates_json', lambda: htmlsafe_json_dumps(load_coordinates(), dumps=app.json.dumps))
+
+def label_map():
+    """Active polygons rasterized for hit testing, rebuilt when they change"""
+    return study_cache.get('label_map', lambda: hit_map.LabelMap(polygon_store.active_coordinates()))
 
 @app.route('/')
 def homepage():
@@ -89,8 +92,8 @@ def proceed_to_study():
 
 @app.route('/study')
 def study():
-    coordinates = load_coordinates()
-    return render_template('study.html', stored_coordinates=coordinates)
+    # The page only depends on the coordinates, so the rendered HTML is cached too
+    return study_cache.get('study_html', lambda: render_template('study.html', stored_coordinates_json=coordinates_json()))
 
 @app.route('/admin')
 def admin():
@@ -99,7 +102,8 @@ def admin():
         return redirect(url_for('admin_login'))
     
     coordinates = load_coordinates()
-    polygon_sets = load_polygon_sets()
+    # The page only lists the saved sets; loading one fetches its polygons
+    polygon_sets = load_polygon_sets(geometry=False)
     return render_template('admin.html', stored_coordinates=coordinates, polygon_sets=polygon_sets)
 
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -121,228 +125,754 @@ def admin_logout():
     flash('You have been logged out.')
     return redirect(url_for('admin_login'))
 
-@app.route('/api/coordinates', methods=['GET', 'POST', 'DELETE'])
+# Douglas-Peucker tolerance in pixels for polygons as they are saved; 0 keeps every vertex
+POLYGON_SIMPLIFY_PX = float(os.environ.get('POLYGON_SIMPLIFY_PX', 0))
+
+def apply_coordinate_fields(coord, data):
+    """Copy label/points from request data onto a StoredCoordinate"""
+    if not isinstance(data, dict):
+        raise ValueError('A coordinate must be an object')
+    if 'label' in data:
+        label = data.get('label') or ''
+        if not isinstance(label, str):
+            raise ValueError('label must be a string')
+        coord.label = label
+    if 'points' in data:
+        points = data['points']
+        if not isinstance(points, list):
+            raise ValueError('points must be a list')
+        if POLYGON_SIMPLIFY_PX > 0:
+            points = geometry.simplify(points, POLYGON_SIMPLIFY_PX)
+        coord.points = points
+
+def new_coordinate(data):
+    """An unsaved coordinate row from request data; the database assigns its id when added"""
+    if not isinstance(data, dict):
+        raise ValueError('A coordinate must be an object')
+    if not isinstance(data.get('points'), list):
+        raise ValueError('points is required')
+    coord = StoredCoordinate(label='', points=[])
+    apply_coordinate_fields(coord, data)
+    return coord
+
+@app.route('/api/coordinates', methods=['GET', 'POST', 'PATCH', 'DELETE'])
 def api_coordinates():
     if request.method == 'GET':
-        return jsonify(load_coordinates())
+        etag = f'coordinates-{study_cache.version()}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(coordinates_json(), mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
     
     elif request.method == 'POST':
-        data = request.get_json()
-        coordinates = load_coordinates()
-        coordinates.append(data)
-        save_coordinates(coordinates)
-        return jsonify({'success': True, 'id': len(coordinates)})
+        data = request.get_json() or {}
+        try:
+            coord = polygon_store.add_coordinate(new_coordinate(data))
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        return jsonify({'success': True, 'id': coord.id, 'coordinate': coord.to_dict()})
+    
+    elif request.method == 'PATCH':
+        # Bulk edit: {"create": [...], "update": [{"id": ..., ...}], "delete": [ids]}
+        data = request.get_json() or {}
+        if not isinstance(data, dict) or not all(isinstance(data.get(field, []), list) for field in ('create', 'update', 'delete')):
+            return jsonify({'error': 'Invalid bulk edit: expected lists under create, update and delete'}), 400
+        try:
+            created = polygon_store.add_coordinates([new_coordinate(item) for item in data.get('create', [])])
+            
+            updated = []
+            for item in data.get('update', []):
+                coord = polygon_store.writable_coordinate(int(item['id']))
+                if coord is None:
+                    db.session.rollback()
+                    return jsonify({'error': f"Coordinate not found: {item['id']}"}), 404
+                apply_coordinate_fields(coord, item)
+                updated.append(coord)
+            
+            deleted = polygon_store.remove_coordinates([int(i) for i in data.get('delete', [])])
+        except (ValueError, KeyError, TypeError) as e:
+            db.session.rollback()
+            return jsonify({'error': f'Invalid bulk edit: {e}'}), 400
+        
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'created': [coord.to_dict() for coord in created],
+            'updated': [coord.to_dict() for coord in updated],
+            'deleted': deleted
+        })
     
     elif request.method == 'DELETE':
         polygon_id = request.args.get('id')
         if polygon_id:
-            coordinates = load_coordinates()
-            coordinates = [c for c in coordinates if c.get('id') != int(polygon_id)]
-            save_coordinates(coordinates)
-            return jsonify({'success': True})
+            polygon_store.remove_coordinates([int(polygon_id)])
         else:
             # Delete all
-            save_coordinates([])
-            return jsonify({'success': True})
+            polygon_store.clear_coordinates()
+        db.session.commit()
+        return jsonify({'success': True})
+
+@app.route('/api/coordinates/<int:coordinate_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
+def api_coordinate(coordinate_id):
+    if polygon_store.get_active_coordinate(coordinate_id) is None:
+        return jsonify({'error': 'Coordinate not found'}), 404
+    
+    if request.method == 'GET':
+        return jsonify(polygon_store.get_active_coordinate(coordinate_id).to_dict())
+    
+    elif request.method in ('PUT', 'PATCH'):
+        # The id changes if a saved set still references the old row
+        coord = polygon_store.writable_coordinate(coordinate_id)
+        try:
+            apply_coordinate_fields(coord, request.get_json() or {})
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        db.session.commit()
+        return jsonify({'success': True, 'id': coord.id, 'coordinate': coord.to_dict()})
+    
+    elif request.method == 'DELETE':
+        polygon_store.remove_coordinates([coordinate_id])
+        db.session.commit()
+        return jsonify({'success': True})
 
 @app.route('/api/polygon-sets', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def api_polygon_sets():
     if request.method == 'GET':
-        return jsonify(load_polygon_sets())
+        # geometry=0 lists the sets with polygon counts only
+        return jsonify(load_polygon_sets(geometry=request.args.get('geometry') != '0'))
     
-    elif request.method == 'POST':
-        # Save current coordinates as a new polygon set
-        data = request.get_json()
-        set_name = data.get('name')
-        if not set_name:
-            return jsonify({'error': 'Set name is required'}), 400
-        
-        coordinates = load_coordinates()
-        polygon_sets = load_polygon_sets()
-        
-        polygon_sets[set_name] = {
-            'name': set_name,
-            'polygons': coordinates,
-            'created_at': data.get('created_at'),
-            'description': data.get('description', '')
-        }
-        
-        save_polygon_sets(polygon_sets)
-        return jsonify({'success': True, 'set_name': set_name})
-    
-    elif request.method == 'PUT':
-        # Load a polygon set into current coordinates
-        data = request.get_json()
-        set_name = data.get('name')
-        if not set_name:
-            return jsonify({'error': 'Set name is required'}), 400
+    try:
+        if request.method == 'POST':
+            # Save the active polygons as a new immutable set (by reference)
+            data = request.get_json()
+            set_name = data.get('name')
+            if not set_name:
+                return jsonify({'error': 'Set name is required'}), 400
+            
+            created_at = data.get('created_at')
+            if created_at:
+                try:
+                    created_at = exports.parse_timestamp(created_at)
+                except (AttributeError, ValueError):
+                    return jsonify({'error': 'created_at must be an ISO timestamp'}), 400
+            polygon_set = polygon_store.save_set(set_name, data.get('description', ''), created_at)
+            db.session.commit()
+            return jsonify({'success': True, 'set_name': set_name, 'version': polygon_set.version})
         
-        polygon_sets = load_polygon_sets()
-        if set_name not in polygon_sets:
-            return jsonify({'error': 'Set not found'}), 404
+        elif request.method == 'PUT':
+            # Activate a polygon set for the study (a single pointer update)
+            data = request.get_json()
+            set_name = data.get('name')
+            if not set_name:
+                return jsonify({'error': 'Set name is required'}), 400
+            
+            polygon_store.activate_set(set_name)
+            db.session.commit()
+            return jsonify({'success': True, 'coordinates': load_coordinates()})
         
-        coordinates = polygon_sets[set_name]['polygons']
-        save_coordinates(coordinates)
-        return jsonify({'success': True, 'coordinates': coordinates})
-    
-    elif request.method == 'DELETE':
-        # Delete a polygon set
-        set_name = request.args.get('name')
-        if not set_name:
-            return jsonify({'error': 'Set name is required'}), 400
-        
-        polygon_sets = load_polygon_sets()
-        if set_name in polygon_sets:
-            del polygon_sets[set_name]
-            save_polygon_sets(polygon_sets)
+        elif request.method == 'DELETE':
+            # Delete a polygon set
+            set_name = request.args.get('name')
+            if not set_name:
+                return jsonify({'error': 'Set name is required'}), 400
+            
+            polygon_store.delete_set(set_name)
+            db.session.commit()
             return jsonify({'success': True})
-        else:
-            return jsonify({'error': 'Set not found'}), 404
+    except polygon_store.SetError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), e.status
+
+# Fraction of pixels that receive noise
+NOISE_DENSITY = 0.15
 
-def generate_processed_image(brightness=1.0, noise_intensity=0.4):
+def generate_processed_image(brightness=1.0, noise_intensity=0.4, stimulus_id=DEFAULT_STIMULUS, rng=None, out=None, size=None):
     """
     Generate image with custom brightness and noise
     """
-    # Read the original image
-    img_path = 'static/images/Computer_Room_Desk_2008.jpg'
-    img = cv2.imread(img_path)
-    if img is None:
+    # Brightness-adjusted frame (resized to size, if given) comes from the decoded stimulus cache
+    with metrics.span('decode'):
+        img_bright = stimuli.get_brightened(stimulus_id, brightness, size=size)
+    if img_bright is None:
         return None
     
-    # Apply brightness adjustment
-    img_float = img.astype(np.float32)
-    img_bright = img_float * brightness
-    img_bright = np.clip(img_bright, 0, 255).astype(np.uint8)
+    # Add noise to 15% of pixels
+    with metrics.span('render'):
+        return noise_kernel.render_visual_snow(img_bright, 1.0, noise_intensity, density=NOISE_DENSITY, rng=rng, out=out)
+
+def finite_arg(args, name, default):
+    """A float query parameter; ValueError unless it is a finite number"""
+    value = float(args.get(name, default))
+    if not math.isfinite(value):
+        raise ValueError(f'{name} must be a finite number')
+    return value
+
+def parse_render_args(args, default_format='jpeg'):
+    """
+    Parse the shared image parameters of the generate/stream endpoints.
     
-    # Add noise
-    height, width, channels = img_bright.shape
-    noise = np.random.randint(0, 256, (height, width, channels), dtype=np.uint8)
-    noise_mask = np.random.random((height, width)) < 0.15  # 15% of pixels get noise
+    Returns (key, seed) where key is (stimulus, brightness, noise, size,
+    format, quality). Raises ValueError for bad values and
+    StimulusNotFound for unknown images.
+    """
+    stimulus_id = args.get('image', DEFAULT_STIMULUS)
+    brightness = quantize(finite_arg(args, 'brightness', 1.0))
+    noise = quantize(finite_arg(args, 'noise', 0.4))
+    width = args.get('width', type=int)
+    max_dim = args.get('max_dim', type=int)
+    fmt = image_codec.parse_format(args.get('format', default_format))
+    quality = image_codec.parse_quality(args.get('quality'))
+    seed = args.get('seed')
+    if seed is not None:
+        if not seed.isdigit():
+            raise ValueError('Seed must be a non-negative integer')
+        seed = int(seed)
     
-    final_noise = np.zeros_like(img_bright)
-    for i in range(channels):
-        final_noise[:, :, i] = noise[:, :, i] * noise_mask
+    # Resolve the output size first so noise is generated at that resolution
+    size = stimuli.output_size(stimulus_id, width=width, max_dim=max_dim)
+    return (stimulus_id, brightness, noise, size, fmt, quality), seed
+
+def render_encoded_image(key, seed=None):
+    """Render and encode one frame for a parse_render_args() key"""
+    stimulus_id, brightness, noise, size, fmt, quality = key
+    with metrics.span('decode'):
+        frame = stimuli.get_frame(stimulus_id, size)
+    if frame is None:
+        return None
     
-    # Blend noise with image
-    img_float = img_bright.astype(np.float32)
-    noise_float = final_noise.astype(np.float32)
-    noisy_img = img_float + (noise_float * noise_intensity)
-    noisy_img = np.clip(noisy_img, 0, 255).astype(np.uint8)
+    # The frame buffer is reused by this thread once the bytes are encoded
+    processed_img = generate_processed_image(brightness, noise, stimulus_id, rng=seed, out=noise_kernel.thread_buffer(frame.shape), size=size)
+    with metrics.span('encode'):
+        return image_codec.encode(processed_img, fmt, quality)
+
+# Noisy frames are pre-rendered in the background; FRAME_POOL_SIZE=0 disables the pool
+frame_pool = FramePool(
+    render_encoded_image,
+    pool_size=int(os.environ.get('FRAME_POOL_SIZE', 8)),
+    max_bytes=int(os.environ.get('FRAME_POOL_MB', 64)) * 1024 * 1024,
+    max_pools=int(os.environ.get('FRAME_POOL_KEYS', 32)),
+    max_queue=int(os.environ.get('FRAME_POOL_QUEUE', 64))
+)
+
+# Seeded renders are deterministic, so their encoded bytes can be reused
+encoded_cache = FrameCache(int(os.environ.get('ENCODED_CACHE_MB', 64)) * 1024 * 1024, sizeof=len)
+
+# Seeded frames never change for a given URL (the stimulus mtime is part of the ETag)
+SEEDED_MAX_AGE = 365 * 24 * 3600
+
+# Request threads per worker; gunicorn.conf.py reads the same setting
+REQUEST_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Open streams and requests waiting on renders each hold a request thread
+# for a long time, so together they get all but one of them and
+# submissions, telemetry and admin routes are always served. Streams are
+# capped first, leaving at least one render waiter.
+LONG_REQUEST_BUDGET = max(1, REQUEST_THREADS - 1)
+STREAM_MAX_CONCURRENT = max(0, min(int(os.environ.get('STREAM_MAX_CONCURRENT', 4)), LONG_REQUEST_BUDGET - 1))
+
+# Renders for requests run on RENDER_WORKERS threads per process, with at most
+# RENDER_QUEUE waiting to start and RENDER_MAX_WAITERS requests (coalesced
+# ones included) blocked on them; past that image requests get a 503 straight
+# away
+RENDER_MAX_WAITERS = max(1, min(
+    int(os.environ.get('RENDER_MAX_WAITERS', max(1, REQUEST_THREADS // 2))),
+    LONG_REQUEST_BUDGET - STREAM_MAX_CONCURRENT
+))
+render_executor = RenderExecutor(
+    workers=int(os.environ.get('RENDER_WORKERS', max(1, REQUEST_THREADS // 4))),
+    max_queue=int(os.environ.get('RENDER_QUEUE', RENDER_MAX_WAITERS)),
+    max_waiters=RENDER_MAX_WAITERS
+)
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 10))
+
+def offload_render(render, cache_key=None):
+    """
+    Run render() (returning encoded bytes) on the render executor. With
+    cache_key, identical concurrent requests share one render and the
+    result is stored in encoded_cache even if every waiter has timed out,
+    so a retry finds it.
+    """
+    route = metrics.current_route()
+    
+    def job():
+        with metrics.detached(route) as timings:
+            img_bytes = render()
+        if img_bytes is not None and cache_key is not None:
+            encoded_cache.put(cache_key, img_bytes)
+        return img_bytes, timings
     
-    return noisy_img
+    img_bytes, timings = render_executor.submit(job, key=cache_key, timeout=RENDER_TIMEOUT)
+    metrics.add_timings(timings)
+    return img_bytes
+
+def render_unavailable(error):
+    message = 'Image renderer is busy' if isinstance(error, Saturated) else 'Image render timed out'
+    response = jsonify({'error': f'{message}, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def immutable_image(cache_key, render, mimetype):
+    """
+    Response for an image fully determined by cache_key (which must include
+    the stimulus version), cached here and by browsers indefinitely
+    """
+    # A matching If-None-Match can be answered before rendering anything
+    etag = hashlib.sha1(repr(cache_key).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        img_bytes = encoded_cache.get(cache_key)
+        if img_bytes is None:
+            try:
+                img_bytes = offload_render(render, cache_key=cache_key)
+            except (Saturated, DeadlineExceeded) as e:
+                return render_unavailable(e)
+            if img_bytes is None:
+                return jsonify({'error': 'Could not process image'}), 500
+        response = Response(img_bytes, mimetype=mimetype)
+    
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = SEEDED_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/stimuli')
+def list_stimuli():
+    """List the stimulus ids that can be passed to /api/generate-image"""
+    return jsonify({'default': DEFAULT_STIMULUS, 'stimuli': stimuli.ids()})
 
 @app.route('/api/generate-image')
 def generate_image():
-    brightness = float(request.args.get('brightness', 1.0))
-    noise = float(request.args.get('noise', 0.4))
+    try:
+        key, seed = parse_render_args(request.args)
+        version = stimuli.version(key[0])
+    except StimulusNotFound as e:
+        return jsonify({'error': f'Unknown image: {e.args[0]}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    mimetype = image_codec.mimetype(key[4])
     
-    processed_img = generate_processed_image(brightness, noise)
-    if processed_img is None:
+    if seed is None:
+        # Serve a pre-rendered frame when one is ready, otherwise render inline
+        img_bytes = frame_pool.get(key)
+        if img_bytes is None:
+            try:
+                img_bytes = offload_render(lambda: render_encoded_image(key))
+            except (Saturated, DeadlineExceeded) as e:
+                return render_unavailable(e)
+            if img_bytes is None:
+                return jsonify({'error': 'Could not process image'}), 500
+            frame_pool.offer(key, img_bytes)
+        
+        response = Response(img_bytes, mimetype=mimetype)
+        response.cache_control.no_store = True
+        return response
+    
+    # Seeded frames are identified by their parameters alone
+    return immutable_image(key + (version, seed), lambda: render_encoded_image(key, seed=seed), mimetype)
+
+# Animated snow streams: per-stream frame rate cap, CPU share of one core,
+# maximum duration and the number of concurrent streams per worker
+STREAM_MAX_FPS = float(os.environ.get('STREAM_MAX_FPS', 15))
+STREAM_CPU_BUDGET = float(os.environ.get('STREAM_CPU_BUDGET', 0.25))
+STREAM_MAX_SECONDS = float(os.environ.get('STREAM_MAX_SECONDS', 300))
+stream_limiter = StreamLimiter(STREAM_MAX_CONCURRENT)
+
+@app.route('/api/stream')
+def stream_image():
+    """Stream animated visual snow as multipart/x-mixed-replace JPEG frames"""
+    try:
+        fps = float(request.args.get('fps', STREAM_MAX_FPS))
+    except ValueError:
+        return jsonify({'error': 'fps must be a number'}), 400
+    if not math.isfinite(fps):
+        return jsonify({'error': 'fps must be finite'}), 400
+    fps = min(max(fps, 1.0), STREAM_MAX_FPS)
+    try:
+        key, seed = parse_render_args(request.args)
+        stimulus_id, brightness, noise, size, fmt, quality = key
+        base = stimuli.get_brightened(stimulus_id, brightness, size=size)
+    except StimulusNotFound as e:
+        return jsonify({'error': f'Unknown image: {e.args[0]}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if fmt != 'jpeg':
+        return jsonify({'error': 'Streams are only available as JPEG'}), 400
+    if base is None:
         return jsonify({'error': 'Could not process image'}), 500
     
-    # Encode image to memory buffer
-    success, img_encoded = cv2.imencode('.jpg', processed_img)
-    if not success:
-        return jsonify({'error': 'Could not encode image'}), 500
+    if not stream_limiter.acquire():
+        response = jsonify({'error': 'Too many active streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+    
+    # Only the noise layer is regenerated per frame, into this stream's own buffer
+    rng = noise_kernel.make_rng(seed)
+    frame = np.empty_like(base)
     
-    # Create BytesIO object
-    img_buffer = BytesIO(img_encoded.tobytes())
-    img_buffer.seek(0)
+    def render_frame():
+        noise_kernel.render_visual_snow(base, 1.0, noise, rng=rng, out=frame)
+        return image_codec.encode(frame, fmt, quality)
     
-    return send_file(img_buffer, mimetype='image/jpeg', as_attachment=False)
+    response = Response(
+        mjpeg_stream(render_frame, fps, STREAM_MAX_SECONDS, STREAM_CPU_BUDGET),
+        mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}'
+    )
+    response.call_on_close(stream_limiter.release)
+    response.cache_control.no_store = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+SUBMIT_BATCH_MAX = int(os.environ.get('SUBMIT_BATCH_MAX', 500))
+SUBMIT_TIMEOUT = float(os.environ.get('SUBMIT_TIMEOUT', 10))
+
+def write_submissions(sessions):
+    """Insert sessions in one transaction; (id, created) per session"""
+    try:
+        results = submissions.insert_sessions(sessions)
+        with metrics.span('commit'):
+            db.session.commit()
+        return results
+    except Exception:
+        db.session.rollback()
+        raise
+
+def flush_submissions(sessions):
+    # Runs on the buffer's thread, which has no app context of its own
+    with app.app_context():
+        return write_submissions(sessions)
+
+# Write-behind buffering of single submissions (off by default): requests
+# arriving within SUBMIT_BUFFER_MS of each other share one INSERT and COMMIT
+SUBMIT_BUFFER_MS = float(os.environ.get('SUBMIT_BUFFER_MS', 0))
+submission_buffer = submissions.SubmissionBuffer(
+    flush_submissions,
+    max_delay=SUBMIT_BUFFER_MS / 1000.0,
+    max_items=int(os.environ.get('SUBMIT_BUFFER_MAX', 100))
+) if SUBMIT_BUFFER_MS > 0 else None
 
 @app.route('/api/submit-score', methods=['POST'])
 def submit_score():
     try:
-        data = request.get_json()
-        
-        # Validate required fields
-        required_fields = ['username', 'score', 'time', 'clicks', 'foundObjects', 'targetObjects']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # Extract questionnaire data
-        questionnaire = data.get('questionnaire', {})
-        
-        # Create new study session record
-        session = StudySession(
-            username=data['username'],
-            score=data['score'],
-            time_ms=data['time'],
-            clicks=data['clicks'],
-            found_objects=data['foundObjects'],
-            target_objects=data['targetObjects'],
-            image_mode=data.get('imageMode', 'normal'),
-            frustrated=questionnaire.get('frustrated'),
-            challenged=questionnaire.get('challenged'),
-            happy=questionnaire.get('happy'),
-            angry=questionnaire.get('angry'),
-            upset=questionnaire.get('upset'),
-            defeated=questionnaire.get('defeated'),
-            content=questionnaire.get('content'),
-            joyful=questionnaire.get('joyful'),
-            heard_visual_snow=questionnaire.get('heardVisualSnow'),
-            have_visual_snow=questionnaire.get('haveVisualSnow')
-        )
-        
-        db.session.add(session)
-        db.session.commit()
-        
-        # Mark test as completed in session
-        from flask import session as flask_session
-        flask_session['test_completed'] = True
-        
-        return jsonify({'success': True, 'message': 'Study data submitted successfully'})
+        session = submissions.session_from_payload(request.get_json())
+    except submissions.SubmissionError as e:
+        return jsonify({'error': str(e)}), 400
     
+    try:
+        if submission_buffer is not None:
+            session_id, created = submission_buffer.submit(session, SUBMIT_TIMEOUT)
+        else:
+            session_id, created = write_submissions([session])[0]
+    except TimeoutError:
+        # The write may still land; a retry with the same idempotency key is safe
+        return jsonify({'error': 'Submission not confirmed in time, please retry'}), 503, {'Retry-After': '1'}
     except Exception as e:
-        db.session.rollback()
         print(f"Error submitting score: {e}")
         return jsonify({'error': 'Failed to submit study data'}), 500
+    
+    # Mark test as completed in session
+    from flask import session as flask_session
+    flask_session['test_completed'] = True
+    
+    return jsonify({
+        'success': True,
+        'message': 'Study data submitted successfully',
+        'id': session_id,
+        'duplicate': not created
+    })
+
+@app.route('/api/submit-scores', methods=['POST'])
+def submit_scores():
+    """
+    Store many sessions at once, e.g. results collected offline in a lab.
+    
+    Body: {"sessions": [...]} (or a bare array), each item shaped like a
+    /api/submit-score payload, ideally with its own idempotencyKey. Valid
+    items are inserted in one transaction; each gets a result entry with
+    status created, duplicate or invalid.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('sessions') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a list of sessions'}), 400
+    if len(items) > SUBMIT_BATCH_MAX:
+        return jsonify({'error': f'At most {SUBMIT_BATCH_MAX} sessions per request'}), 413
+    
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, submissions.session_from_payload(item)))
+        except submissions.SubmissionError as e:
+            results[index] = {'status': 'invalid', 'error': str(e)}
+    
+    try:
+        stored = write_submissions([session for _, session in valid]) if valid else []
+    except Exception as e:
+        print(f"Error submitting scores: {e}")
+        return jsonify({'error': 'Failed to submit study data'}), 500
+    
+    for (index, _), (session_id, created) in zip(valid, stored):
+        results[index] = {'status': 'created' if created else 'duplicate', 'id': session_id}
+    return jsonify({
+        'success': True,
+        'created': sum(1 for result in results if result['status'] == 'created'),
+        'results': results
+    })
+
+TELEMETRY_MAX_EVENTS = int(os.environ.get('TELEMETRY_MAX_EVENTS', 5000))
+
+def write_telemetry(rows):
+    try:
+        telemetry.write_chunks(rows)
+        with metrics.span('commit'):
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+def flush_telemetry(rows):
+    # Runs on the buffer's thread, which has no app context of its own
+    with app.app_context():
+        write_telemetry(rows)
+
+# Telemetry is written behind by default: batches arriving within
+# TELEMETRY_BUFFER_MS of each other share one INSERT and COMMIT
+TELEMETRY_BUFFER_MS = float(os.environ.get('TELEMETRY_BUFFER_MS', 500))
+telemetry_buffer = telemetry.TelemetryBuffer(
+    flush_telemetry,
+    max_delay=TELEMETRY_BUFFER_MS / 1000.0,
+    max_pending=int(os.environ.get('TELEMETRY_QUEUE_MAX', 10000)),
+    on_drop=lambda count: metrics.registry.increment(metrics.TELEMETRY_DROPPED_METRIC, {}, count)
+) if TELEMETRY_BUFFER_MS > 0 else None
+
+@app.route('/api/telemetry', methods=['POST'])
+def ingest_telemetry():
+    """
+    Store a batch of click / pointer-move events from the study page.
+    
+    Body: {"sessionKey": <the submission's idempotencyKey>, "seq": n,
+    "t": [...], "x": [...], "y": [...], "kind": [...], "polygon": [...]},
+    one entry per event in each list (see telemetry.py). Resending a
+    batch with the same seq is harmless.
+    """
+    # sendBeacon posts as text/plain, so parse whatever the content type
+    try:
+        row = telemetry.chunk_from_payload(request.get_json(force=True, silent=True), TELEMETRY_MAX_EVENTS)
+    except telemetry.TelemetryError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    if telemetry_buffer is not None:
+        if not telemetry_buffer.add(row):
+            return jsonify({'error': 'Telemetry queue full, please retry'}), 503, {'Retry-After': '5'}
+        return jsonify({'success': True, 'events': row['event_count']}), 202
+    try:
+        write_telemetry([row])
+    except Exception as e:
+        print(f"Error storing telemetry: {e}")
+        return jsonify({'error': 'Failed to store telemetry'}), 500
+    return jsonify({'success': True, 'events': row['event_count']})
+
+@app.route('/api/telemetry/<session_key>')
+@app.route('/api/admin/results/<int:session_id>/telemetry')
+def read_telemetry(session_key=None, session_id=None):
+    """A participant's events in order, streamed as NDJSON (admin only)"""
+    if not session.get('admin_authenticated'):
+        return jsonify({'error': 'Authentication required'}), 401
+    if session_id is not None:
+        study_session = db.session.get(StudySession, session_id)
+        session_key = study_session.idempotency_key if study_session else None
+    if session_key is None or telemetry.session_chunks(session_key).first() is None:
+        return jsonify({'error': 'No telemetry for this session'}), 404
+    
+    chunks = exports.encode_chunks(telemetry.ndjson_events(session_key))
+    response = Response(stream_with_context(chunks), mimetype=exports.MIMETYPES['ndjson'])
+    response.headers['Content-Disposition'] = 'attachment; filename=telemetry.ndjson'
+    return response
+
+VALIDATE_MAX_POINTS = int(os.environ.get('VALIDATE_MAX_POINTS', 100000))
+
+@app.route('/api/validate-clicks', methods=['POST'])
+def validate_clicks():
+    """
+    Hit-test click points against the active polygons.
+    
+    Body: {"points": [{"x": .., "y": ..}, ...], "targets": [ids]} for one
+    click sequence, or {"sessions": [{"points": [...], "targets": [...]}, ...]}
+    to audit many at once. Each gets the polygon ids hit by every point and,
+    when targets are given, the targets found and the resulting score.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    batch = 'sessions' in data
+    items = data['sessions'] if batch else [data]
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'sessions must be a list of objects'}), 400
+    
+    try:
+        parsed = [hit_map.parse_points(item.get('points', [])) for item in items]
+        targets = [[int(t) for t in item['targets']] if item.get('targets') is not None else None for item in items]
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    total = sum(len(xs) for xs, _ in parsed)
+    if total > VALIDATE_MAX_POINTS:
+        return jsonify({'error': f'At most {VALIDATE_MAX_POINTS} points per request'}), 413
+    
+    # One lookup for every point in the request
+    xs = np.concatenate([xs for xs, _ in parsed]) if parsed else np.zeros(0, dtype=np.int64)
+    ys = np.concatenate([ys for _, ys in parsed]) if parsed else np.zeros(0, dtype=np.int64)
+    hits = label_map().lookup(xs, ys)
+    
+    results = []
+    start = 0
+    for (item_xs, _), item_targets in zip(parsed, targets):
+        item_hits = hits[start:start + len(item_xs)]
+        start += len(item_xs)
+        result = {'hits': item_hits}
+        if item_targets is not None:
+            found, score = hit_map.replay(item_hits, item_targets)
+            result['found'] = found
+            result['score'] = score
+        results.append(result)
+    
+    response = {'coordinatesVersion': study_cache.version()}
+    if batch:
+        response['results'] = results
+    else:
+        response.update(results[0])
+    return jsonify(response)
 
 @app.route('/api/export-data')
 def export_data():
-    """Export all study data as JSON (for research analysis)"""
+    """
+    Export study data for research analysis, streamed row by row.
+    
+    format: json (default), ndjson or csv; parquet, arrow (need pyarrow)
+        or npz for columnar analysis
+    since / until: ISO timestamps bounding the session time
+    after_id: only sessions with a larger id, in id order (incremental pulls)
+    image_mode, username + username_mode: as for /api/admin/results
+    gzip=1: compress the stream
+    """
     try:
-        sessions = StudySession.query.order_by(StudySession.timestamp.desc()).all()
-        data = [session.to_dict() for session in sessions]
-        return jsonify(data)
+        fmt = request.args.get('format', 'json')
+        if fmt not in exports.SERIALIZERS and fmt not in exports.COLUMNAR_FORMATS:
+            return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+        query = exports.session_query(
+            since=exports.parse_timestamp(request.args.get('since')),
+            until=exports.parse_timestamp(request.args.get('until')),
+            after_id=request.args.get('after_id', type=int),
+            image_mode=request.args.get('image_mode'),
+            username=request.args.get('username'),
+            username_mode=request.args.get('username_mode', 'contains')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid export parameters'}), 400
+    
+    if fmt in exports.COLUMNAR_FORMATS:
+        # Columnar files need their footer written last, so they are built
+        # chunk by chunk into a spooled temp file and then sent
+        try:
+            output = exports.write_columnar(query, fmt)
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 501
+        mimetype, extension = exports.COLUMNAR_FORMATS[fmt]
+        return send_file(output, mimetype=mimetype, as_attachment=True,
+                         download_name=f'visual_snow_study.{extension}')
+    
+    chunks = exports.encode_chunks(exports.SERIALIZERS[fmt](exports.iter_sessions(query)))
+    compress = request.args.get('gzip') == '1'
+    if compress:
+        chunks = exports.gzip_chunks(chunks)
+    
+    response = Response(stream_with_context(chunks), mimetype=exports.MIMETYPES[fmt])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    if fmt != 'json':
+        response.headers['Content-Disposition'] = f'attachment; filename=visual_snow_study.{fmt}'
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request and span latency histograms of all workers, Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stats')
+def study_stats():
+    """
+    Summary statistics grouped by image_mode, have_visual_snow and both:
+    count, mean/variance/std of score, time_ms, clicks and found ratio,
+    and the answer distribution of each Likert item. Read from rollup
+    tables, so the cost does not grow with the number of sessions.
+    """
+    try:
+        return jsonify({'success': True, 'groups': stats.summary()})
     except Exception as e:
-        return jsonify({'error': 'Failed to export data'}), 500
+        print(f"Error loading stats: {e}")
+        return jsonify({'error': 'Failed to load statistics'}), 500
+
+@app.cli.command('recompute-stats')
+def recompute_stats_command():
+    """Rebuild the statistics rollups from all study sessions."""
+    sessions, group_count = stats.recompute()
+    print(f"Recomputed statistics from {sessions} sessions into {group_count} groups")
 
 @app.route('/api/admin/results')
 def admin_results():
+    """
+    Study results for the admin interface, newest first, one page at a time.
+    
+    limit: page size (default 100, max 500)
+    cursor: next_cursor from the previous page
+    image_mode: exact match
+    username + username_mode: contains (default, case-insensitive), prefix or exact
+    
+    The total is only estimated on the first page (cursor absent).
+    """
     # Check if user is authenticated for API access
     if not session.get('admin_authenticated'):
         return jsonify({'error': 'Authentication required'}), 401
-    """Get study results for admin interface"""
     try:
-        # Get query parameters for filtering
-        image_mode = request.args.get('image_mode')
-        username = request.args.get('username')
-        
-        # Build query
-        query = StudySession.query
-        
-        if image_mode:
-            query = query.filter(StudySession.image_mode == image_mode)
-        
-        if username:
-            query = query.filter(StudySession.username.ilike(f'%{username}%'))
-        
-        # Get results ordered by most recent first
-        sessions = query.order_by(StudySession.timestamp.desc()).all()
-        data = [session.to_dict() for session in sessions]
-        
-        return jsonify({
+        query = results_query.filtered_query(
+            image_mode=request.args.get('image_mode'),
+            username=request.args.get('username'),
+            username_mode=request.args.get('username_mode', 'contains')
+        )
+        limit = results_query.parse_limit(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        sessions, next_cursor = results_query.page(query, limit=limit, cursor=cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        with metrics.span('serialize'):
+            results = [session.to_dict() for session in sessions]
+        data = {
             'success': True,
-            'count': len(data),
-            'results': data
-        })
+            'count': len(sessions),
+            'results': results,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if cursor is None:
+            data['total'], data['total_exact'] = results_query.estimate_count(query)
+        return jsonify(data)
     except Exception as e:
         return jsonify({'error': 'Failed to load results'}), 500
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
+        stats.recompute_if_empty()
+        polygon_store.pack_legacy_points()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Database-backed benchmarks: coordinate save/load at 10-10,000 polygons,
+and export / admin / stats endpoints at 1k sessions and up.
+
+Runs against a throwaway SQLite file by default. --database-url points it
+at another database (e.g. a local Postgres); every table in it is dropped
+and recreated, so the script refuses to touch one that already holds
+study sessions unless --reset is given.
+
+    python benchmarks/bench_db.py [--quick] [--max-sessions 1000000]
+    python benchmarks/bench_db.py --database-url postgresql://localhost/vs_bench --reset
+"""
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+
+from common import measure, print_result, result, save_results, use_database
+
+POLYGON_COUNTS = [10, 100, 1000, 10000]
+SESSION_COUNTS = [1000, 10000, 100000, 1000000]
+EXPORT_FORMATS = ['json', 'ndjson', 'csv', 'npz']
+
+
+def random_polygon(rng):
+    cx, cy = rng.uniform(50, 750), rng.uniform(50, 550)
+    return [[round(cx + rng.uniform(-40, 40), 1), round(cy + rng.uniform(-40, 40), 1)] for _ in range(8)]
+
+
+def session_rows(rng, start, count):
+    base = datetime(2025, 1, 1)
+    for i in range(start, start + count):
+        yield {
+            'username': f'participant{rng.randrange(5000)}',
+            'score': rng.randrange(6), 'time_ms': rng.randrange(5000, 120000), 'clicks': rng.randrange(1, 30),
+            'found_objects': rng.randrange(6), 'target_objects': 5,
+            'image_mode': rng.choice(['normal', 'visual_snow']),
+            'timestamp': base + timedelta(seconds=i * 37),
+            **{item: rng.randrange(1, 6) for item in
+               ['frustrated', 'challenged', 'happy', 'angry', 'upset', 'defeated', 'content', 'joyful']},
+            'heard_visual_snow': rng.choice(['yes', 'no']), 'have_visual_snow': rng.choice(['yes', 'no']),
+            'idempotency_key': f'bench-{i}',
+        }
+
+
+def bench_coordinates(app, client, counts, repeat):
+    import polygon_store
+    from app import load_coordinates, study_cache
+    from database import db
+
+    rng = random.Random(1)
+    results = []
+    for count in counts:
+        with app.app_context():
+            polygon_store.clear_coordinates()
+            db.session.commit()
+        body = {'create': [{'label': f'object {i}', 'points': random_polygon(rng)} for i in range(count)]}
+
+        def save():
+            response = client.patch('/api/coordinates', json=body)
+            assert response.status_code == 200, response.data
+        stats = measure(save, repeat=1, warmup=0)
+        results.append(result(f'coordinates/save/{count}', stats, params={'polygons': count}))
+
+        def load():
+            with app.app_context():
+                load_coordinates()
+        results.append(result(f'coordinates/load/{count}', measure(load, repeat=repeat), params={'polygons': count}))
+
+        def get_uncached():
+            study_cache.clear()
+            client.get('/api/coordinates')
+        results.append(result(f'coordinates/get-uncached/{count}', measure(get_uncached, repeat=repeat), params={'polygons': count}))
+        results.append(result(f'coordinates/get-cached/{count}', measure(lambda: client.get('/api/coordinates'), repeat=repeat), params={'polygons': count}))
+
+        names = iter(range(1_000_000))
+
+        def save_set():
+            response = client.post('/api/polygon-sets', json={'name': f'bench-{count}-{next(names)}'})
+            assert response.status_code == 200, response.data
+        results.append(result(f'polygon-sets/save/{count}', measure(save_set, repeat=3, warmup=0), params={'polygons': count}))
+        for entry in results[-5:]:
+            print_result(entry)
+    return results
+
+
+def bench_sessions(app, client, counts, repeat):
+    import stats
+    from database import db, StudySession
+
+    rng = random.Random(2)
+    results = []
+    stored = 0
+    for count in counts:
+        with app.app_context():
+            while stored < count:
+                batch = min(10000, count - stored)
+                db.session.execute(db.insert(StudySession.__table__), list(session_rows(rng, stored, batch)))
+                stored += batch
+            db.session.commit()
+            recompute = measure(stats.recompute, repeat=1, warmup=0)
+        results.append(result(f'stats/recompute/{count}', recompute, params={'sessions': count}))
+
+        runs = max(1, repeat if count <= 10000 else 3 if count <= 100000 else 1)
+        for fmt in EXPORT_FORMATS:
+            def export():
+                response = client.get(f'/api/export-data?format={fmt}')
+                size = len(response.get_data())
+                assert response.status_code == 200, response.status_code
+                return size
+            size = export()
+            stats_ = measure(export, repeat=runs, warmup=0)
+            results.append(result(
+                f'export/{fmt}/{count}', stats_, params={'sessions': count, 'format': fmt},
+                bytes=size, rows_per_second=count / stats_['p50']
+            ))
+
+        with client.session_transaction() as flask_session:
+            flask_session['admin_authenticated'] = True
+        results.append(result(f'admin-results/first-page/{count}',
+                              measure(lambda: client.get('/api/admin/results'), repeat=repeat), params={'sessions': count}))
+        results.append(result(f'admin-results/prefix-search/{count}',
+                              measure(lambda: client.get('/api/admin/results?username=participant12'), repeat=repeat),
+                              params={'sessions': count}))
+        results.append(result(f'stats/summary/{count}', measure(lambda: client.get('/api/stats'), repeat=repeat),
+                              params={'sessions': count}))
+        for entry in results[-(len(EXPORT_FORMATS) + 4):]:
+            print_result(entry)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Database to benchmark against (default: temporary SQLite)')
+    parser.add_argument('--reset', action='store_true', help='Allow dropping a database that already has sessions')
+    parser.add_argument('--quick', action='store_true', help='Small sizes only')
+    parser.add_argument('--max-polygons', type=int, default=10000)
+    parser.add_argument('--max-sessions', type=int, default=100000, help='Largest export size (up to 1000000)')
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('--output', help='Results file (default benchmarks/results/db-<time>.json)')
+    args = parser.parse_args()
+
+    database_url = use_database(args.database_url)
+    from app import app
+    from common import reset_database
+    from database import db, StudySession
+
+    if args.database_url and not args.reset:
+        with app.app_context():
+            inspector = db.inspect(db.engine)
+            if inspector.has_table('study_sessions') and db.session.query(StudySession.id).first() is not None:
+                sys.exit('Refusing to drop a database that holds study sessions; pass --reset to allow it')
+    reset_database(app)
+
+    repeat = args.repeat or (5 if args.quick else 20)
+    polygon_counts = [n for n in POLYGON_COUNTS if n <= (100 if args.quick else args.max_polygons)]
+    session_counts = [n for n in SESSION_COUNTS if n <= (1000 if args.quick else args.max_sessions)]
+
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['admin_authenticated'] = True
+    results = bench_coordinates(app, client, polygon_counts, repeat)
+    results += bench_sessions(app, client, session_counts, repeat)
+    save_results('db', results, args.output, database=app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0], repeat=repeat)
+
+
+if __name__ == '__main__':
+    main()
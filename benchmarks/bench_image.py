@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the image pipeline: generate_processed_image across
+output sizes and noise settings, and encoding of the result in each
+supported format and quality.
+
+    python benchmarks/bench_image.py [--quick] [--output FILE]
+"""
+import argparse
+
+from common import measure, print_result, result, save_results, use_database
+
+use_database()
+
+from app import generate_processed_image, stimuli
+from noise_kernel import thread_buffer
+from stimuli import DEFAULT_STIMULUS
+import image_codec
+
+WIDTHS = [320, 800, 1280, 1920, None]
+NOISE = [0.0, 0.4, 1.5]
+ENCODINGS = [('jpeg', 95), ('jpeg', 75), ('webp', 80), ('webp', 50), ('png', None)]
+
+
+def size_label(size):
+    return 'full' if size is None else f'{size[0]}x{size[1]}'
+
+
+def bench_render(widths, noise_levels, repeat):
+    results = []
+    for width in widths:
+        size = stimuli.output_size(DEFAULT_STIMULUS, width=width)
+        frame = stimuli.get_frame(DEFAULT_STIMULUS, size)
+        out = thread_buffer(frame.shape)
+        for noise in noise_levels:
+            seed = iter(range(1_000_000))
+            stats = measure(
+                lambda: generate_processed_image(1.0, noise, DEFAULT_STIMULUS, rng=next(seed), out=out, size=size),
+                repeat=repeat
+            )
+            entry = result(
+                f'render/{size_label(size)}/noise={noise}', stats,
+                params={'width': width, 'size': size and list(size), 'noise': noise},
+                megapixels=frame.shape[0] * frame.shape[1] / 1e6
+            )
+            print_result(entry)
+            results.append(entry)
+    return results
+
+
+def bench_encode(widths, repeat):
+    results = []
+    for width in widths:
+        size = stimuli.output_size(DEFAULT_STIMULUS, width=width)
+        frame = stimuli.get_frame(DEFAULT_STIMULUS, size)
+        img = generate_processed_image(1.0, 0.4, DEFAULT_STIMULUS, rng=1, size=size)
+        for fmt, quality in ENCODINGS:
+            encoded = image_codec.encode(img, fmt, quality)
+            stats = measure(lambda: image_codec.encode(img, fmt, quality), repeat=repeat)
+            label = f'{fmt}' + (f'/q{quality}' if quality else '')
+            entry = result(
+                f'encode/{size_label(size)}/{label}', stats,
+                params={'width': width, 'format': fmt, 'quality': quality},
+                bytes=len(encoded), megapixels=frame.shape[0] * frame.shape[1] / 1e6
+            )
+            print_result(entry)
+            results.append(entry)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Fewer sizes and repetitions')
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('--output', help='Results file (default benchmarks/results/image-<time>.json)')
+    args = parser.parse_args()
+
+    widths = [320, 800] if args.quick else WIDTHS
+    noise_levels = [0.4] if args.quick else NOISE
+    repeat = args.repeat or (5 if args.quick else 20)
+
+    results = bench_render(widths, noise_levels, repeat) + bench_encode(widths, repeat)
+    save_results('image', results, args.output, repeat=repeat)
+
+
+if __name__ == '__main__':
+    main()
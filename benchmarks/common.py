@@ -0,0 +1,142 @@
+"""
+Shared helpers for the benchmark scripts: timing, result files and a
+throwaway database.
+
+Results are JSON documents of the form
+
+    {"suite": "image", "meta": {...}, "results": [
+        {"name": "render/800w/noise=0.4", "params": {...},
+         "unit": "s", "stats": {"min": ..., "mean": ..., "p50": ..., ...},
+         "extra": {...}}
+    ]}
+
+so compare.py can match results by name across runs.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Allow running as `python benchmarks/<script>.py` from the project root
+sys.path.insert(0, ROOT)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    """Latency statistics (in the samples' unit) for a list of timings"""
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'min': ordered[0],
+        'mean': statistics.fmean(ordered),
+        'stdev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1],
+    }
+
+
+def measure(fn, repeat=20, warmup=2, min_time=0.0):
+    """
+    Time fn() repeat times after warmup calls (and keep going until
+    min_time seconds have been spent); returns summarize() of the timings.
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < repeat or time.perf_counter() - started < min_time:
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def result(name, stats, params=None, unit='s', **extra):
+    return {'name': name, 'params': params or {}, 'unit': unit, 'stats': stats, 'extra': extra}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def metadata(**extra):
+    import cv2
+    import numpy as np
+    meta = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+    meta.update(extra)
+    return meta
+
+
+def save_results(suite, results, output=None, **meta):
+    """Write a results document; returns its path"""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'{suite}-{stamp}.json')
+    document = {'suite': suite, 'meta': metadata(**meta), 'results': results}
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print(f"Saved {len(results)} results to {output}")
+    return output
+
+
+def print_result(entry):
+    stats = entry['stats']
+    if entry['unit'] == 's':
+        print(f"{entry['name']:<48} p50 {stats['p50'] * 1000:9.2f} ms   p95 {stats['p95'] * 1000:9.2f} ms   (n={stats['n']})")
+    else:
+        print(f"{entry['name']:<48} {stats['mean']:.2f} {entry['unit']}")
+
+
+def use_database(database_url=None):
+    """
+    Point the app at database_url, or at a fresh SQLite file in a temp
+    directory. Must run before app is imported; returns the URL used.
+    """
+    if database_url is None:
+        directory = tempfile.mkdtemp(prefix='visual-snow-bench-')
+        database_url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    # Keep background work from skewing the numbers
+    os.environ.setdefault('FRAME_POOL_SIZE', '0')
+    os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'visual-snow-bench-metrics'))
+    return database_url
+
+
+def reset_database(app):
+    """Drop and recreate every table of the app's database"""
+    from database import db, init_db
+    with app.app_context():
+        db.drop_all()
+        init_db()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files and flag regressions.
+
+    python benchmarks/compare.py baseline.json candidate.json [--threshold 0.10] [--stat p50]
+
+Results are matched by name. Exits with status 1 if any latency got worse
+by more than --threshold (fractional), or any throughput dropped by more
+than that, so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        document = json.load(f)
+    return document, {entry['name']: entry for entry in document['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed slowdown, e.g. 0.10 = 10%%')
+    parser.add_argument('--stat', default='p50', choices=['min', 'mean', 'p50', 'p95', 'p99'])
+    args = parser.parse_args()
+
+    base_doc, baseline = load(args.baseline)
+    cand_doc, candidate = load(args.candidate)
+    print(f"baseline  {base_doc['meta'].get('commit')} {base_doc['meta'].get('timestamp')}")
+    print(f"candidate {cand_doc['meta'].get('commit')} {cand_doc['meta'].get('timestamp')}\n")
+
+    regressions = []
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name], candidate[name]
+        old, new = before['stats'][args.stat], after['stats'][args.stat]
+        if not old:
+            continue
+        change = new / old - 1
+        marker = ''
+        if change > args.threshold:
+            marker = '  REGRESSION'
+            regressions.append(name)
+        elif change < -args.threshold:
+            marker = '  faster'
+        line = f"{name:<48} {old * 1000:10.2f} -> {new * 1000:10.2f} ms {change:+7.1%}"
+
+        # Load results also carry throughput, where lower is worse
+        old_tp, new_tp = before['extra'].get('throughput'), after['extra'].get('throughput')
+        if old_tp and new_tp:
+            tp_change = new_tp / old_tp - 1
+            line += f"   {old_tp:8.1f} -> {new_tp:8.1f} req/s {tp_change:+7.1%}"
+            if tp_change < -args.threshold and name not in regressions:
+                marker = '  REGRESSION'
+                regressions.append(name)
+        print(line + marker)
+
+    for name in sorted(set(baseline) - set(candidate)):
+        print(f"{name:<48} missing from candidate")
+    for name in sorted(set(candidate) - set(baseline)):
+        print(f"{name:<48} new")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%} on {args.stat}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%} on {args.stat}")
+
+
+if __name__ == '__main__':
+    main()
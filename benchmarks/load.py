@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Concurrent load driver for a running server.
+
+Each worker thread sends requests back to back for --duration seconds;
+throughput and p50/p95/p99 latency are reported per scenario and saved
+as JSON like the other benchmarks.
+
+    gunicorn -w 4 app:app &
+    python benchmarks/load.py --url http://127.0.0.1:8000 --concurrency 16 --duration 30
+
+Scenarios:
+    image         /api/generate-image, unseeded (frame pool path)
+    image-seeded  /api/generate-image with a fresh seed per request (render path)
+    submit        /api/submit-score with a unique idempotency key per request
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from common import print_result, result, save_results, summarize
+
+SCENARIOS = ('image', 'image-seeded', 'submit')
+
+
+def image_request(url, args, rng):
+    return urllib.request.Request(f'{url}/api/generate-image?width={args.width}&noise={args.noise}&format={args.format}')
+
+
+def seeded_image_request(url, args, rng):
+    seed = rng.randrange(2 ** 31)
+    return urllib.request.Request(
+        f'{url}/api/generate-image?width={args.width}&noise={args.noise}&format={args.format}&seed={seed}'
+    )
+
+
+def submit_request(url, args, rng):
+    body = {
+        'username': f'load-{rng.randrange(10000)}',
+        'score': rng.randrange(6), 'time': rng.randrange(5000, 120000), 'clicks': rng.randrange(1, 30),
+        'foundObjects': rng.randrange(6), 'targetObjects': 5,
+        'imageMode': rng.choice(['normal', 'visual_snow']),
+        'idempotencyKey': f'load-{uuid.uuid4().hex}',
+        'questionnaire': {'happy': rng.randrange(1, 6), 'haveVisualSnow': rng.choice(['yes', 'no'])},
+    }
+    return urllib.request.Request(
+        f'{url}/api/submit-score', data=json.dumps(body).encode(),
+        headers={'Content-Type': 'application/json'}, method='POST'
+    )
+
+
+BUILDERS = {'image': image_request, 'image-seeded': seeded_image_request, 'submit': submit_request}
+
+
+def run_scenario(name, args):
+    build = BUILDERS[name]
+    deadline = time.monotonic() + args.duration
+    latencies = []
+    errors = {}
+    received = [0]
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(index)
+        local = []
+        local_errors = {}
+        local_bytes = 0
+        while time.monotonic() < deadline:
+            request = build(args.url, args, rng)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                    local_bytes += len(response.read())
+                local.append(time.perf_counter() - start)
+            except urllib.error.HTTPError as e:
+                local_errors[str(e.code)] = local_errors.get(str(e.code), 0) + 1
+            except (urllib.error.URLError, OSError) as e:
+                key = type(getattr(e, 'reason', e)).__name__
+                local_errors[key] = local_errors.get(key, 0) + 1
+        with lock:
+            latencies.extend(local)
+            received[0] += local_bytes
+            for key, count in local_errors.items():
+                errors[key] = errors.get(key, 0) + count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    if not latencies:
+        print(f"{name}: no successful requests ({errors})")
+        return None
+    entry = result(
+        f'load/{name}/c{args.concurrency}', summarize(latencies),
+        params={'concurrency': args.concurrency, 'duration': args.duration, 'width': args.width,
+                'noise': args.noise, 'format': args.format},
+        throughput=len(latencies) / elapsed, errors=errors, bytes_per_second=received[0] / elapsed
+    )
+    print_result(entry)
+    print(f"{'':<48} {entry['extra']['throughput']:.1f} req/s, p99 {entry['stats']['p99'] * 1000:.1f} ms, errors {errors}")
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Repeatable; default all')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per scenario')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--noise', type=float, default=0.4)
+    parser.add_argument('--format', default='jpeg')
+    parser.add_argument('--output', help='Results file (default benchmarks/results/load-<time>.json)')
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        entry = run_scenario(name, args)
+        if entry is not None:
+            results.append(entry)
+    save_results('load', results, args.output, url=args.url)
+
+
+if __name__ == '__main__':
+    main()
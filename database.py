@@ -1,11 +1,71 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.schema import CreateColumn
 from datetime import datetime
 import json
 
+import geometry
+
 db = SQLAlchemy()
 
+def init_db():
+    """
+    Create missing tables, then add columns and indexes introduced after a
+    table was first created. create_all() never alters existing tables, so
+    new columns must be nullable or carry a server_default.
+    """
+    dialect = db.engine.dialect
+    if dialect.name == 'postgresql':
+        # Trigram index for substring username search; needs the extension
+        try:
+            db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not enable pg_trgm, substring search will not be indexed: {e}")
+    db.create_all()
+    
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=dialect)
+            db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+        
+        # checkfirst skips existing indexes; ddl_if() rules skip other dialects
+        for index in table.indexes:
+            index.create(db.session.connection(), checkfirst=True)
+    db.session.commit()
+
+def has_pg_trgm(bind):
+    """Whether the pg_trgm extension is installed (init_db tries to enable it)"""
+    if bind is None:
+        return True
+    return bool(bind.execute(db.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+
 class StudySession(db.Model):
     __tablename__ = 'study_sessions'
+    __table_args__ = (
+        # Keyset pagination in the admin results view: newest first, with
+        # optional image_mode / exact or prefix username filters
+        db.Index('ix_study_sessions_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_study_sessions_mode_timestamp_id', 'image_mode', 'timestamp', 'id'),
+        db.Index('ix_study_sessions_username_timestamp_id', 'username', 'timestamp', 'id'),
+        # A unique index rather than a constraint so init_db can add it to
+        # existing tables; NULL (keyless legacy rows) is allowed repeatedly
+        db.Index('ux_study_sessions_idempotency_key', 'idempotency_key', unique=True),
+        # Postgres only: LIKE 'prefix%' under a non-C collation, and
+        # trigram-backed ILIKE '%substring%'
+        db.Index(
+            'ix_study_sessions_username_pattern', 'username',
+            postgresql_ops={'username': 'varchar_pattern_ops'}
+        ).ddl_if(dialect='postgresql'),
+        db.Index(
+            'ix_study_sessions_username_trgm', 'username',
+            postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql', callable_=lambda ddl, target, bind, **kw: has_pg_trgm(bind)),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), nullable=False)
@@ -29,6 +89,14 @@ class StudySession(db.Model):
     heard_visual_snow = db.Column(db.String(3))  # 'yes' or 'no'
     have_visual_snow = db.Column(db.String(3))   # 'yes' or 'no'
     
+    # Exact stimulus frame shown in visual snow mode (see /api/generate-image)
+    stimulus_id = db.Column(db.String(100))
+    stimulus_seed = db.Column(db.BigInteger)
+    stimulus_width = db.Column(db.Integer)  # requested width; the noise depends on it too
+    
+    # Client-chosen key that makes retried submissions safe (see submissions.py)
+    idempotency_key = db.Column(db.String(64))
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -40,6 +108,9 @@ class StudySession(db.Model):
             'target_objects': self.target_objects,
             'image_mode': self.image_mode,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'stimulus_id': self.stimulus_id,
+            'stimulus_seed': self.stimulus_seed,
+            'stimulus_width': self.stimulus_width,
             'questionnaire': {
                 'frustrated': self.frustrated,
                 'challenged': self.challenged,
@@ -54,21 +125,74 @@ class StudySession(db.Model):
             }
         }
 
+class TelemetryChunk(db.Model):
+    """
+    A batch of click / pointer-move events from one participant, packed
+    into a compressed binary blob (see telemetry.py) instead of one row
+    per event. session_key is the participant's submission idempotency key.
+    """
+    __tablename__ = 'telemetry_chunks'
+    __table_args__ = (
+        # Also makes a retried batch (same seq) a no-op
+        db.Index('ux_telemetry_chunks_session_seq', 'session_key', 'seq', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_key = db.Column(db.String(64), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    event_count = db.Column(db.Integer, nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    data = db.Column(db.LargeBinary, nullable=False)
+
 class StoredCoordinate(db.Model):
+    """
+    One polygon. Vertices are stored packed in points_data (see
+    geometry.py); rows written before that keep them as JSON text in
+    points_json until polygon_store.pack_legacy_points() converts them.
+    """
     __tablename__ = 'stored_coordinates'
     
     id = db.Column(db.Integer, primary_key=True)
     label = db.Column(db.String(100), nullable=False)
-    points_json = db.Column(db.Text, nullable=False)  # JSON string of points array
+    points_json = db.Column(db.Text, nullable=False, default='')  # Legacy JSON string of points array
+    points_data = db.Column(db.LargeBinary)  # Packed vertices
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    def _flat_points(self):
+        """[x0, y0, x1, y1, ...], decoded once per loaded row"""
+        source = self.points_data if self.points_data is not None else self.points_json
+        cached = self.__dict__.get('_decoded')
+        if cached is None or cached[0] is not source:
+            if self.points_data is not None:
+                flat = geometry.unpack(self.points_data)
+            else:
+                flat = [value for pair in geometry.pairs(json.loads(self.points_json)) for value in pair]
+            cached = self._decoded = (source, flat)
+        return cached[1]
+    
+    @property
+    def vertices(self):
+        """(n, 2) read-only numpy array of the vertices for hit testing, built once per decode"""
+        flat = self._flat_points()
+        cached = self.__dict__.get('_vertices')
+        if cached is None or cached[0] is not flat:
+            array = geometry.as_array(flat)
+            array.flags.writeable = False
+            cached = self._vertices = (flat, array)
+        return cached[1]
+    
     @property
     def points(self):
-        return json.loads(self.points_json)
+        if self.points_data is None:
+            return json.loads(self.points_json)
+        return geometry.to_points(self._flat_points())
     
     @points.setter
     def points(self, value):
-        self.points_json = json.dumps(value)
+        self.points_data = geometry.pack(value)
+        self.points_json = ''
+        self.__dict__.pop('_decoded', None)
+        self.__dict__.pop('_vertices', None)
     
     def to_dict(self):
         return {
@@ -78,13 +202,22 @@ class StoredCoordinate(db.Model):
         }
 
 class PolygonSet(db.Model):
+    """
+    A named polygon set. Saved sets are frozen (immutable) and reference
+    their StoredCoordinate rows through polygon_set_members; the admin's
+    working copy is an unfrozen draft set. See polygon_store.py.
+    """
     __tablename__ = 'polygon_sets'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
-    polygons_json = db.Column(db.Text, nullable=False)  # JSON string of polygons array
+    polygons_json = db.Column(db.Text, nullable=False, default='[]')  # Legacy embedded copy, migrated to members
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer)  # Assigned when the set is frozen
+    frozen = db.Column(db.Boolean, nullable=False, default=True, server_default='1')
+    
+    members = db.relationship('StoredCoordinate', secondary='polygon_set_members', order_by='StoredCoordinate.id', viewonly=True)
     
     @property
     def polygons(self):
@@ -94,10 +227,69 @@ class PolygonSet(db.Model):
     def polygons(self, value):
         self.polygons_json = json.dumps(value)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, geometry=True):
+        data = {
+            'id': self.id,
             'name': self.name,
             'description': self.description,
-            'polygons': self.polygons,
+            'version': self.version,
             'created_at': self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+        }
+        if geometry:
+            data['polygons'] = [coord.to_dict() for coord in self.members]
+        return data
+
+class PolygonSetMember(db.Model):
+    """Reference from a polygon set to one of its coordinate rows"""
+    __tablename__ = 'polygon_set_members'
+    
+    set_id = db.Column(db.Integer, db.ForeignKey('polygon_sets.id'), primary_key=True)
+    coordinate_id = db.Column(db.Integer, db.ForeignKey('stored_coordinates.id'), primary_key=True, index=True)
+
+class StudyState(db.Model):
+    """Single row (id=1) pointing at the polygon set the study currently uses"""
+    __tablename__ = 'study_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    active_set_id = db.Column(db.Integer, db.ForeignKey('polygon_sets.id'))
+    # Incremented by every coordinate/polygon set write; lets each worker
+    # tell whether its cached study payload is stale
+    coordinates_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Last version handed to a saved polygon set
+    set_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SessionStats(db.Model):
+    """
+    Running moments of study sessions for one group, e.g. image_mode =
+    'visual_snow'. Maintained by stats.record() in the same transaction
+    as each submission; means and M2 sums follow Welford's method.
+    """
+    __tablename__ = 'session_stats'
+    
+    dimension = db.Column(db.String(50), primary_key=True)
+    group_value = db.Column(db.String(50), primary_key=True)
+    n = db.Column(db.BigInteger, nullable=False, default=0)
+    score_mean = db.Column(db.Float, nullable=False, default=0.0)
+    score_m2 = db.Column(db.Float, nullable=False, default=0.0)
+    time_ms_mean = db.Column(db.Float, nullable=False, default=0.0)
+    time_ms_m2 = db.Column(db.Float, nullable=False, default=0.0)
+    clicks_mean = db.Column(db.Float, nullable=False, default=0.0)
+    clicks_m2 = db.Column(db.Float, nullable=False, default=0.0)
+    # Sessions with target_objects > 0; the ratio is undefined otherwise
+    found_ratio_n = db.Column(db.BigInteger, nullable=False, default=0)
+    found_ratio_mean = db.Column(db.Float, nullable=False, default=0.0)
+    found_ratio_m2 = db.Column(db.Float, nullable=False, default=0.0)
+
+class LikertCounts(db.Model):
+    """Answer distribution of one questionnaire item within a stats group"""
+    __tablename__ = 'likert_counts'
+    
+    dimension = db.Column(db.String(50), primary_key=True)
+    group_value = db.Column(db.String(50), primary_key=True)
+    item = db.Column(db.String(20), primary_key=True)
+    level_1 = db.Column(db.BigInteger, nullable=False, default=0)
+    level_2 = db.Column(db.BigInteger, nullable=False, default=0)
+    level_3 = db.Column(db.BigInteger, nullable=False, default=0)
+    level_4 = db.Column(db.BigInteger, nullable=False, default=0)
+    level_5 = db.Column(db.BigInteger, nullable=False, default=0)
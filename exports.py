@@ -0,0 +1,298 @@
+"""
+Streaming exports of study sessions.
+
+Rows are read with yield_per (a server-side cursor on Postgres) and
+serialized one at a time, so memory stays flat regardless of how many
+sessions are exported. Columnar exports (Parquet / Arrow IPC via the
+optional pyarrow package, or NumPy .npz) are built chunk by chunk from
+plain column tuples rather than ORM objects.
+"""
+import csv
+import io
+import json
+import tempfile
+import zlib
+from datetime import datetime, timezone
+
+import results_query
+from database import StudySession
+from lazy_import import lazy_import
+
+# Only needed by the columnar formats, so loaded on first use
+np = lazy_import('numpy')
+pa = lazy_import('pyarrow', optional=True)
+
+LIKERT_FIELDS = ['frustrated', 'challenged', 'happy', 'angry', 'upset', 'defeated', 'content', 'joyful']
+
+# Flat column order used by the CSV export
+CSV_FIELDS = [
+    'id', 'username', 'score', 'time_ms', 'clicks', 'found_objects', 'target_objects',
+    'image_mode', 'timestamp', 'stimulus_id', 'stimulus_seed', 'stimulus_width',
+    *LIKERT_FIELDS, 'heard_visual_snow', 'have_visual_snow'
+]
+
+MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+BATCH_SIZE = 1000
+
+# Chunks are coalesced to roughly this size before being written out
+FLUSH_BYTES = 64 * 1024
+
+
+def parse_timestamp(value):
+    """
+    Naive UTC datetime (as stored) from an ISO timestamp; one with an
+    offset is converted to UTC first, one without is taken as UTC
+    """
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def session_query(since=None, until=None, after_id=None, image_mode=None, username=None, username_mode='contains'):
+    """
+    Sessions in [since, until), optionally filtered like the admin results
+    view. With after_id the rows come in id order so an incremental pull
+    can resume from the last id it saw; otherwise the newest come first,
+    as before.
+    """
+    query = results_query.filtered_query(image_mode=image_mode, username=username, username_mode=username_mode)
+    if since is not None:
+        query = query.filter(StudySession.timestamp >= since)
+    if until is not None:
+        query = query.filter(StudySession.timestamp < until)
+    if after_id is not None:
+        return query.filter(StudySession.id > after_id).order_by(StudySession.id)
+    return query.order_by(StudySession.timestamp.desc(), StudySession.id.desc())
+
+
+def iter_sessions(query, batch_size=BATCH_SIZE):
+    return query.yield_per(batch_size)
+
+
+def dumps(value):
+    # Same settings as Flask's jsonify outside debug mode, so a streamed
+    # download is byte-for-byte what the old in-memory export returned
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def json_chunks(sessions):
+    """A JSON array, produced element by element"""
+    yield '['
+    separator = ''
+    for session in sessions:
+        yield separator + dumps(session.to_dict())
+        separator = ','
+    yield ']\n'
+
+
+def ndjson_chunks(sessions):
+    for session in sessions:
+        yield dumps(session.to_dict()) + '\n'
+
+
+def csv_chunks(sessions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for session in sessions:
+        row = []
+        for field in CSV_FIELDS:
+            value = getattr(session, field)
+            row.append(value.isoformat() if isinstance(value, datetime) else value)
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+SERIALIZERS = {
+    'json': json_chunks,
+    'ndjson': ndjson_chunks,
+    'csv': csv_chunks,
+}
+
+
+def encode_chunks(chunks, flush_bytes=FLUSH_BYTES):
+    """UTF-8 encode text chunks, coalescing small ones"""
+    pending = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= flush_bytes:
+            yield b''.join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield b''.join(pending)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a byte stream on the fly into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Columnar layout: name -> storage kind
+COLUMNS = {
+    'id': 'int32',
+    'username': 'string',
+    'score': 'int32',
+    'time_ms': 'int32',
+    'clicks': 'int32',
+    'found_objects': 'int32',
+    'target_objects': 'int32',
+    'image_mode': 'category',
+    'timestamp': 'timestamp',
+    'stimulus_id': 'category',
+    'stimulus_seed': 'int64',
+    'stimulus_width': 'int64',
+    **{field: 'likert' for field in LIKERT_FIELDS},
+    'heard_visual_snow': 'category',
+    'have_visual_snow': 'category',
+}
+
+COLUMNAR_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+    'npz': ('application/octet-stream', 'npz'),
+}
+
+# Spool columnar output in memory up to this size before using a temp file
+SPOOL_BYTES = 16 * 1024 * 1024
+
+
+def category_values(query, name):
+    """Distinct values of a categorical column, so every chunk shares one dictionary"""
+    column = getattr(StudySession, name)
+    values = query.with_entities(column).filter(column.isnot(None)).distinct().order_by(None)
+    return sorted(row[0] for row in values)
+
+
+def column_chunks(query, batch_size=BATCH_SIZE):
+    """
+    Yield dicts of NumPy arrays, batch_size rows at a time. Likert values
+    are int8 with 0 for missing (responses are 1-5), categorical columns
+    are int8/int16 codes into category_values() with -1 for missing,
+    and a missing stimulus_seed or stimulus_width is -1.
+    """
+    categories = {name: category_values(query, name) for name, kind in COLUMNS.items() if kind == 'category'}
+    codes = {name: {value: i for i, value in enumerate(values)} for name, values in categories.items()}
+    entities = [getattr(StudySession, name) for name in COLUMNS]
+    rows = query.with_entities(*entities).yield_per(batch_size)
+
+    def convert(batch):
+        columns = list(zip(*batch))
+        chunk = {}
+        for (name, kind), values in zip(COLUMNS.items(), columns):
+            if kind == 'int32':
+                chunk[name] = np.array(values, dtype=np.int32)
+            elif kind == 'int64':
+                chunk[name] = np.array([-1 if v is None else v for v in values], dtype=np.int64)
+            elif kind == 'likert':
+                chunk[name] = np.array([v or 0 for v in values], dtype=np.int8)
+            elif kind == 'category':
+                dtype = np.int8 if len(codes[name]) < 127 else np.int16
+                chunk[name] = np.array([codes[name].get(v, -1) for v in values], dtype=dtype)
+            elif kind == 'timestamp':
+                chunk[name] = np.array(values, dtype='datetime64[ms]')
+            else:
+                chunk[name] = np.array(values, dtype=str)
+        return chunk
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield categories, convert(batch)
+            batch = []
+    # A final chunk of None still describes the categories when nothing matched
+    yield categories, convert(batch) if batch else None
+
+
+def arrow_schema(categories):
+    fields = []
+    for name, kind in COLUMNS.items():
+        if kind == 'int32':
+            field_type = pa.int32()
+        elif kind == 'int64':
+            field_type = pa.int64()
+        elif kind == 'likert':
+            field_type = pa.int8()
+        elif kind == 'category':
+            field_type = pa.dictionary(pa.int8() if len(categories[name]) < 127 else pa.int16(), pa.string())
+        elif kind == 'timestamp':
+            field_type = pa.timestamp('ms')
+        else:
+            field_type = pa.string()
+        fields.append(pa.field(name, field_type))
+    return pa.schema(fields)
+
+
+def arrow_batch(schema, categories, chunk):
+    arrays = []
+    for field in schema:
+        name, kind = field.name, COLUMNS[field.name]
+        values = chunk[name]
+        if kind == 'likert':
+            arrays.append(pa.array(values, mask=values == 0))
+        elif kind == 'int64':
+            arrays.append(pa.array(values, mask=values == -1))
+        elif kind == 'category':
+            indices = pa.array(values, type=field.type.index_type, mask=values == -1)
+            arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(categories[name], type=pa.string())))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_columnar(query, fmt, batch_size=BATCH_SIZE):
+    """Write a columnar export to a spooled temp file, rewound for reading"""
+    if fmt in ('parquet', 'arrow') and pa is None:
+        raise RuntimeError(f'{fmt} export requires pyarrow; use format=npz instead')
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+
+    if fmt == 'npz':
+        parts = {}
+        categories = {}
+        for categories, chunk in column_chunks(query, batch_size):
+            if chunk is not None:
+                for name, values in chunk.items():
+                    parts.setdefault(name, []).append(values)
+        arrays = {
+            name: np.concatenate(parts[name]) if name in parts else np.array([], dtype=np.int32)
+            for name in COLUMNS
+        }
+        for name, values in categories.items():
+            arrays[f'{name}__categories'] = np.array(values, dtype=str)
+        np.savez_compressed(output, **arrays)
+    else:
+        writer = None
+        for categories, chunk in column_chunks(query, batch_size):
+            if writer is None:
+                schema = arrow_schema(categories)
+                if fmt == 'parquet':
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(output, schema, compression='zstd')
+                else:
+                    writer = pa.ipc.new_file(output, schema)
+            if chunk is not None:
+                writer.write_batch(arrow_batch(schema, categories, chunk))
+        writer.close()
+
+    output.seek(0)
+    return output
@@ -0,0 +1,181 @@
+import atexit
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+
+class _Pool:
+    def __init__(self, size):
+        self.slots = [None] * size
+        self.cursor = 0
+        self.pending = set()
+        self.bytes = 0
+
+
+class FramePool:
+    """
+    Pools of pre-rendered, pre-encoded frames keyed by render parameters.
+
+    Frames are served round-robin. Each frame that is served is queued for
+    replacement by a background worker, so the request path is a buffer
+    lookup; under a burst a frame may be served again before its
+    replacement lands rather than blocking on a render. Whole pools are
+    evicted least-recently-used first once the memory cap or max_pools is
+    exceeded, and refills beyond max_queue are dropped rather than queued,
+    so requests for many distinct settings cannot grow the backlog without
+    bound; a slot whose refill was dropped is retried when the cursor next
+    reaches it.
+    """
+
+    def __init__(self, render, pool_size=8, max_bytes=64 * 1024 * 1024, workers=1, max_pools=32, max_queue=64):
+        self.render = render
+        self.pool_size = pool_size
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_pools = max_pools
+        self.max_queue = max_queue
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self._pools = OrderedDict()
+        self._jobs = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._worker_pid = None
+        self._threads = []
+
+    def _ensure_workers(self):
+        # Threads do not survive a fork, so start them lazily in each worker process
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._jobs = queue.Queue(self.max_queue)
+            for pool in self._pools.values():
+                pool.pending.clear()
+            self._threads = []
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(self._jobs,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._worker_pid is None:
+                atexit.register(self.shutdown)
+            self._worker_pid = os.getpid()
+
+    def shutdown(self, timeout=2.0):
+        """Stop the workers so none is mid-render during interpreter teardown"""
+        if self._worker_pid != os.getpid():
+            return
+        # Drop queued refills; only the job already in progress is waited for
+        stops = len(self._threads)
+        while stops:
+            try:
+                self._jobs.put_nowait(None)
+                stops -= 1
+            except queue.Full:
+                try:
+                    self._jobs.get_nowait()
+                except queue.Empty:
+                    pass
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._worker_pid = None
+
+    def _schedule(self, key, pool, slot):
+        if slot not in pool.pending:
+            try:
+                self._jobs.put_nowait((key, slot))
+            except queue.Full:
+                self.dropped += 1
+                return
+            pool.pending.add(slot)
+
+    def get(self, key):
+        """Return an encoded frame for key, or None if none is ready yet"""
+        if self.pool_size <= 0:
+            return None
+        self._ensure_workers()
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                while self._pools and len(self._pools) >= self.max_pools:
+                    _, evicted = self._pools.popitem(last=False)
+                    self.current_bytes -= evicted.bytes
+                pool = self._pools[key] = _Pool(self.pool_size)
+                for slot in range(self.pool_size):
+                    self._schedule(key, pool, slot)
+                self.misses += 1
+                return None
+            self._pools.move_to_end(key)
+            for _ in range(self.pool_size):
+                slot = pool.cursor
+                pool.cursor = (pool.cursor + 1) % self.pool_size
+                frame = pool.slots[slot]
+                # Refills the frame served, or an empty slot whose refill was dropped
+                self._schedule(key, pool, slot)
+                if frame is not None:
+                    self.hits += 1
+                    return frame
+            self.misses += 1
+            return None
+
+    def offer(self, key, frame):
+        """Store a frame rendered on the request path in an empty slot"""
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                return
+            for slot, existing in enumerate(pool.slots):
+                if existing is None:
+                    self._store(pool, slot, frame)
+                    return
+
+    def _store(self, pool, slot, frame):
+        previous = pool.slots[slot]
+        delta = len(frame) - (len(previous) if previous is not None else 0)
+        pool.slots[slot] = frame
+        pool.bytes += delta
+        self.current_bytes += delta
+        while self.current_bytes > self.max_bytes and len(self._pools) > 1:
+            _, evicted = self._pools.popitem(last=False)
+            self.current_bytes -= evicted.bytes
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            key, slot = job
+            with self._lock:
+                pool = self._pools.get(key)
+            if pool is None:
+                continue
+            try:
+                frame = self.render(key)
+            except Exception as e:
+                print(f"Error pre-rendering frame for {key}: {e}")
+                frame = None
+            with self._lock:
+                pool.pending.discard(slot)
+                if frame is not None and self._pools.get(key) is pool:
+                    self._store(pool, slot, frame)
+
+    def clear(self):
+        with self._lock:
+            self._pools.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pools': len(self._pools),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'dropped': self.dropped,
+                'queued': self._jobs.qsize()
+            }
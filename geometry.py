@@ -0,0 +1,123 @@
+"""
+Packed polygon vertices.
+
+StoredCoordinate rows keep their vertices as a small binary blob rather
+than JSON text: one format byte, then little-endian x, y pairs. They are
+int16 when every coordinate is a whole number in range (the admin draws
+on whole pixels), int32 hundredths of a pixel when that holds them
+exactly, and float32 otherwise. Packing and unpacking use the
+array module, so serving coordinates does not need numpy; as_array()
+gives the numpy form for hit testing.
+"""
+import math
+import sys
+from array import array
+
+from lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+INT16 = 1
+FLOAT32 = 2
+CENTI = 3
+
+TYPECODES = {INT16: 'h', FLOAT32: 'f', CENTI: 'i'}
+
+
+def pairs(points):
+    """[(x, y), ...] floats from [{"x": .., "y": ..}, ...] or [[x, y], ...]"""
+    if not isinstance(points, list):
+        raise ValueError('points must be a list')
+    result = []
+    for point in points:
+        if isinstance(point, dict):
+            x, y = point.get('x'), point.get('y')
+        elif isinstance(point, (list, tuple)) and len(point) == 2:
+            x, y = point
+        else:
+            raise ValueError(f'Invalid point: {point!r}')
+        try:
+            x, y = float(x), float(y)
+        except (TypeError, ValueError):
+            raise ValueError('Point coordinates must be numbers') from None
+        if not (math.isfinite(x) and math.isfinite(y)):
+            raise ValueError('Point coordinates must be finite')
+        result.append((x, y))
+    return result
+
+
+def pack(points):
+    flat = [value for pair in pairs(points) for value in pair]
+    if all(value.is_integer() and -32768 <= value <= 32767 for value in flat):
+        fmt, values = INT16, array('h', [int(value) for value in flat])
+    elif all(round(value * 100) / 100 == value and abs(value) < 2 ** 31 / 100 for value in flat):
+        fmt, values = CENTI, array('i', [round(value * 100) for value in flat])
+    else:
+        fmt, values = FLOAT32, array('f', flat)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return bytes([fmt]) + values.tobytes()
+
+
+def unpack(data):
+    """Flat [x0, y0, x1, y1, ...] list from a packed blob"""
+    if not data or data[0] not in TYPECODES:
+        raise ValueError('Unknown vertex format')
+    values = array(TYPECODES[data[0]])
+    values.frombytes(data[1:])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    if data[0] == CENTI:
+        # Whole pixels stay ints, as INT16 gives them, so 50 doesn't come back as 50.0
+        return [value // 100 if value % 100 == 0 else value / 100 for value in values]
+    if data[0] == FLOAT32:
+        # float32 only holds ~7 significant digits; don't print the noise
+        return [int(value) if value.is_integer() else round(value, 3) for value in values]
+    return values.tolist()
+
+
+def to_points(flat):
+    """The [{"x": .., "y": ..}, ...] form the pages and API use"""
+    return [{'x': x, 'y': y} for x, y in zip(flat[0::2], flat[1::2])]
+
+
+def as_array(flat):
+    return np.asarray(flat, dtype=np.float64).reshape(-1, 2)
+
+
+def simplify(points, tolerance):
+    """
+    points without the vertices that lie within tolerance pixels of the
+    simplified outline (Douglas-Peucker on the closed polygon), keeping
+    at least three.
+    """
+    count = len(points)
+    if tolerance <= 0 or count <= 3:
+        return points
+    ring = np.asarray(pairs(points) + pairs(points[:1]), dtype=np.float64)
+    # Split the ring at the first vertex and the one farthest from it
+    far = int(np.argmax(((ring[:count] - ring[0]) ** 2).sum(axis=1)))
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[far] = True
+    pending = [(0, far), (far, count)]
+    while pending:
+        start, end = pending.pop()
+        if end - start < 2:
+            continue
+        a, b = ring[start], ring[end]
+        between = ring[start + 1:end]
+        dx, dy = b - a
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(between[:, 0] - a[0], between[:, 1] - a[1])
+        else:
+            distances = np.abs(dx * (between[:, 1] - a[1]) - dy * (between[:, 0] - a[0])) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            index += start + 1
+            keep[index] = True
+            pending.append((start, index))
+            pending.append((index, end))
+    if keep.sum() < 3:
+        return points
+    return [point for point, kept in zip(points, keep.tolist()) if kept]
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app` (Procfile).
+
+By default the app is imported once in the master and every stimulus is
+decoded there before the workers fork. Workers then boot without
+importing anything, and map the decoded frames from SHARED_FRAMES_DIR
+instead of each holding a private copy. GUNICORN_PRELOAD=0 turns this
+off, e.g. to let `--reload` work in development.
+
+Worker count comes from WEB_CONCURRENCY as usual, threads per worker
+from GUNICORN_THREADS.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+# Threaded workers. app.py reads GUNICORN_THREADS too and sizes the render
+# executor and the stream limit from it so that open streams and requests
+# waiting on renders never hold every thread; set the thread count here
+# rather than with --threads so the two agree
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Widths the study requests (800 CSS pixels at 1x and 2x density); their
+# size classes are decoded up front along with the full-size frames
+PRELOAD_WIDTHS = [int(width) for width in os.environ.get('PRELOAD_WIDTHS', '800,1600').split(',') if width.strip()]
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from app import stimuli
+    loaded = stimuli.preload(PRELOAD_WIDTHS)
+    server.log.info('Preloaded %d stimulus frames into %s', loaded, stimuli.shared_dir or 'worker memory')
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    # Connections opened in the master must not be shared with workers
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,147 @@
+"""
+Server-side hit testing of study clicks against the active polygons.
+
+LabelMap rasterizes the polygons once into an image-sized array holding,
+per pixel, a label for the polygon covering it, so checking a
+batch of clicks is one fancy-indexing lookup however many polygons there
+are. Where polygons overlap, the label stands for the combination of
+polygons covering that pixel.
+"""
+import numpy as np
+
+# The study image is shown at a fixed 800x600 and clicks are reported in
+# those pixel coordinates (see getImageCoordinates in study.js)
+STUDY_WIDTH = 800
+STUDY_HEIGHT = 600
+
+
+def parse_points(points, rounded=True):
+    """
+    (xs, ys) arrays from [{"x": .., "y": ..}, ...] or [[x, y], ...];
+    rounded to whole pixels unless rounded is False
+    """
+    if not isinstance(points, list):
+        raise ValueError('points must be a list')
+    pairs = []
+    for point in points:
+        if isinstance(point, dict):
+            pairs.append((point.get('x'), point.get('y')))
+        elif isinstance(point, (list, tuple)) and len(point) == 2:
+            pairs.append(tuple(point))
+        else:
+            raise ValueError(f'Invalid point: {point!r}')
+    try:
+        array = np.asarray(pairs, dtype=np.float64).reshape(-1, 2)
+    except (TypeError, ValueError) as e:
+        raise ValueError('Point coordinates must be numbers') from e
+    if not np.isfinite(array).all():
+        raise ValueError('Point coordinates must be finite')
+    if rounded:
+        # Same rounding as the client, which hit-tests Math.round()ed positions
+        array = np.floor(array + 0.5).astype(np.int64)
+    return array[:, 0], array[:, 1]
+
+
+class LabelMap:
+    """Pixel -> polygons lookup for a list of StoredCoordinate rows"""
+
+    def __init__(self, coordinates, width=STUDY_WIDTH, height=STUDY_HEIGHT):
+        self.width = width
+        self.height = height
+        self.labels = np.zeros((height, width), dtype=np.uint16)
+        # Polygon ids per label; label 0 is "no polygon"
+        self.members = [()]
+        self._combined = {}
+
+        for coord in coordinates:
+            polygon = self._vertices(coord)
+            if polygon is None:
+                continue
+            x0, y0 = np.maximum(np.floor(polygon.min(axis=0)).astype(np.int64), 0)
+            x1, y1 = np.minimum(np.ceil(polygon.max(axis=0)).astype(np.int64) + 1, (width, height))
+            if x0 >= x1 or y0 >= y1:
+                continue
+            # Fill within the bounding box only, so building is proportional
+            # to the polygons' area rather than polygons x image size
+            inside = even_odd_mask(polygon, x0, y0, x1, y1)
+            covered = self.labels[y0:y1, x0:x1][inside]
+            # Pixels another polygon already covers get a label for the
+            # combination, so overlaps stay a single lookup too
+            previous, inverse = np.unique(covered, return_inverse=True)
+            mapped = np.array([self._label(self.members[label] + (coord.id,)) for label in previous])
+            # _label() may have widened the array, so index it afresh
+            self.labels[y0:y1, x0:x1][inside] = mapped[inverse]
+
+    def _label(self, ids):
+        label = self._combined.get(ids)
+        if label is None:
+            label = self._combined[ids] = len(self.members)
+            self.members.append(ids)
+            if label > np.iinfo(self.labels.dtype).max:
+                self.labels = self.labels.astype(np.uint32)
+        return label
+
+    @staticmethod
+    def _vertices(coord):
+        try:
+            polygon = coord.vertices
+        except ValueError:
+            return None
+        return polygon if len(polygon) >= 3 else None
+
+    def lookup(self, xs, ys):
+        """Polygon ids hit by each point, as a list of lists (empty for a miss)"""
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        labels = np.zeros(len(xs), dtype=np.int64)
+        labels[inside] = self.labels[ys[inside], xs[inside]]
+        members = self.members
+        return [list(members[label]) for label in labels.tolist()]
+
+
+def even_odd_mask(polygon, x0, y0, x1, y1):
+    """
+    Boolean mask of the integer pixels in [x0, x1) x [y0, y1) inside
+    polygon, by the same crossing rule as checkIfPointInPolygon in
+    study.js, so server and client agree on every boundary pixel.
+    """
+    px, py = polygon[:, 0], polygon[:, 1]
+    qx, qy = np.roll(px, 1), np.roll(py, 1)
+    rows = np.arange(y0, y1, dtype=np.float64)[:, None]
+    # Edges crossing each row's horizontal ray, and where they cross it
+    crossing = (py > rows) != (qy > rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xc = (qx - px) * (rows - py) / (qy - py) + px
+    # Pixel x is left of a crossing iff x < ceil(xc); count crossings per
+    # column, then the crossings right of x are the row total minus the
+    # running count
+    width = x1 - x0
+    columns = np.clip(np.ceil(np.where(crossing, xc, 0)) - x0, 0, width).astype(np.int64)
+    row_index = np.broadcast_to(np.arange(y1 - y0)[:, None], crossing.shape)
+    counts = np.zeros((y1 - y0, width + 1), dtype=np.int32)
+    np.add.at(counts, (row_index[crossing], columns[crossing]), 1)
+    right = crossing.sum(axis=1)[:, None] - np.cumsum(counts, axis=1)[:, :width]
+    return (right & 1).astype(bool)
+
+
+def replay(hits, targets):
+    """
+    (found target ids, score) for a click sequence, following study.js: a
+    click finds the first target (in target order) it hits that was not
+    found before and scores +1; any other click scores -1. Clicks after
+    the last target is found are ignored, as the task has ended.
+    """
+    found = []
+    score = 0
+    for ids in hits:
+        if targets and len(found) == len(targets):
+            break
+        for target in targets:
+            if target in ids and target not in found:
+                found.append(target)
+                score += 1
+                break
+        else:
+            score -= 1
+    return found, score
@@ -0,0 +1,45 @@
+import cv2
+
+# format name -> (OpenCV extension, mimetype, quality flag, default quality)
+FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY, 95),
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY, 80),
+    'png': ('.png', 'image/png', None, None),
+}
+ALIASES = {'jpg': 'jpeg'}
+
+# PNG is lossless; a low compression level keeps encoding cheap
+PNG_COMPRESSION = 3
+
+
+def parse_format(value):
+    """Normalize a format name, raising ValueError for unsupported formats"""
+    name = ALIASES.get(value.lower(), value.lower())
+    if name not in FORMATS:
+        raise ValueError(f'Unsupported format: {value}')
+    return name
+
+
+def parse_quality(value):
+    """Quality 1-100 for lossy formats, or None for the format default"""
+    if value is None:
+        return None
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise ValueError('Quality must be between 1 and 100')
+    return quality
+
+
+def mimetype(fmt):
+    return FORMATS[fmt][1]
+
+
+def encode(img, fmt='jpeg', quality=None):
+    """Encode an image to bytes, or None if OpenCV fails"""
+    ext, _, quality_flag, default_quality = FORMATS[fmt]
+    if quality_flag is not None:
+        params = [quality_flag, quality or default_quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    success, encoded = cv2.imencode(ext, img, params)
+    return encoded.tobytes() if success else None
@@ -0,0 +1,36 @@
+"""
+Deferred imports for heavy modules.
+
+    np = lazy_import('numpy')
+
+returns a module object at once, but the module only executes on first
+attribute access. Routes that never touch images (database, admin,
+submissions) then run in workers that never load numpy or OpenCV.
+"""
+import importlib.util
+import sys
+import threading
+
+_lock = threading.Lock()
+
+
+def lazy_import(name, optional=False):
+    """
+    The module called name, loaded on first use. With optional=True a
+    module that is not installed gives None instead of ImportError.
+    """
+    with _lock:
+        module = sys.modules.get(name)
+        if module is not None:
+            return module
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            if optional:
+                return None
+            raise ImportError(f'No module named {name!r}', name=name)
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        return module
@@ -0,0 +1,358 @@
+"""
+Request timing, sub-span histograms and a Prometheus text endpoint.
+
+init_app() times every request by route and adds a Server-Timing header
+listing the spans recorded while handling it, e.g.
+
+    with metrics.span('render'):
+        ...
+
+Database time is collected automatically as the 'query' span. Each
+worker process keeps its own histograms and periodically writes them to
+<METRICS_DIR>/<pid>.json; /metrics merges the files of all live workers,
+so the numbers cover the whole gunicorn server rather than whichever
+worker answered the scrape.
+"""
+import atexit
+import bisect
+import cProfile
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds in seconds, Prometheus style; +Inf is implicit
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_METRIC = 'http_request_duration_seconds'
+SPAN_METRIC = 'span_duration_seconds'
+TELEMETRY_DROPPED_METRIC = 'telemetry_chunks_dropped_total'
+
+HELP = {
+    REQUEST_METRIC: 'Time from request start until the response is returned (first byte for streams)',
+    SPAN_METRIC: 'Time spent in named phases of request handling',
+    TELEMETRY_DROPPED_METRIC: 'Accepted telemetry batches that could not be written',
+}
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
+class Registry:
+    """Histograms and counters of this process, keyed by (metric, labels)"""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), f'visual-snow-metrics-{os.getuid()}')
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._pid = os.getpid()
+        self._flushed_at = 0.0
+        atexit.register(self.flush)
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Forked worker: counts inherited from the parent belong to it
+            self._histograms = {}
+            self._counters = {}
+            self._pid = os.getpid()
+
+    def observe(self, metric, labels, seconds):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, metric, labels, amount=1):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = Counter()
+            counter.value += amount
+
+    def snapshot(self):
+        """[metric, labels, bucket counts, sum] per histogram; counters have None for the buckets"""
+        with self._lock:
+            return [
+                [metric, list(labels), list(histogram.counts), histogram.sum]
+                for (metric, labels), histogram in self._histograms.items()
+            ] + [
+                [metric, list(labels), None, counter.value]
+                for (metric, labels), counter in self._counters.items()
+            ]
+
+    def flush(self):
+        """Write this process's histograms and counters for /metrics in other workers"""
+        if self._pid != os.getpid() or not (self._histograms or self._counters):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(self.directory, f'{self._pid}.json'))
+        self._flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        """Histograms and counters summed over every live worker's file"""
+        self.flush()
+        merged = {}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith('.json') or not name[:-len('.json')].isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            if not _alive(int(name[:-len('.json')])):
+                # A worker that exited; its counts leave the totals (a counter reset)
+                _unlink(path)
+                continue
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, counts, total in entries:
+                key = (metric, tuple(tuple(pair) for pair in labels))
+                if counts is None:
+                    counter = merged.get(key)
+                    if counter is None:
+                        counter = merged[key] = Counter()
+                    counter.value += total
+                    continue
+                histogram = merged.get(key)
+                if histogram is None:
+                    histogram = merged[key] = Histogram()
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        merged = self.collect()
+        for metric in sorted({metric for metric, _ in merged}):
+            entries = sorted((labels, value) for (name, labels), value in merged.items() if name == metric)
+            lines.append(f'# HELP {metric} {HELP.get(metric, metric)}')
+            if isinstance(entries[0][1], Counter):
+                lines.append(f'# TYPE {metric} counter')
+                for labels, counter in entries:
+                    label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+                    lines.append(f'{metric}{{{label_text}}} {counter.value}')
+                continue
+            lines.append(f'# TYPE {metric} histogram')
+            for labels, histogram in entries:
+                label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+                prefix = label_text + ',' if label_text else ''
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label_text}}} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{{{label_text}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry(
+    directory=os.environ.get('METRICS_DIR'),
+    flush_interval=float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+)
+
+
+# Spans recorded on a thread working for a request (see detached())
+_detached = threading.local()
+
+
+def current_route():
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return getattr(_detached, 'route', None) or 'background'
+
+
+def record_span(name, seconds):
+    """Add a finished span to the histograms and to this request's Server-Timing"""
+    registry.observe(SPAN_METRIC, {'route': current_route(), 'span': name}, seconds)
+    if has_request_context():
+        timings = g.setdefault('_span_timings', {})
+    else:
+        timings = getattr(_detached, 'timings', None)
+        if timings is None:
+            return
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def detached(route):
+    """
+    Attribute spans recorded by this (non-request) thread to route, and
+    collect them into the yielded dict for add_timings() in the request
+    """
+    _detached.route = route
+    _detached.timings = timings = {}
+    try:
+        yield timings
+    finally:
+        _detached.route = _detached.timings = None
+
+
+def add_timings(timings):
+    """Add spans collected by detached() to this request's Server-Timing"""
+    totals = g.setdefault('_span_timings', {})
+    for name, seconds in timings.items():
+        totals[name] = totals.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+# Profiler hook: factory(route) returns a context manager wrapped around
+# a sampled fraction of requests
+_profiler = {'factory': None, 'rate': 0.0}
+
+
+def set_profiler(factory, sample_rate):
+    _profiler['factory'] = factory
+    _profiler['rate'] = sample_rate
+
+
+class CProfileSampler:
+    """Profiler factory that dumps one cProfile .prof file per sampled request"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @contextmanager
+    def __call__(self, route):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+            profile.dump_stats(os.path.join(self.directory, f'{slug}-{time.time():.3f}-{os.getpid()}.prof'))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is not None:
+        record_span('query', time.perf_counter() - start)
+
+
+def _start_request():
+    g._metrics_start = time.perf_counter()
+    factory = _profiler['factory']
+    if factory is not None and random.random() < _profiler['rate']:
+        profiler = factory(current_route())
+        profiler.__enter__()
+        g._profiler = profiler
+
+
+def _record_request(status):
+    start = g.pop('_metrics_start', None)
+    if start is None:
+        return None
+    total = time.perf_counter() - start
+    registry.observe(REQUEST_METRIC, {
+        'route': current_route(), 'method': request.method, 'status': str(status)
+    }, total)
+    registry.maybe_flush()
+    return total
+
+
+def _finish_request(response):
+    total = _record_request(response.status_code)
+    if total is not None:
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in g.get('_span_timings', {}).items()]
+        entries.append(f'total;dur={total * 1000:.2f}')
+        response.headers.add('Server-Timing', ', '.join(entries))
+    return response
+
+
+def _teardown_request(exc):
+    # Requests that raised never reach after_request
+    _record_request(500)
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        profiler.__exit__(None, None, None)
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    if sample_rate > 0:
+        set_profiler(CProfileSampler(os.environ.get('PROFILE_DIR', 'profiles')), sample_rate)
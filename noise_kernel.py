@@ -0,0 +1,149 @@
+"""
+Shared visual snow noise kernel.
+
+Brightness and noise are applied in one pass over a caller-supplied (or
+thread-local) output buffer. Brightness on uint8 frames is a 256-entry
+lookup table, and random values are only drawn for the pixels the noise
+lands on instead of through full-frame random arrays and masks.
+"""
+import math
+import threading
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+DEFAULT_DENSITY = 0.15
+
+# Above this density a dense mask is cheaper than sampling indices
+DENSE_THRESHOLD = 0.5
+
+_local = threading.local()
+
+
+def make_rng(seed=None):
+    """Return a np.random.Generator; seed may be None, an int or a Generator"""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def _thread_rng():
+    rng = getattr(_local, 'rng', None)
+    if rng is None:
+        # Generators are not thread-safe, so each thread gets its own
+        rng = _local.rng = np.random.default_rng()
+    return rng
+
+
+def thread_buffer(shape, dtype=np.uint8, name='frame'):
+    """
+    Reusable per-thread output buffer.
+
+    The contents are overwritten by the next render on the same thread,
+    so callers must be done with it (e.g. encoded it) before rendering again.
+    """
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    dtype = np.dtype(dtype)
+    buf = buffers.get(name)
+    if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+@lru_cache(maxsize=64)
+def brightness_lut(brightness):
+    """uint8 lookup table matching clip(value * brightness) truncated to uint8"""
+    lut = np.clip(np.arange(256, dtype=np.float32) * np.float32(brightness), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_brightness(base, brightness, out):
+    if brightness == 1.0:
+        np.copyto(out, base, casting='unsafe')
+    elif base.dtype == np.uint8 and out.dtype == np.uint8:
+        # cv2.LUT avoids the intp index copy np.take would make
+        cv2.LUT(base, brightness_lut(float(brightness)), dst=out)
+    else:
+        np.multiply(base, np.float32(brightness), out=out, casting='unsafe')
+        np.clip(out, 0, 255, out=out)
+    return out
+
+
+def sample_pixels(rng, pixel_count, density):
+    """Flat indices of the pixels that receive noise"""
+    if density <= 0:
+        return np.empty(0, dtype=np.intp)
+    if density >= DENSE_THRESHOLD:
+        return np.flatnonzero(rng.random(pixel_count, dtype=np.float32) < density)
+    # Draws are taken with replacement; Poisson(-n*ln(1-p)) draws cover a
+    # fraction p of the pixels in expectation, matching an independent mask
+    draws = rng.poisson(-pixel_count * math.log1p(-density))
+    return rng.integers(0, pixel_count, size=draws, dtype=np.intp)
+
+
+@lru_cache(maxsize=64)
+def noise_lut(noise_intensity):
+    """uint8 table mapping a noise sample to its contribution, saturated at 255"""
+    lut = np.clip(np.arange(256, dtype=np.float32) * np.float32(noise_intensity), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def _draw_noise(rng, pixel_count, channels, noise_intensity, density):
+    """(flat pixel indices, per-channel uint8 contributions), or None if no pixel is hit"""
+    idx = sample_pixels(rng, pixel_count, density)
+    if idx.size == 0:
+        return None
+    samples = rng.integers(0, 256, size=(idx.size, channels), dtype=np.uint8)
+    cv2.LUT(samples, noise_lut(float(noise_intensity)), dst=samples)
+    return idx, samples
+
+
+def _scatter(target, idx, values):
+    """target's pixel idx[i] = values[i], moving whole pixels as opaque items"""
+    channels = values.shape[1]
+    pixel = np.dtype((np.void, channels))
+    target.reshape(-1, channels).view(pixel).ravel()[idx] = values.view(pixel).ravel()
+
+
+def add_noise(frame, noise_intensity, density=DEFAULT_DENSITY, rng=None):
+    """Add sparse uniform noise scaled by noise_intensity to frame in place"""
+    if not frame.flags.c_contiguous:
+        raise ValueError('frame must be C-contiguous to be updated in place')
+    rng = _thread_rng() if rng is None else make_rng(rng)
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+
+    noise = _draw_noise(rng, height * width, channels, noise_intensity, density)
+    if noise is None:
+        return frame
+    delta = thread_buffer(frame.shape[:2] + ((channels,) if frame.ndim == 3 else ()), name='noise')
+    delta.fill(0)
+    _scatter(delta, *noise)
+
+    # Base values are integral, so a saturating add of the truncated
+    # contribution equals clip(frame + noise * intensity)
+    if frame.dtype == np.uint8:
+        cv2.add(frame, delta, dst=frame)
+    else:
+        np.add(frame, delta, out=frame, casting='unsafe')
+        np.minimum(frame, 255, out=frame)
+    return frame
+
+
+def render_visual_snow(base, brightness=1.0, noise_intensity=0.4, density=DEFAULT_DENSITY, rng=None, out=None):
+    """
+    Return clip(base * brightness) with visual snow added.
+
+    base may be uint8 or float32; the result has the dtype of out (or of
+    base when out is None) and is written into out when given.
+    """
+    if out is None:
+        out = np.empty_like(base)
+    apply_brightness(base, brightness, out)
+    add_noise(out, noise_intensity, density, rng)
+    return out
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class VersionedCache:
+    """
+    Per-worker cache of values derived from the study coordinates.
+
+    Entries are tagged with the shared version counter they were built
+    from. The counter is re-read from the database at most once per
+    check_interval seconds, so steady-state reads do no database work;
+    writes in this worker call invalidate() to force an immediate re-check,
+    and other workers notice within check_interval.
+    """
+
+    def __init__(self, read_version, check_interval=2.0):
+        self.read_version = read_version
+        self.check_interval = check_interval
+        self._version = None
+        self._checked_at = 0.0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def version(self):
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.check_interval:
+            version = self.read_version()
+            with self._lock:
+                self._version = version
+                self._checked_at = now
+        return self._version
+
+    def get(self, name, build):
+        """Return the cached value for name, rebuilding it if the version moved"""
+        version = self.version()
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        value = build()
+        with self._lock:
+            self._entries[name] = (version, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+            self._version = None
+
+    def clear(self):
+        """Drop every entry, forcing the next get() of each to rebuild"""
+        with self._lock:
+            self._entries.clear()
+            self._checked_at = 0.0
+            self._version = None
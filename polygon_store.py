@@ -0,0 +1,427 @@
+"""
+Polygon sets as immutable, versioned records.
+
+The study always uses the set that study_state.active_set_id points to.
+Saved sets are frozen and reference their StoredCoordinate rows, so
+activating one is a single pointer update and saving one never copies
+geometry. Admin edits go to an unfrozen draft set: the first edit after
+a frozen set is activated forks a draft that references the same rows,
+and editing a row that a frozen set still references writes a new row
+(copy-on-write). None of these functions commit.
+
+Every write also increments study_state.coordinates_version, and
+callbacks registered with on_change() run after such a commit.
+"""
+import json
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import db, StoredCoordinate, PolygonSet, PolygonSetMember, StudyState
+
+DRAFT_PREFIX = '__draft__'
+
+
+class SetError(Exception):
+    """A polygon set operation that cannot be applied; carries an HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+_change_listeners = []
+
+
+def on_change(callback):
+    """Call callback() after any commit that changed coordinates or sets"""
+    _change_listeners.append(callback)
+    return callback
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_change(session):
+    if session.info.pop('coordinates_changed', False):
+        for callback in _change_listeners:
+            callback()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_change(session, previous_transaction):
+    session.info.pop('coordinates_changed', None)
+
+
+def _changed():
+    """
+    Bump the shared version counter inside the current transaction. Once
+    is enough however many edits the transaction makes, so a bulk edit
+    pays for a single UPDATE.
+    """
+    if db.session.info.get('coordinates_changed'):
+        return
+    get_state()
+    db.session.execute(
+        db.update(StudyState)
+        .where(StudyState.id == 1)
+        .values(coordinates_version=StudyState.coordinates_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.info['coordinates_changed'] = True
+
+
+def current_version():
+    """The shared version counter, read straight from the database"""
+    version = db.session.query(StudyState.coordinates_version).filter(StudyState.id == 1).scalar()
+    if version is None:
+        version = get_state().coordinates_version
+    return version
+
+
+def get_state():
+    state = db.session.get(StudyState, 1)
+    if state is None:
+        state = _initialize_state()
+    return state
+
+
+def _initialize_state():
+    """
+    First use after upgrading: existing coordinate rows become the working
+    draft and legacy sets get member rows. Runs in its own transaction.
+    """
+    try:
+        materialize_legacy_sets()
+        draft = _new_draft()
+        unreferenced = db.select(db.literal(draft.id), StoredCoordinate.id).where(
+            ~db.exists().where(PolygonSetMember.coordinate_id == StoredCoordinate.id)
+        )
+        db.session.execute(
+            db.insert(PolygonSetMember).from_select(['set_id', 'coordinate_id'], unreferenced)
+        )
+        state = StudyState(id=1, active_set_id=draft.id)
+        db.session.add(state)
+        db.session.commit()
+    except IntegrityError:
+        # Another worker initialized the state first
+        db.session.rollback()
+        state = db.session.get(StudyState, 1)
+    return state
+
+
+def materialize_legacy_sets():
+    """Turn sets that still embed polygons as JSON into member references"""
+    legacy = PolygonSet.query.filter(
+        PolygonSet.polygons_json != '[]',
+        ~db.exists().where(PolygonSetMember.set_id == PolygonSet.id)
+    ).all()
+    for polygon_set in legacy:
+        for data in polygon_set.polygons:
+            coord = StoredCoordinate(label=data.get('label', ''))
+            try:
+                coord.points = data.get('points', [])
+            except ValueError:
+                # Kept as it was; hit testing skips malformed polygons
+                coord.points_json = json.dumps(data.get('points', []))
+            db.session.add(coord)
+            db.session.flush()
+            db.session.add(PolygonSetMember(set_id=polygon_set.id, coordinate_id=coord.id))
+        polygon_set.polygons_json = '[]'
+        if polygon_set.version is None:
+            polygon_set.version = _next_version()
+    db.session.flush()
+
+
+def pack_legacy_points(batch_size=500):
+    """
+    Convert coordinate rows still holding JSON points to packed vertices;
+    returns how many were converted. Commits per batch. The geometry is
+    unchanged, so no version bump is needed.
+    """
+    converted = 0
+    last_id = 0
+    while True:
+        rows = (
+            StoredCoordinate.query
+            .filter(StoredCoordinate.points_data.is_(None), StoredCoordinate.id > last_id)
+            .order_by(StoredCoordinate.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return converted
+        for coord in rows:
+            try:
+                coord.points = json.loads(coord.points_json)
+                converted += 1
+            except ValueError:
+                pass
+        last_id = rows[-1].id
+        db.session.commit()
+
+
+def _next_version():
+    """
+    Draw the next set version from the counter on the study_state row. The
+    UPDATE locks that row until commit, so two concurrent saves cannot both
+    read the same max(version) and take the same number. The max only seeds
+    the counter on databases whose sets were versioned before it existed.
+    """
+    highest = db.func.coalesce(db.select(db.func.max(PolygonSet.version)).scalar_subquery(), 0)
+    version = db.session.execute(
+        db.update(StudyState)
+        .where(StudyState.id == 1)
+        .values(set_version=db.case((StudyState.set_version >= highest, StudyState.set_version), else_=highest) + 1)
+        .returning(StudyState.set_version)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if version is None:
+        # No state row yet: this is _initialize_state's own transaction, and a
+        # concurrent initialization fails on the state insert and rolls back
+        version = (db.session.query(db.func.max(PolygonSet.version)).scalar() or 0) + 1
+    return version
+
+
+def _new_draft():
+    draft = PolygonSet(name=f'{DRAFT_PREFIX}{uuid.uuid4().hex[:16]}', frozen=False)
+    db.session.add(draft)
+    db.session.flush()
+    return draft
+
+
+def _delete_set_rows(polygon_set):
+    """Delete a set and any coordinate rows only it referenced"""
+    member_ids = [row.coordinate_id for row in PolygonSetMember.query.filter_by(set_id=polygon_set.id)]
+    PolygonSetMember.query.filter_by(set_id=polygon_set.id).delete(synchronize_session=False)
+    if member_ids:
+        still_used = {
+            row.coordinate_id for row in
+            PolygonSetMember.query.filter(PolygonSetMember.coordinate_id.in_(member_ids))
+        }
+        orphans = [cid for cid in member_ids if cid not in still_used]
+        if orphans:
+            StoredCoordinate.query.filter(StoredCoordinate.id.in_(orphans)).delete(synchronize_session=False)
+    db.session.delete(polygon_set)
+
+
+def active_set():
+    state = get_state()
+    return db.session.get(PolygonSet, state.active_set_id) if state.active_set_id else None
+
+
+def active_coordinates():
+    """StoredCoordinate rows of the active set, in id order"""
+    state = get_state()
+    if state.active_set_id is None:
+        return []
+    return (
+        StoredCoordinate.query
+        .join(PolygonSetMember, PolygonSetMember.coordinate_id == StoredCoordinate.id)
+        .filter(PolygonSetMember.set_id == state.active_set_id)
+        .order_by(StoredCoordinate.id)
+        .all()
+    )
+
+
+def editable_set():
+    """The draft set edits go to, forking one from a frozen active set if needed"""
+    state = get_state()
+    current = db.session.get(PolygonSet, state.active_set_id) if state.active_set_id else None
+    if current is not None and not current.frozen:
+        return current
+
+    draft = _new_draft()
+    if current is not None:
+        # References only; no geometry is copied
+        db.session.execute(
+            db.insert(PolygonSetMember).from_select(
+                ['set_id', 'coordinate_id'],
+                db.select(db.literal(draft.id), PolygonSetMember.coordinate_id).where(
+                    PolygonSetMember.set_id == current.id
+                )
+            )
+        )
+    # Compare-and-swap the pointer: if another editor forked (or activated
+    # a set) since we read it, their transaction has moved it and ours
+    # must not overwrite it, or their edits would vanish with their draft
+    swapped = db.session.execute(
+        db.update(StudyState)
+        .where(StudyState.id == 1, StudyState.active_set_id == state.active_set_id)
+        .values(active_set_id=draft.id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.expire(state, ['active_set_id'])
+    if not swapped:
+        _delete_set_rows(draft)
+        db.session.flush()
+        return editable_set()
+    return draft
+
+
+def _shared_elsewhere(coordinate_id, set_id):
+    return db.session.query(PolygonSetMember.query.filter(
+        PolygonSetMember.coordinate_id == coordinate_id,
+        PolygonSetMember.set_id != set_id
+    ).exists()).scalar()
+
+
+def add_coordinate(coord):
+    """Add a new StoredCoordinate to the editable set"""
+    return add_coordinates([coord])[0]
+
+
+def add_coordinates(coords):
+    """Add new StoredCoordinate rows to the editable set with a single flush"""
+    if not coords:
+        return coords
+    draft = editable_set()
+    db.session.add_all(coords)
+    db.session.flush()
+    db.session.add_all([PolygonSetMember(set_id=draft.id, coordinate_id=coord.id) for coord in coords])
+    _changed()
+    return coords
+
+
+def get_active_coordinate(coordinate_id):
+    """A coordinate row of the active set, or None"""
+    state = get_state()
+    member = db.session.get(PolygonSetMember, (state.active_set_id, coordinate_id)) if state.active_set_id else None
+    return db.session.get(StoredCoordinate, coordinate_id) if member else None
+
+
+def writable_coordinate(coordinate_id):
+    """
+    The row to apply an edit of coordinate_id to. If a frozen set still
+    references the row, a copy replaces it in the draft and is returned.
+    """
+    if get_active_coordinate(coordinate_id) is None:
+        return None
+    draft = editable_set()
+    _changed()
+    coord = db.session.get(StoredCoordinate, coordinate_id)
+    if not _shared_elsewhere(coordinate_id, draft.id):
+        return coord
+
+    copy = StoredCoordinate(label=coord.label, points_json=coord.points_json, points_data=coord.points_data)
+    db.session.add(copy)
+    db.session.flush()
+    db.session.get(PolygonSetMember, (draft.id, coordinate_id)).coordinate_id = copy.id
+    return copy
+
+
+def remove_coordinates(coordinate_ids):
+    """Remove coordinates from the editable set; returns how many were removed"""
+    coordinate_ids = [cid for cid in coordinate_ids if get_active_coordinate(cid) is not None]
+    if not coordinate_ids:
+        return 0
+    draft = editable_set()
+    removed = PolygonSetMember.query.filter(
+        PolygonSetMember.set_id == draft.id,
+        PolygonSetMember.coordinate_id.in_(coordinate_ids)
+    ).delete(synchronize_session=False)
+    _changed()
+    # Rows no other set references are deleted outright
+    orphans = [cid for cid in coordinate_ids if not _shared_elsewhere(cid, draft.id)]
+    if orphans:
+        StoredCoordinate.query.filter(StoredCoordinate.id.in_(orphans)).delete(synchronize_session=False)
+    return removed
+
+
+def clear_coordinates():
+    """Make an empty draft the active set"""
+    state = get_state()
+    previous = db.session.get(PolygonSet, state.active_set_id) if state.active_set_id else None
+    state.active_set_id = _new_draft().id
+    db.session.flush()
+    if previous is not None and not previous.frozen:
+        _delete_set_rows(previous)
+    _changed()
+
+
+def list_sets(geometry=True):
+    """
+    Frozen sets by name with their polygon counts and, unless geometry is
+    False, the polygons themselves (loaded in one more query)
+    """
+    query = PolygonSet.query.filter(PolygonSet.frozen.is_(True)).order_by(PolygonSet.created_at)
+    if geometry:
+        query = query.options(db.selectinload(PolygonSet.members))
+    sets = query.all()
+    counts = dict(
+        db.session.query(PolygonSetMember.set_id, db.func.count())
+        .filter(PolygonSetMember.set_id.in_([polygon_set.id for polygon_set in sets]))
+        .group_by(PolygonSetMember.set_id)
+        .all()
+    ) if sets else {}
+    active_id = get_state().active_set_id
+    result = {}
+    for polygon_set in sets:
+        data = polygon_set.to_dict(geometry=geometry)
+        data['polygon_count'] = counts.get(polygon_set.id, 0)
+        data['active'] = polygon_set.id == active_id
+        result[polygon_set.name] = data
+    return result
+
+
+def save_set(name, description='', created_at=None):
+    """
+    Snapshot the active set under a new name. A draft is frozen in place;
+    a frozen active set gets a new set referencing the same rows.
+    """
+    if PolygonSet.query.filter_by(name=name).first() is not None:
+        raise SetError('A set with this name already exists; saved sets are immutable', 409)
+    state = get_state()
+    current = db.session.get(PolygonSet, state.active_set_id) if state.active_set_id else None
+    if current is None:
+        current = editable_set()
+
+    if not current.frozen:
+        saved = current
+        saved.name = name
+        saved.frozen = True
+    else:
+        saved = PolygonSet(name=name)
+        db.session.add(saved)
+        db.session.flush()
+        db.session.execute(
+            db.insert(PolygonSetMember).from_select(
+                ['set_id', 'coordinate_id'],
+                db.select(db.literal(saved.id), PolygonSetMember.coordinate_id).where(
+                    PolygonSetMember.set_id == current.id
+                )
+            )
+        )
+    saved.description = description
+    if created_at is not None:
+        saved.created_at = created_at
+    saved.version = _next_version()
+    db.session.flush()
+    _changed()
+    return saved
+
+
+def activate_set(name):
+    """Point the study at a frozen set; an unsaved draft is discarded"""
+    polygon_set = PolygonSet.query.filter_by(name=name, frozen=True).first()
+    if polygon_set is None:
+        raise SetError('Set not found', 404)
+    state = get_state()
+    previous = db.session.get(PolygonSet, state.active_set_id) if state.active_set_id else None
+    state.active_set_id = polygon_set.id
+    db.session.flush()
+    if previous is not None and not previous.frozen:
+        _delete_set_rows(previous)
+    _changed()
+    return polygon_set
+
+
+def delete_set(name):
+    """Delete one frozen set; the active set cannot be deleted"""
+    polygon_set = PolygonSet.query.filter_by(name=name, frozen=True).first()
+    if polygon_set is None:
+        raise SetError('Set not found', 404)
+    if get_state().active_set_id == polygon_set.id:
+        raise SetError('Cannot delete the active set', 409)
+    _delete_set_rows(polygon_set)
+    _changed()
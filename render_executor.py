@@ -0,0 +1,174 @@
+"""
+Bounded thread pool for image renders.
+
+Requests hand their render to a few dedicated threads (OpenCV and numpy
+release the GIL for the heavy work) and wait for the result. At most
+max_queue renders wait for a free thread; past that submit() raises
+Saturated straight away, so a burst of image requests is answered with
+503s instead of occupying every request thread while database routes
+queue behind it. Concurrent submits with the same key share one render
+(single flight), and a render whose waiters have all given up is
+skipped rather than run. max_waiters caps the callers blocked in
+submit() at once, coalesced ones included, so it bounds how many request
+threads renders can hold however the requests are keyed.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class Saturated(Exception):
+    """All render threads are busy and the queue is full"""
+
+
+class DeadlineExceeded(Exception):
+    """The render did not finish within the caller's timeout"""
+
+
+class _Job:
+    __slots__ = ('key', 'fn', 'future', 'deadline')
+
+    def __init__(self, key, fn, deadline):
+        self.key = key
+        self.fn = fn
+        self.future = Future()
+        self.deadline = deadline
+
+
+class RenderExecutor:
+    def __init__(self, workers=2, max_queue=8, max_waiters=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_waiters = max_waiters if max_waiters is not None else workers + max_queue
+        self.completed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.expired = 0
+        self._queued = 0
+        self._waiters = 0
+        self._inflight = {}
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+
+    def _ensure_workers(self):
+        # Threads do not survive a fork, so start them lazily in each worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._jobs = queue.Queue()
+            self._inflight = {}
+            self._queued = 0
+            self._waiters = 0
+            self._threads = []
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(self._jobs,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = os.getpid()
+
+    def submit(self, fn, key=None, timeout=None):
+        """
+        Run fn() on a render thread and return its result. Raises
+        Saturated if the queue is full, DeadlineExceeded after timeout
+        seconds, or whatever fn raised. A render already queued or running
+        under the same key is joined instead of starting another. Raises
+        Saturated too when max_waiters callers are already waiting.
+        """
+        self._ensure_workers()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            if self._waiters >= self.max_waiters:
+                self.rejected += 1
+                raise Saturated()
+            job = self._inflight.get(key) if key is not None else None
+            if job is not None:
+                self.coalesced += 1
+                # The shared render is worth running while anyone still waits
+                if job.deadline is not None:
+                    job.deadline = None if deadline is None else max(job.deadline, deadline)
+            else:
+                if self._queued >= self.max_queue:
+                    self.rejected += 1
+                    raise Saturated()
+                job = _Job(key, fn, deadline)
+                self._queued += 1
+                if key is not None:
+                    self._inflight[key] = job
+                self._jobs.put(job)
+            self._waiters += 1
+
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            return job.future.result(remaining)
+        except FutureTimeout:
+            raise DeadlineExceeded() from None
+        finally:
+            with self._lock:
+                self._waiters -= 1
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            with self._lock:
+                self._queued -= 1
+                expired = job.deadline is not None and time.monotonic() >= job.deadline
+                if expired:
+                    self._forget(job)
+                    self.expired += 1
+            if expired:
+                job.future.set_exception(DeadlineExceeded())
+                continue
+
+            try:
+                result = job.fn()
+            except Exception as e:
+                with self._lock:
+                    self._forget(job)
+                job.future.set_exception(e)
+                continue
+            with self._lock:
+                self._forget(job)
+                self.completed += 1
+            job.future.set_result(result)
+
+    def _forget(self, job):
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def shutdown(self, timeout=2.0):
+        """Stop the threads so none is mid-render during interpreter teardown"""
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self._queued,
+                'max_queue': self.max_queue,
+                'waiters': self._waiters,
+                'max_waiters': self.max_waiters,
+                'inflight': len(self._inflight),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'coalesced': self.coalesced,
+                'expired': self.expired
+            }
@@ -0,0 +1,137 @@
+"""
+Keyset-paginated study results for the admin view.
+
+Pages are ordered newest first on (timestamp, id) and continue from an
+opaque cursor holding the last row's position, so every page is an index
+range scan no matter how deep it is. The composite indexes on
+StudySession cover each filter combined with that order.
+"""
+import base64
+import json
+from datetime import datetime
+
+from database import db, StudySession
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+USERNAME_MODES = ('prefix', 'exact', 'contains')
+
+
+def encode_cursor(session):
+    raw = json.dumps([session.timestamp.isoformat() if session.timestamp else None, session.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, session_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(session_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_LIMIT)
+
+
+def filtered_query(image_mode=None, username=None, username_mode='contains'):
+    if username_mode not in USERNAME_MODES:
+        raise ValueError(f'Unsupported username mode: {username_mode}')
+    query = StudySession.query
+    if image_mode:
+        query = query.filter(StudySession.image_mode == image_mode)
+    if username:
+        if username_mode == 'exact':
+            query = query.filter(StudySession.username == username)
+        elif username_mode == 'prefix':
+            # Sargable LIKE 'abc%'; on Postgres served by the pattern_ops index
+            query = query.filter(StudySession.username.startswith(username, autoescape=True))
+        else:
+            # Leading wildcard: a trigram index on Postgres, a scan elsewhere
+            query = query.filter(StudySession.username.icontains(username, autoescape=True))
+    return query
+
+
+def page(query, limit=DEFAULT_LIMIT, cursor=None):
+    """
+    One page of sessions after cursor, plus the cursor for the next page
+    (None on the last page). Sessions without a timestamp come last.
+
+    Rows with a timestamp and rows without are paged as two separate
+    runs, each a plain descending order that a backward scan of the
+    (timestamp, id) indexes returns directly; mixing them in one ORDER BY
+    ... NULLS LAST with an OR'd keyset filter made the planner sort.
+    """
+    timestamp = session_id = None
+    if cursor is not None:
+        timestamp, session_id = decode_cursor(cursor)
+
+    rows = []
+    if cursor is None or timestamp is not None:
+        dated = query.filter(StudySession.timestamp.isnot(None))
+        if cursor is not None:
+            dated = dated.filter(db.tuple_(StudySession.timestamp, StudySession.id) < (timestamp, session_id))
+        rows = (
+            dated
+            .order_by(StudySession.timestamp.desc(), StudySession.id.desc())
+            .limit(limit + 1)
+            .all()
+        )
+        session_id = None
+    if len(rows) <= limit:
+        undated = query.filter(StudySession.timestamp.is_(None))
+        if session_id is not None:
+            undated = undated.filter(StudySession.id < session_id)
+        rows += (
+            undated
+            .order_by(StudySession.id.desc())
+            .limit(limit + 1 - len(rows))
+            .all()
+        )
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def estimate_count(query):
+    """
+    (count, exact) for a filtered query. Postgres answers from planner
+    statistics rather than counting; elsewhere an index-only COUNT(*) is
+    cheap enough.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return query.order_by(None).count(), True
+
+    if query.whereclause is None:
+        estimate = db.session.execute(db.text(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = 'study_sessions'::regclass"
+        )).scalar()
+        if estimate is not None and estimate >= 0:
+            return int(estimate), False
+
+    sql, params = explain_sql(query.order_by(None).with_entities(StudySession.id).statement, db.engine.dialect)
+    plan = db.session.connection().exec_driver_sql(sql, params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows']), False
+
+
+def explain_sql(statement, dialect):
+    """
+    (sql, parameters) for EXPLAINing statement through the driver. The
+    filters stay bound parameters rather than being inlined as literals
+    and re-parsed by text(), which would take a ':word' inside a username
+    filter for a parameter of its own.
+    """
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return f'EXPLAIN (FORMAT JSON) {compiled.string}', params
@@ -1,8 +1,23 @@
+import argparse
 import cv2
-import numpy as np
+import glob
+import hashlib
+import itertools
+import json
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-def add_visual_snow_noise(image_path, output_path, noise_intensity=0.15):
+# Allow running as `python scripts/generate_noisy_image.py` from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_codec
+from noise_kernel import render_visual_snow
+from stimuli import IMAGE_EXTENSIONS, DERIVED_SUFFIXES
+
+def add_visual_snow_noise(image_path, output_path, noise_intensity=0.15, seed=None):
     """
     Add visual snow noise to an image to simulate visual snow syndrome
     
@@ -10,6 +25,7 @@ def add_visual_snow_noise(image_path, output_path, noise_intensity=0.15):
         image_path: Path to the original image
         output_path: Path where the noisy image will be saved
         noise_intensity: Intensity of the noise (0.0 to 1.0)
+        seed: Optional seed for reproducible noise
     """
     # Read the image
     img = cv2.imread(image_path)
@@ -17,34 +33,8 @@ def add_visual_snow_noise(image_path, output_path, noise_intensity=0.15):
         print(f"Error: Could not load image from {image_path}")
         return False
     
-    # Get image dimensions
-    height, width, channels = img.shape
-    
-    # Generate random noise
-    # Create random noise with same dimensions as image
-    noise = np.random.randint(0, 256, (height, width, channels), dtype=np.uint8)
-    
-    # Create a mask for sparse noise (visual snow is not dense)
-    # Only about 15-20% of pixels should have noise
-    noise_mask = np.random.random((height, width)) < 0.18
-    
-    # Create the final noise overlay
-    final_noise = np.zeros_like(img)
-    
-    # Apply noise only where mask is True
-    for i in range(channels):
-        final_noise[:, :, i] = noise[:, :, i] * noise_mask
-    
-    # Blend the noise with the original image
-    # Convert to float for blending
-    img_float = img.astype(np.float32)
-    noise_float = final_noise.astype(np.float32)
-    
-    # Add noise with specified intensity
-    noisy_img = img_float + (noise_float * noise_intensity)
-    
-    # Clip values to valid range and convert back to uint8
-    noisy_img = np.clip(noisy_img, 0, 255).astype(np.uint8)
+    # Only about 15-20% of pixels should have noise (visual snow is not dense)
+    noisy_img = render_visual_snow(img, 1.0, noise_intensity, density=0.18, rng=seed)
     
     # Save the noisy image
     success = cv2.imwrite(output_path, noisy_img)
@@ -55,12 +45,223 @@ def add_visual_snow_noise(image_path, output_path, noise_intensity=0.15):
         print(f"Error: Could not save image to {output_path}")
         return False
 
-if __name__ == "__main__":
-    # Generate the noisy version of the image
-    input_path = "static/images/Computer_Room_Desk_2008.jpg"
-    output_path = "static/images/Computer_Room_Desk_2008_noisy.jpg"
+def find_images(inputs):
+    """Expand directories, globs and file paths into a sorted list of images"""
+    images = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item)
+        for path in candidates:
+            stem, ext = os.path.splitext(os.path.basename(path))
+            if os.path.isfile(path) and ext.lower() in IMAGE_EXTENSIONS and not stem.endswith(DERIVED_SUFFIXES):
+                images.add(os.path.abspath(path))
+    return sorted(images)
+
+def output_name(source, brightness, noise, density, seed, fmt):
+    # The source extension is kept so photo.jpg and photo.png don't share outputs
+    stem, source_ext = os.path.splitext(os.path.basename(source))
+    ext = image_codec.FORMATS[fmt][0]
+    return f"{stem}_{source_ext.lstrip('.').lower()}_b{brightness:g}_n{noise:g}_d{density:g}_s{seed}{ext}"
+
+def name_collisions(images):
+    """Groups of sources from different directories whose outputs would share names"""
+    by_name = {}
+    for path in images:
+        by_name.setdefault(os.path.basename(path).lower(), []).append(path)
+    return [paths for paths in by_name.values() if len(paths) > 1]
+
+def atomic_write(path, data):
+    """Write via a temporary file in the same directory so readers never see partial output"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# Decoded sources are kept per worker process; jobs arrive grouped by source
+_decoded = {}
+
+def render_job(job):
+    """Render, encode and write one grid point; returns its manifest entry"""
+    # A failure is reported with the job instead of raised, which would end
+    # the whole batch and drop the results still queued behind it
+    try:
+        return _render_job(job)
+    except Exception as e:
+        return dict(job, error=f'{type(e).__name__}: {e}')
+
+def _render_job(job):
+    started = time.perf_counter()
+    source = job['source']
+    img = _decoded.get(source)
+    if img is None:
+        _decoded.clear()
+        img = _decoded[source] = cv2.imread(source)
+    if img is None:
+        return dict(job, error=f'Could not load image from {source}')
+    decoded = time.perf_counter()
     
-    if os.path.exists(input_path):
-        add_visual_snow_noise(input_path, output_path, noise_intensity=0.35)
-    else:
-        print(f"Error: Input image not found at {input_path}")
\ No newline at end of file
+    noisy_img = render_visual_snow(img, job['brightness'], job['noise'], density=job['density'], rng=job['seed'])
+    rendered = time.perf_counter()
+    data = image_codec.encode(noisy_img, job['format'], job['quality'])
+    if data is None:
+        return dict(job, error='Could not encode image')
+    encoded = time.perf_counter()
+    
+    atomic_write(job['path'], data)
+    finished = time.perf_counter()
+    
+    return dict(
+        job,
+        sha256=hashlib.sha256(data).hexdigest(),
+        bytes=len(data),
+        timings_ms={
+            'decode': round((decoded - started) * 1000, 2),
+            'render': round((rendered - decoded) * 1000, 2),
+            'encode': round((encoded - rendered) * 1000, 2),
+            'write': round((finished - encoded) * 1000, 2)
+        }
+    )
+
+def manifest_source(manifest_path, source):
+    """Sources are stored relative to the manifest, so it reads the same from any cwd"""
+    return os.path.relpath(source, os.path.dirname(os.path.abspath(manifest_path)))
+
+def resolve_source(manifest_path, source):
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(manifest_path)), source))
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {'entries': {}}
+
+def save_manifest(path, manifest):
+    atomic_write(path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+def parse_floats(value):
+    return [float(v) for v in value.split(',') if v]
+
+def parse_seeds(value):
+    """Comma-separated seeds and/or inclusive ranges, e.g. '0-9,42'"""
+    seeds = []
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            seeds.extend(range(int(first), int(last) + 1))
+        elif part:
+            seeds.append(int(part))
+    return seeds
+
+def run_batch(args):
+    images = find_images(args.inputs)
+    if not images:
+        print("Error: No input images found")
+        return False
+    collisions = name_collisions(images)
+    if collisions:
+        for paths in collisions:
+            print(f"Error: these inputs would overwrite each other's outputs: {', '.join(paths)}")
+        return False
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, 'manifest.json')
+    manifest = load_manifest(manifest_path)
+    entries = manifest.setdefault('entries', {})
+    
+    # Build the parameter grid, skipping outputs a previous run already produced
+    jobs = []
+    skipped = 0
+    for source, brightness, noise, density, seed in itertools.product(
+            images, args.brightness, args.noise, args.density, args.seeds):
+        name = output_name(source, brightness, noise, density, seed, args.format)
+        path = os.path.join(args.output_dir, name)
+        # A manifest entry from another source of the same name (an earlier
+        # run over a different directory) is not this output
+        previous = entries.get(name)
+        if previous is not None and not args.force and resolve_source(manifest_path, previous.get('source', '')) != source:
+            print(f"Error: {path} was rendered from {resolve_source(manifest_path, previous.get('source', ''))}, not {source} (--force overwrites it)")
+            return False
+        if not args.force and previous is not None and os.path.exists(path):
+            skipped += 1
+            continue
+        jobs.append({
+            'name': name,
+            'path': path,
+            'source': source,
+            'brightness': brightness,
+            'noise': noise,
+            'density': density,
+            'seed': seed,
+            'format': args.format,
+            'quality': args.quality
+        })
+    
+    print(f"{len(jobs)} variants to render, {skipped} already rendered")
+    if not jobs:
+        return True
+    
+    started = time.perf_counter()
+    failures = []
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for done, result in enumerate(executor.map(render_job, jobs, chunksize=args.chunksize), 1):
+                if 'error' in result:
+                    failures.append(result)
+                    print(f"Error: {result['name']}: {result['error']}")
+                else:
+                    entry = {k: v for k, v in result.items() if k not in ('name', 'path')}
+                    entry['source'] = manifest_source(manifest_path, entry['source'])
+                    entries[result['name']] = entry
+                # Checkpoint the manifest so an interrupted run resumes where it stopped
+                if done % args.checkpoint_every == 0 or done == len(jobs):
+                    save_manifest(manifest_path, manifest)
+                    elapsed = time.perf_counter() - started
+                    print(f"{done}/{len(jobs)} rendered ({done / elapsed:.1f}/s)")
+    finally:
+        # Outputs finished since the last checkpoint are kept even if the pool dies
+        save_manifest(manifest_path, manifest)
+    
+    print(f"Manifest written to: {manifest_path}")
+    if failures:
+        print(f"{len(failures)} of {len(jobs)} variants failed (a rerun retries them):")
+        for result in failures:
+            print(f"  {result['name']}: {result['error']}")
+    return not failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render visual snow stimulus variants over a parameter grid')
+    parser.add_argument('inputs', nargs='*', help='Image files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', default='static/images/generated', help='Directory for rendered variants')
+    parser.add_argument('--brightness', type=parse_floats, default=[1.0], help='Comma-separated brightness values')
+    parser.add_argument('--noise', type=parse_floats, default=[0.35], help='Comma-separated noise intensities')
+    parser.add_argument('--density', type=parse_floats, default=[0.18], help='Comma-separated noise densities')
+    parser.add_argument('--seeds', type=parse_seeds, default=[0], help="Seeds, e.g. '0-99' or '1,2,3'")
+    parser.add_argument('--format', type=image_codec.parse_format, default='jpeg', help='jpeg, webp or png')
+    parser.add_argument('--quality', type=image_codec.parse_quality, default=None, help='Encoder quality (1-100)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunksize', type=int, default=16, help='Jobs handed to a worker at a time')
+    parser.add_argument('--checkpoint-every', type=int, default=50, help='Save the manifest every N outputs')
+    parser.add_argument('--manifest', default=None, help='Manifest path (default: <output-dir>/manifest.json)')
+    parser.add_argument('--force', action='store_true', help='Re-render outputs that already exist')
+    args = parser.parse_args(argv)
+    
+    if not args.inputs:
+        # Generate the noisy version of the study image
+        input_path = "static/images/Computer_Room_Desk_2008.jpg"
+        output_path = "static/images/Computer_Room_Desk_2008_noisy.jpg"
+        
+        if os.path.exists(input_path):
+            return add_visual_snow_noise(input_path, output_path, noise_intensity=0.35)
+        print(f"Error: Input image not found at {input_path}")
+        return False
+    
+    return run_batch(args)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
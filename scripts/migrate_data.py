@@ -2,105 +2,330 @@
 """
 Migration script to move data from JSON files to database
 Run this once to migrate your existing data before deploying
+
+Records are parsed one at a time and inserted in chunks, each committed
+together with a checkpoint, so large files (e.g. archived studies from
+other sites) migrate in bounded memory and an interrupted run resumes
+where it stopped. Study sessions get an idempotency key derived from the
+record contents, so re-migrating a file never duplicates rows.
 """
 
+import argparse
+import hashlib
 import json
 import os
-from app import app, db
-from database import StudySession, StoredCoordinate, PolygonSet
+import sys
+import tempfile
+import time
 from datetime import datetime
 
-def migrate_coordinates():
-    """Migrate stored_coordinates.json to database"""
-    if os.path.exists('stored_coordinates.json'):
-        with open('stored_coordinates.json', 'r') as f:
-            coordinates = json.load(f)
-        
-        for coord_data in coordinates:
-            coord = StoredCoordinate(
-                id=coord_data.get('id'),
-                label=coord_data.get('label', ''),
-                points=coord_data.get('points', [])
-            )
-            db.session.add(coord)
-        
-        print(f"Migrated {len(coordinates)} coordinate sets")
-
-def migrate_polygon_sets():
+# Allow running as `python scripts/migrate_data.py` from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from database import init_db, StudySession, StoredCoordinate, PolygonSet
+import exports
+import polygon_store
+import stats
+import submissions
+
+READ_SIZE = 64 * 1024
+# A single record larger than this is treated as malformed input
+MAX_RECORD_CHARS = 16 * 1024 * 1024
+WHITESPACE = ' \t\r\n'
+
+
+class MigrationError(Exception):
+    pass
+
+
+def iter_json_array(path, offset=0):
+    """
+    Yield (record, end_offset) for each element of a top-level JSON array,
+    reading READ_SIZE bytes at a time. end_offset is the byte offset just
+    past the element; passing it back as offset resumes after it. Files
+    ending in .ndjson/.jsonl are read as one record per line instead.
+    """
+    if path.endswith(('.ndjson', '.jsonl')):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if line.strip():
+                    yield json.loads(line), offset
+        return
+
+    decoder = json.JSONDecoder()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        state = 'after' if offset else 'start'
+        buffer = ''
+        pos = 0
+        # Element boundaries are found in decoded text; text up to char
+        # index mark has been counted into offset, re-encoded so the byte
+        # offset stays exact for multi-byte characters
+        mark = 0
+        eof = False
+        pending = b''
+
+        def advance(to):
+            nonlocal offset, mark
+            offset += len(buffer[mark:to].encode('utf-8'))
+            mark = to
+
+        def fill():
+            nonlocal buffer, pos, mark, eof, pending
+            advance(pos)
+            buffer = buffer[pos:]
+            pos = mark = 0
+            if len(buffer) > MAX_RECORD_CHARS:
+                raise MigrationError(f'{path}: record at byte {offset} is malformed or too large')
+            data = f.read(READ_SIZE)
+            if not data:
+                eof = True
+                return
+            data = pending + data
+            # Keep an incomplete trailing UTF-8 sequence for the next read
+            try:
+                text = data.decode('utf-8')
+                pending = b''
+            except UnicodeDecodeError as e:
+                if e.start < len(data) - 3:
+                    raise
+                text = data[:e.start].decode('utf-8')
+                pending = data[e.start:]
+            buffer += text
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos >= len(buffer):
+                if eof:
+                    raise MigrationError(f'{path}: unexpected end of file')
+                fill()
+                continue
+
+            char = buffer[pos]
+            if state == 'start':
+                if char != '[':
+                    raise MigrationError(f'{path}: expected a JSON array')
+                pos += 1
+                state = 'first'
+            elif state == 'after':
+                if char == ']':
+                    return
+                if char != ',':
+                    advance(pos)
+                    raise MigrationError(f'{path}: expected "," or "]" at byte {offset}')
+                pos += 1
+                state = 'value'
+            elif state == 'first' and char == ']':
+                return
+            else:
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # Most likely the element continues past the buffer
+                    if eof:
+                        raise
+                    fill()
+                    continue
+                if end == len(buffer) and not eof:
+                    # A number could continue in the next read
+                    fill()
+                    continue
+                pos = end
+                state = 'after'
+                advance(pos)
+                yield record, offset
+
+
+class Checkpoint:
+    """Per-file progress, rewritten atomically after every committed chunk"""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.files = {}
+        if not restart and os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f)
+
+    def start(self, source):
+        """(offset, records) to resume source from, or (0, 0) if it changed"""
+        stat = os.stat(source)
+        entry = self.files.get(os.path.abspath(source))
+        if entry is None:
+            return 0, 0
+        if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            print(f"{source} changed since the last run; starting over (migrated rows are skipped)")
+            return 0, 0
+        return entry['offset'], entry['records']
+
+    def save(self, source, offset, records, done=False):
+        stat = os.stat(source)
+        self.files[os.path.abspath(source)] = {
+            'offset': offset, 'records': records, 'done': done,
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.files, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def migrate_stream(source, checkpoint, chunk_size, insert_chunk):
+    """
+    Feed records of source to insert_chunk(records) chunk_size at a time,
+    committing and checkpointing after each chunk. insert_chunk returns
+    how many records it actually inserted.
+    """
+    if not os.path.exists(source):
+        return
+    offset, records = checkpoint.start(source)
+    entry = checkpoint.files.get(os.path.abspath(source))
+    if offset and entry and entry.get('done'):
+        print(f"{source}: already migrated ({records} records)")
+        return
+    if offset:
+        print(f"{source}: resuming after {records} records")
+
+    total_bytes = os.path.getsize(source)
+    started = time.monotonic()
+    processed = inserted = 0
+    chunk = []
+
+    def flush(end_offset, done=False):
+        nonlocal processed, inserted, records
+        if chunk:
+            inserted += insert_chunk(chunk)
+        db.session.commit()
+        processed += len(chunk)
+        records += len(chunk)
+        checkpoint.save(source, end_offset, records, done)
+        chunk.clear()
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"{source}: {records} records, {end_offset * 100 // max(total_bytes, 1)}% "
+              f"({processed / elapsed:.0f} records/s, {inserted} new)")
+
+    end_offset = offset
+    for record, end_offset in iter_json_array(source, offset):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            flush(end_offset)
+    flush(end_offset, done=True)
+
+
+def parse_timestamp(value):
+    # Records without a timestamp are stamped with the migration time
+    return exports.parse_timestamp(value) if value else datetime.utcnow()
+
+
+def record_key(record):
+    """Stable idempotency key for a migrated record"""
+    canonical = json.dumps(record, sort_keys=True, separators=(',', ':'))
+    return 'migrate:' + hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def insert_scores(records):
+    """Bulk insert game_scores.json records, skipping ones migrated before"""
+    sessions = []
+    for record in records:
+        try:
+            session = submissions.session_from_payload({**record, 'idempotencyKey': record_key(record)})
+        except submissions.SubmissionError as e:
+            print(f"Skipping invalid record: {e}")
+            continue
+        session.timestamp = parse_timestamp(record.get('timestamp'))
+        sessions.append(session)
+    # Multi-row INSERT ... ON CONFLICT DO NOTHING, plus the stats rollups
+    results = submissions.insert_sessions(sessions)
+    return sum(1 for _, created in results if created)
+
+
+def insert_coordinates(records):
+    """Add stored_coordinates.json records to the working draft, skipping known ids"""
+    ids = [record['id'] for record in records if record.get('id') is not None]
+    existing = {
+        row.id for row in db.session.query(StoredCoordinate.id).filter(StoredCoordinate.id.in_(ids))
+    } if ids else set()
+    inserted = 0
+    for record in records:
+        if record.get('id') in existing:
+            continue
+        polygon_store.add_coordinate(StoredCoordinate(
+            id=record.get('id'),
+            label=record.get('label', ''),
+            points=record.get('points', [])
+        ))
+        inserted += 1
+    return inserted
+
+
+def migrate_polygon_sets(path):
     """Migrate polygon_sets.json to database"""
-    if os.path.exists('polygon_sets.json'):
-        with open('polygon_sets.json', 'r') as f:
-            polygon_sets = json.load(f)
-        
-        for name, set_data in polygon_sets.items():
-            polygon_set = PolygonSet(
-                name=name,
-                description=set_data.get('description', ''),
-                polygons=set_data.get('polygons', []),
-                created_at=datetime.fromisoformat(set_data['created_at'].replace('Z', '+00:00')) if set_data.get('created_at') else datetime.utcnow()
-            )
-            db.session.add(polygon_set)
-        
-        print(f"Migrated {len(polygon_sets)} polygon sets")
-
-def migrate_scores():
-    """Migrate game_scores.json to database"""
-    if os.path.exists('game_scores.json'):
-        with open('game_scores.json', 'r') as f:
-            scores = json.load(f)
-        
-        for score_data in scores:
-            # Handle questionnaire data if it exists
-            questionnaire = score_data.get('questionnaire', {})
-            
-            session = StudySession(
-                username=score_data['username'],
-                score=score_data['score'],
-                time_ms=score_data['time'],
-                clicks=score_data['clicks'],
-                found_objects=score_data['foundObjects'],
-                target_objects=score_data['targetObjects'],
-                image_mode=score_data.get('imageMode', 'normal'),
-                timestamp=datetime.fromisoformat(score_data['timestamp'].replace('Z', '+00:00')) if score_data.get('timestamp') else datetime.utcnow(),
-                frustrated=questionnaire.get('frustrated'),
-                challenged=questionnaire.get('challenged'),
-                happy=questionnaire.get('happy'),
-                angry=questionnaire.get('angry'),
-                upset=questionnaire.get('upset'),
-                defeated=questionnaire.get('defeated'),
-                content=questionnaire.get('content'),
-                joyful=questionnaire.get('joyful'),
-                heard_visual_snow=questionnaire.get('heardVisualSnow'),
-                have_visual_snow=questionnaire.get('haveVisualSnow')
-            )
-            db.session.add(session)
-        
-        print(f"Migrated {len(scores)} study sessions")
+    if not os.path.exists(path):
+        return
+    # A single object keyed by set name, written by the admin UI; small
+    # enough to load whole
+    with open(path, 'r') as f:
+        polygon_sets = json.load(f)
+
+    migrated = 0
+    for name, set_data in polygon_sets.items():
+        if PolygonSet.query.filter_by(name=name).first() is not None:
+            continue
+        polygon_set = PolygonSet(
+            name=name,
+            description=set_data.get('description', ''),
+            polygons=set_data.get('polygons', []),
+            created_at=parse_timestamp(set_data.get('created_at'))
+        )
+        db.session.add(polygon_set)
+        migrated += 1
+
+    # Saved sets reference coordinate rows instead of embedding them
+    db.session.flush()
+    polygon_store.materialize_legacy_sets()
+    db.session.commit()
+    print(f"Migrated {migrated} polygon sets ({len(polygon_sets) - migrated} already present)")
+
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scores', default='game_scores.json', help='Study sessions: JSON array or NDJSON')
+    parser.add_argument('--coordinates', default='stored_coordinates.json')
+    parser.add_argument('--polygon-sets', default='polygon_sets.json')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Records per insert and commit')
+    parser.add_argument('--checkpoint', default='.migrate_checkpoint.json', help='Progress file used to resume')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint (migrated rows are still skipped)')
+    args = parser.parse_args()
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be positive')
+
     with app.app_context():
         # Create all tables
-        db.create_all()
+        init_db()
+        stats.recompute_if_empty()
         print("Created database tables")
-        
+
+        checkpoint = Checkpoint(args.checkpoint, restart=args.restart)
+
         # Migrate data
-        migrate_coordinates()
-        migrate_polygon_sets()
-        migrate_scores()
-        
-        # Commit all changes
-        db.session.commit()
+        migrate_stream(args.coordinates, checkpoint, args.chunk_size, insert_coordinates)
+        migrate_polygon_sets(args.polygon_sets)
+        migrate_stream(args.scores, checkpoint, args.chunk_size, insert_scores)
         print("Migration completed successfully!")
-        
+
         # Show summary
         coord_count = StoredCoordinate.query.count()
         set_count = PolygonSet.query.count()
         session_count = StudySession.query.count()
-        
+
         print(f"\nDatabase summary:")
         print(f"- Coordinates: {coord_count}")
         print(f"- Polygon sets: {set_count}")
         print(f"- Study sessions: {session_count}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
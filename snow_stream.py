@@ -0,0 +1,61 @@
+import threading
+import time
+
+BOUNDARY = 'frame'
+
+
+class StreamLimiter:
+    """
+    Caps the number of concurrent streams served by one worker process
+    """
+
+    def __init__(self, max_streams):
+        self.max_streams = max_streams
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.max_streams:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active = max(0, self.active - 1)
+
+
+def mjpeg_stream(render_frame, fps, max_seconds, cpu_budget):
+    """
+    Yield multipart/x-mixed-replace parts produced by render_frame().
+
+    Frames are paced to at most fps. The CPU time spent rendering each
+    frame is measured, and the frame interval is stretched whenever needed
+    so the stream uses at most cpu_budget of one core on average.
+    """
+    min_interval = 1.0 / fps
+    interval = min_interval
+    started = time.monotonic()
+    next_frame = started
+
+    while time.monotonic() - started < max_seconds:
+        cpu_start = time.thread_time()
+        jpeg = render_frame()
+        cpu_used = time.thread_time() - cpu_start
+        if jpeg is None:
+            return
+        interval = max(min_interval, cpu_used / cpu_budget)
+
+        yield (
+            f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n'.encode()
+            + jpeg + b'\r\n'
+        )
+
+        next_frame += interval
+        delay = next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Fell behind (slow client or encoder); don't try to catch up with a burst
+            next_frame = time.monotonic()
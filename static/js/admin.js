@@ -21,6 +21,7 @@ const coordsSection = document.getElementById('coordsSection');
 const resultsSection = document.getElementById('resultsSection');
 const studyContent = document.getElementById('studyContent');
 const loadResultsBtn = document.getElementById('loadResultsBtn');
+const loadMoreResultsBtn = document.getElementById('loadMoreResultsBtn');
 const exportResultsBtn = document.getElementById('exportResultsBtn');
 const resultsCount = document.getElementById('resultsCount');
 const imageModeFilter = document.getElementById('imageModeFilter');
@@ -166,6 +167,9 @@ async function storePolygon() {
         });
         
         if (response.ok) {
+            // The server assigns the real id
+            const result = await response.json();
+            polygonData.id = result.id;
             storedPolygons.push(polygonData);
             displayStoredPolygons();
             updateStoredPolygonsDisplay();
@@ -224,7 +228,7 @@ async function deletePolygon(polygonId) {
     if (!confirm('Are you sure you want to delete this polygon?')) return;
     
     try {
-        const response = await fetch(`/api/coordinates?id=${polygonId}`, {
+        const response = await fetch(`/api/coordinates/${polygonId}`, {
             method: 'DELETE'
         });
         
@@ -344,7 +348,7 @@ async function savePolygonSet() {
 
 async function loadPolygonSets() {
     try {
-        const response = await fetch('/api/polygon-sets');
+        const response = await fetch('/api/polygon-sets?geometry=0');
         if (response.ok) {
             polygonSets = await response.json();
             displayPolygonSets();
@@ -376,10 +380,10 @@ function displayPolygonSets() {
         setDiv.innerHTML = `
             <div style="display: flex; justify-content: between; align-items: flex-start; margin-bottom: 10px;">
                 <div style="flex: 1;">
-                    <h5 style="margin: 0; color: #2c3e50;">${set.name}</h5>
+                    <h5 style="margin: 0; color: #2c3e50;">${set.name}${set.active ? ' <span style="color: #27ae60; font-size: 12px;">(active)</span>' : ''}</h5>
                     <p style="margin: 5px 0; color: #7f8c8d; font-size: 12px;">Created: ${createdDate}</p>
                     ${set.description ? `<p style="margin: 5px 0; color: #34495e; font-size: 14px;">${set.description}</p>` : ''}
-                    <p style="margin: 5px 0; color: #27ae60; font-size: 12px; font-weight: bold;">${set.polygons.length} polygon(s)</p>
+                    <p style="margin: 5px 0; color: #27ae60; font-size: 12px; font-weight: bold;">${set.polygon_count} polygon(s)</p>
                 </div>
             </div>
             <div style="display: flex; gap: 8px;">
@@ -417,6 +421,7 @@ async function loadPolygonSet(setName) {
                 polygonCounter = Math.max(...storedPolygons.map(p => p.id || 0)) + 1;
             }
             
+            await loadPolygonSets();
             alert(`Polygon set "${setName}" loaded successfully!`);
         } else {
             const error = await response.json();
@@ -477,36 +482,87 @@ function showResultsSection() {
 }
 
 // Results management functions
+const RESULTS_PAGE_SIZE = 100;
+let resultsCursor = null;
+let resultsTotal = null;
+let resultsRequest = 0;
+
+function resultsParams() {
+    const params = new URLSearchParams();
+    const imageMode = imageModeFilter.value;
+    const username = usernameFilter.value.trim();
+    if (imageMode) params.append('image_mode', imageMode);
+    if (username) params.append('username', username);
+    params.append('limit', RESULTS_PAGE_SIZE);
+    return params;
+}
+
+function updateResultsCount() {
+    let text = `${currentResults.length} result(s) loaded`;
+    if (resultsTotal !== null) {
+        text += ` of ${resultsTotal.exact ? '' : '~'}${resultsTotal.count}`;
+    }
+    resultsCount.textContent = text;
+    loadMoreResultsBtn.style.display = resultsCursor ? 'inline-block' : 'none';
+}
+
+async function fetchResultsPage(cursor) {
+    const params = resultsParams();
+    if (cursor) params.append('cursor', cursor);
+    const response = await fetch(`/api/admin/results?${params}`);
+    const data = await response.json();
+    if (!data.success) {
+        throw new Error(data.error || 'Failed to load results');
+    }
+    return data;
+}
+
 async function loadResults() {
+    // Filters can change while a page is in flight; only the latest request wins
+    const request = ++resultsRequest;
     try {
         loadResultsBtn.textContent = 'Loading...';
         loadResultsBtn.disabled = true;
         
-        // Get filter values
-        const imageMode = imageModeFilter.value;
-        const username = usernameFilter.value.trim();
+        const data = await fetchResultsPage(null);
+        if (request !== resultsRequest) return;
         
-        // Build query params
-        const params = new URLSearchParams();
-        if (imageMode) params.append('image_mode', imageMode);
-        if (username) params.append('username', username);
+        currentResults = data.results;
+        resultsCursor = data.next_cursor;
+        resultsTotal = { count: data.total, exact: data.total_exact };
+        displayResults(currentResults);
+        updateResultsCount();
+    } catch (error) {
+        console.error('Error loading results:', error);
+        alert('Error loading results: ' + error.message);
+    } finally {
+        if (request === resultsRequest) {
+            loadResultsBtn.textContent = 'Load Results';
+            loadResultsBtn.disabled = false;
+        }
+    }
+}
+
+async function loadMoreResults() {
+    if (!resultsCursor) return;
+    const request = resultsRequest;
+    try {
+        loadMoreResultsBtn.textContent = 'Loading...';
+        loadMoreResultsBtn.disabled = true;
         
-        const response = await fetch(`/api/admin/results?${params}`);
-        const data = await response.json();
+        const data = await fetchResultsPage(resultsCursor);
+        if (request !== resultsRequest) return;
         
-        if (data.success) {
-            currentResults = data.results;
-            displayResults(currentResults);
-            resultsCount.textContent = `${data.count} result(s) loaded`;
-        } else {
-            throw new Error(data.error || 'Failed to load results');
-        }
+        currentResults = currentResults.concat(data.results);
+        resultsCursor = data.next_cursor;
+        appendResults(data.results);
+        updateResultsCount();
     } catch (error) {
-        console.error('Error loading results:', error);
+        console.error('Error loading more results:', error);
         alert('Error loading results: ' + error.message);
     } finally {
-        loadResultsBtn.textContent = 'Load All Results';
-        loadResultsBtn.disabled = false;
+        loadMoreResultsBtn.textContent = 'Load More';
+        loadMoreResultsBtn.disabled = false;
     }
 }
 
@@ -516,7 +572,16 @@ function displayResults(results) {
         return;
     }
     
-    resultsTableBody.innerHTML = results.map(result => {
+    resultsTableBody.innerHTML = renderResultRows(results);
+}
+
+function appendResults(results) {
+    // Only the new page is rendered; existing rows are left in place
+    resultsTableBody.insertAdjacentHTML('beforeend', renderResultRows(results));
+}
+
+function renderResultRows(results) {
+    return results.map(result => {
         const timestamp = result.timestamp ? new Date(result.timestamp).toLocaleString() : 'N/A';
         const timeSeconds = (result.time_ms / 1000).toFixed(1);
         const questionnaire = result.questionnaire || {};
@@ -597,60 +662,18 @@ function showResultDetails(resultId) {
 }
 
 function exportResultsAsCSV() {
-    if (currentResults.length === 0) {
-        alert('No results to export. Please load results first.');
-        return;
-    }
-    
-    const csvHeaders = [
-        'ID', 'Username', 'Score', 'Time_MS', 'Clicks', 'Found_Objects', 'Target_Objects', 
-        'Image_Mode', 'Timestamp', 'Frustrated', 'Challenged', 'Happy', 'Angry', 'Upset', 
-        'Defeated', 'Content', 'Joyful', 'Heard_Visual_Snow', 'Have_Visual_Snow'
-    ];
-    
-    const csvRows = currentResults.map(result => {
-        const q = result.questionnaire || {};
-        return [
-            result.id,
-            result.username,
-            result.score,
-            result.time_ms,
-            result.clicks,
-            result.found_objects,
-            result.target_objects,
-            result.image_mode,
-            result.timestamp || '',
-            q.frustrated || '',
-            q.challenged || '',
-            q.happy || '',
-            q.angry || '',
-            q.upset || '',
-            q.defeated || '',
-            q.content || '',
-            q.joyful || '',
-            q.heard_visual_snow || '',
-            q.have_visual_snow || ''
-        ].map(field => `"${field}"`).join(',');
-    });
-    
-    const csvContent = [csvHeaders.join(','), ...csvRows].join('\n');
-    
-    // Create and download file
-    const blob = new Blob([csvContent], { type: 'text/csv' });
-    const url = window.URL.createObjectURL(blob);
-    const a = document.createElement('a');
-    a.href = url;
-    a.download = `visual_snow_study_results_${new Date().toISOString().split('T')[0]}.csv`;
-    document.body.appendChild(a);
-    a.click();
-    window.URL.revokeObjectURL(url);
-    document.body.removeChild(a);
+    // Export every matching session from the server, not just the pages loaded here
+    const params = resultsParams();
+    params.delete('limit');
+    params.append('format', 'csv');
+    window.location.href = `/api/export-data?${params}`;
 }
 
 // Event listeners for results section
 coordsNavBtn.addEventListener('click', showCoordsSection);
 resultsNavBtn.addEventListener('click', showResultsSection);
 loadResultsBtn.addEventListener('click', loadResults);
+loadMoreResultsBtn.addEventListener('click', loadMoreResults);
 exportResultsBtn.addEventListener('click', exportResultsAsCSV);
 imageModeFilter.addEventListener('change', loadResults);
 usernameFilter.addEventListener('input', debounce(loadResults, 500));
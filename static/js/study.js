@@ -30,6 +30,67 @@ let timerInterval = null;
 let taskComplete = false;
 let taskStarted = false;
 
+// One noise seed per participant so the exact stimulus frame can be reproduced
+const stimulusId = 'Computer_Room_Desk_2008';
+const stimulusSeed = Math.floor(Math.random() * 2147483647);
+// Render at the displayed size (800px wide) rather than the source resolution.
+// The noise pattern depends on the width as well as the seed, so it is fixed
+// once per participant and submitted with the seed.
+const stimulusWidth = Math.round(800 * (window.devicePixelRatio || 1));
+
+// Sent with every attempt to submit this participant's results, so a retry
+// after a timeout cannot store the session twice
+const idempotencyKey = (window.crypto && crypto.randomUUID)
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+
+// Pointer telemetry: sampled moves and every click, sent in batches to
+// /api/telemetry under the same key so they can be matched to the session
+const TELEMETRY_MOVE_INTERVAL = 100;   // ms between recorded moves
+const TELEMETRY_FLUSH_INTERVAL = 5000; // ms between batches
+const TELEMETRY_BATCH_SIZE = 200;
+const TELEMETRY_KINDS = { move: 0, hit: 1, miss: 2 };
+let telemetryEvents = newTelemetryBatch();
+let telemetrySeq = 0;
+let lastMoveRecorded = 0;
+
+function newTelemetryBatch() {
+    return { t: [], x: [], y: [], kind: [], polygon: [] };
+}
+
+function recordEvent(kind, coords, polygonId) {
+    if (!startTime) return;
+    
+    telemetryEvents.t.push(Date.now() - startTime);
+    telemetryEvents.x.push(coords.x);
+    telemetryEvents.y.push(coords.y);
+    telemetryEvents.kind.push(TELEMETRY_KINDS[kind]);
+    telemetryEvents.polygon.push(polygonId == null ? -1 : polygonId);
+    if (telemetryEvents.t.length >= TELEMETRY_BATCH_SIZE) {
+        flushTelemetry(false);
+    }
+}
+
+function flushTelemetry(leaving) {
+    if (telemetryEvents.t.length === 0) return;
+    
+    const body = JSON.stringify({ sessionKey: idempotencyKey, seq: telemetrySeq++, ...telemetryEvents });
+    telemetryEvents = newTelemetryBatch();
+    // Fire and forget: a lost batch only leaves a gap in the trace
+    if (leaving && navigator.sendBeacon && navigator.sendBeacon('/api/telemetry', body)) return;
+    fetch('/api/telemetry', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: body,
+        keepalive: true
+    }).catch(() => {});
+}
+
+setInterval(() => flushTelemetry(false), TELEMETRY_FLUSH_INTERVAL);
+window.addEventListener('pagehide', () => flushTelemetry(true));
+
 function getImageCoordinates(event) {
     const rect = gameImage.getBoundingClientRect();
     
@@ -187,6 +248,8 @@ submitScoreBtn.addEventListener('click', async function() {
     submitScoreBtn.disabled = true;
     submitScoreBtn.textContent = 'Submitting...';
     
+    flushTelemetry(false);
+    
     try {
         const finalTime = Date.now() - startTime;
         const studyData = {
@@ -197,7 +260,11 @@ submitScoreBtn.addEventListener('click', async function() {
             foundObjects: foundObjects.length,
             targetObjects: targetObjects.length,
             imageMode: tintedModeRadio.checked ? 'visual_snow' : 'normal',
+            stimulusId: stimulusId,
+            stimulusSeed: tintedModeRadio.checked ? stimulusSeed : null,
+            stimulusWidth: tintedModeRadio.checked ? stimulusWidth : null,
             timestamp: new Date().toISOString(),
+            idempotencyKey: idempotencyKey,
             questionnaire: questionnaireData
         };
         
@@ -258,6 +325,7 @@ gameImage.addEventListener('click', function(event) {
     
     if (foundObject) {
         // Found a target object!
+        recordEvent('hit', coords, foundObject.id);
         const objectData = {
             clickNumber: clickCounter++,
             coordinates: coords,
@@ -286,6 +354,8 @@ gameImage.addEventListener('click', function(event) {
         checkTaskComplete();
     } else {
         // Didn't find a target object
+        const touched = storedPolygons.find(polygon => checkIfPointInPolygon(coords, polygon));
+        recordEvent('miss', coords, touched ? touched.id : null);
         clickCounter++;
         updateScore(-1); // -1 point for incorrect identification
         coordinatesDisplay.textContent = `No target object at (${coords.x}, ${coords.y}). -1 point`;
@@ -322,6 +392,11 @@ gameImage.addEventListener('mousemove', function(event) {
     
     const coords = getImageCoordinates(event);
     coordinatesDisplay.textContent = `Position: (${coords.x}, ${coords.y}) | Click to identify objects`;
+    
+    if (event.timeStamp - lastMoveRecorded >= TELEMETRY_MOVE_INTERVAL) {
+        lastMoveRecorded = event.timeStamp;
+        recordEvent('move', coords, null);
+    }
 });
 
 // Handle reveal button click
@@ -348,13 +423,61 @@ revealBtn.addEventListener('click', function() {
     updateSvgSize();
 });
 
+// Rendered images can be refused with 503 + Retry-After while a burst of
+// participants saturates the server's renderer. Fetch them ourselves so we
+// can wait and retry, with jittered backoff so a whole classroom doesn't
+// retry in lockstep, instead of leaving a broken stimulus mid-trial.
+const RENDER_RETRY_ATTEMPTS = 8;
+const RENDER_RETRY_MAX_MS = 15000;
+
+async function fetchRenderedImage(url) {
+    for (let attempt = 1; ; attempt++) {
+        let retryAfter = 1;
+        try {
+            const response = await fetch(url);
+            if (response.ok) {
+                return URL.createObjectURL(await response.blob());
+            }
+            if (response.status !== 503) {
+                throw new Error(`Image request failed with status ${response.status}`);
+            }
+            retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+        } catch (error) {
+            // Network errors are retried too; other HTTP errors are final
+            if (error.message.startsWith('Image request failed')) {
+                throw error;
+            }
+        }
+        if (attempt >= RENDER_RETRY_ATTEMPTS) {
+            throw new Error('Image renderer stayed busy');
+        }
+        const delay = Math.min(retryAfter * 1000 * 2 ** (attempt - 1), RENDER_RETRY_MAX_MS) * (0.5 + Math.random());
+        await new Promise(resolve => setTimeout(resolve, delay));
+    }
+}
+
+function loadRenderedImage(img, url) {
+    // Only the latest request for an element may set its source
+    img.dataset.pendingSrc = url;
+    fetchRenderedImage(url).then(objectUrl => {
+        if (img.dataset.pendingSrc !== url) {
+            URL.revokeObjectURL(objectUrl);
+            return;
+        }
+        if (img.src.startsWith('blob:')) {
+            URL.revokeObjectURL(img.src);
+        }
+        img.src = objectUrl;
+    }).catch(error => console.error('Error loading stimulus:', error));
+}
+
 // Image processing functions
 function updateProcessedImage() {
     const brightness = 0.6;  // Fixed brightness value
     const noise = 1.5;       // Fixed noise value
     
-    const imageUrl = `/api/generate-image?brightness=${brightness}&noise=${noise}&t=${Date.now()}`;
-    gameImage.src = imageUrl;
+    const params = `image=${stimulusId}&brightness=${brightness}&noise=${noise}&seed=${stimulusSeed}&width=${stimulusWidth}`;
+    loadRenderedImage(gameImage, `/api/generate-image?${params}`);
     
     // Simple coordinate refresh when image loads
     gameImage.onload = updateSvgSize;
@@ -365,6 +488,10 @@ function updateImageMode() {
     if (tintedModeRadio.checked) {
         updateProcessedImage();
     } else {
+        delete gameImage.dataset.pendingSrc;
+        if (gameImage.src.startsWith('blob:')) {
+            URL.revokeObjectURL(gameImage.src);
+        }
         gameImage.src = gameImage.dataset.normalSrc;
         gameImage.onload = updateSvgSize;
     }
@@ -0,0 +1,250 @@
+"""
+Aggregate study statistics, maintained incrementally.
+
+Every submission updates one session_stats row per group it belongs to
+(by image_mode, by have_visual_snow, and by both) plus the matching
+likert_counts rows; a batch of submissions is merged per group first.
+The updates are single UPDATE statements whose right hand sides read the
+old column values, so concurrent submissions never lose each other's
+updates and no row has to be read first. Reading the
+summary is then proportional to the number of groups, not sessions.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from database import db, StudySession, SessionStats, LikertCounts
+from exports import LIKERT_FIELDS as LIKERT_ITEMS
+
+LIKERT_LEVELS = range(1, 6)
+
+MOMENT_METRICS = ['score', 'time_ms', 'clicks']
+
+UNKNOWN = 'unknown'
+
+
+def groups(session):
+    """(dimension, group_value) pairs a session counts towards"""
+    image_mode = session.image_mode or UNKNOWN
+    have_visual_snow = session.have_visual_snow or UNKNOWN
+    return [
+        ('image_mode', image_mode),
+        ('have_visual_snow', have_visual_snow),
+        ('image_mode+have_visual_snow', f'{image_mode}+{have_visual_snow}'),
+    ]
+
+
+def likert_answers(session):
+    """item -> level for the valid 1-5 answers of a session"""
+    answers = {}
+    for item in LIKERT_ITEMS:
+        try:
+            level = int(getattr(session, item))
+        except (TypeError, ValueError):
+            continue
+        if level in LIKERT_LEVELS:
+            answers[item] = level
+    return answers
+
+
+def found_ratio(session):
+    if not session.target_objects:
+        return None
+    return float(session.found_objects) / float(session.target_objects)
+
+
+def _merge(values, count_column, prefix, batch):
+    # Chan et al. parallel update; for a single value this is Welford's step:
+    # mean' = mean + delta * nb / (n + nb)
+    # M2'   = M2 + M2b + delta^2 * n * nb / (n + nb),  delta = mean_b - mean
+    mean = getattr(SessionStats, f'{prefix}_mean')
+    m2 = getattr(SessionStats, f'{prefix}_m2')
+    delta = batch.mean - mean
+    total = count_column + batch.n
+    values[f'{prefix}_mean'] = mean + delta * batch.n / total
+    values[f'{prefix}_m2'] = m2 + batch.m2 + delta * delta * count_column * batch.n / total
+
+
+def _insert_ignore(model, rows):
+    """Insert rows, skipping any whose primary key already exists"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        db.session.execute(postgresql.insert(model).values(rows).on_conflict_do_nothing())
+    elif dialect == 'sqlite':
+        db.session.execute(sqlite.insert(model).values(rows).on_conflict_do_nothing())
+    else:
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(db.insert(model).values(row))
+            except IntegrityError:
+                pass
+
+
+def _ensure_group(dimension, group_value):
+    _insert_ignore(SessionStats, [{'dimension': dimension, 'group_value': group_value}])
+    _insert_ignore(LikertCounts, [
+        {'dimension': dimension, 'group_value': group_value, 'item': item}
+        for item in LIKERT_ITEMS
+    ])
+
+
+def _update_group(dimension, group_value, moments, counts):
+    """Merge accumulated sessions into a group; returns False if its row does not exist"""
+    values = {'n': SessionStats.n + moments['score'].n}
+    for metric in MOMENT_METRICS:
+        _merge(values, SessionStats.n, metric, moments[metric])
+    if moments['found_ratio'].n:
+        values['found_ratio_n'] = SessionStats.found_ratio_n + moments['found_ratio'].n
+        _merge(values, SessionStats.found_ratio_n, 'found_ratio', moments['found_ratio'])
+
+    result = db.session.execute(
+        db.update(SessionStats)
+        .where(SessionStats.dimension == dimension, SessionStats.group_value == group_value)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        return False
+
+    answered = [item for item, levels in counts.items() if any(levels)]
+    if answered:
+        # One statement for all items: each level column gains that item's count
+        db.session.execute(
+            db.update(LikertCounts)
+            .where(
+                LikertCounts.dimension == dimension,
+                LikertCounts.group_value == group_value,
+                LikertCounts.item.in_(answered)
+            )
+            .values({
+                f'level_{level}': getattr(LikertCounts, f'level_{level}') + db.case(
+                    *[(LikertCounts.item == item, counts[item][level - 1])
+                      for item in answered if counts[item][level - 1]],
+                    else_=0
+                )
+                for level in LIKERT_LEVELS
+                if any(counts[item][level - 1] for item in answered)
+            })
+            .execution_options(synchronize_session=False)
+        )
+    return True
+
+
+class _Moments:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+
+def accumulate(sessions):
+    """(dimension, group_value) -> (moments, likert counts) over an iterable of sessions"""
+    result = {}
+    for session in sessions:
+        ratio = found_ratio(session)
+        answers = likert_answers(session)
+        for key in groups(session):
+            if key not in result:
+                result[key] = (
+                    {name: _Moments() for name in MOMENT_METRICS + ['found_ratio']},
+                    {item: [0] * len(LIKERT_LEVELS) for item in LIKERT_ITEMS}
+                )
+            moments, counts = result[key]
+            for metric in MOMENT_METRICS:
+                moments[metric].add(float(getattr(session, metric)))
+            if ratio is not None:
+                moments['found_ratio'].add(ratio)
+            for item, level in answers.items():
+                counts[item][level - 1] += 1
+    return result
+
+
+def record(sessions):
+    """
+    Fold new StudySessions into the rollups with one UPDATE pair per group;
+    call in the transaction that inserts them.
+    """
+    for (dimension, group_value), (moments, counts) in accumulate(sessions).items():
+        if not _update_group(dimension, group_value, moments, counts):
+            # First sessions of this group
+            _ensure_group(dimension, group_value)
+            _update_group(dimension, group_value, moments, counts)
+
+
+def recompute(batch_size=1000):
+    """
+    Rebuild both rollup tables from study_sessions in one transaction.
+    The old rows are deleted first, which holds off concurrent
+    submissions' rollup updates until the rebuild commits.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('LOCK TABLE session_stats, likert_counts IN EXCLUSIVE MODE'))
+    db.session.execute(db.delete(LikertCounts))
+    db.session.execute(db.delete(SessionStats))
+
+    rollups = accumulate(StudySession.query.order_by(StudySession.id).yield_per(batch_size))
+    for (dimension, group_value), (moments, counts) in rollups.items():
+        row = SessionStats(
+            dimension=dimension, group_value=group_value,
+            n=moments['score'].n, found_ratio_n=moments['found_ratio'].n
+        )
+        for metric, acc in moments.items():
+            setattr(row, f'{metric}_mean', acc.mean)
+            setattr(row, f'{metric}_m2', acc.m2)
+        db.session.add(row)
+        for item, levels in counts.items():
+            db.session.add(LikertCounts(
+                dimension=dimension, group_value=group_value, item=item,
+                **{f'level_{level}': levels[level - 1] for level in LIKERT_LEVELS}
+            ))
+    db.session.commit()
+    # Every session is in exactly one image_mode group
+    sessions = sum(moments['score'].n for (dimension, _), (moments, _) in rollups.items() if dimension == 'image_mode')
+    return sessions, len(rollups)
+
+
+def recompute_if_empty():
+    """Build the rollups once for a database that predates them"""
+    if SessionStats.query.first() is None and StudySession.query.first() is not None:
+        return recompute()
+    return None
+
+
+def _describe(n, mean, m2):
+    variance = m2 / (n - 1) if n > 1 else None
+    return {
+        'mean': mean if n else None,
+        'variance': variance,
+        'std': variance ** 0.5 if variance is not None else None,
+    }
+
+
+def summary():
+    """dimension -> group_value -> statistics, read from the rollup tables"""
+    result = {}
+    for row in SessionStats.query.order_by(SessionStats.dimension, SessionStats.group_value):
+        group = {'n': row.n, 'likert': {}}
+        for metric in MOMENT_METRICS:
+            group[metric] = _describe(row.n, getattr(row, f'{metric}_mean'), getattr(row, f'{metric}_m2'))
+        group['found_ratio'] = _describe(row.found_ratio_n, row.found_ratio_mean, row.found_ratio_m2)
+        group['found_ratio']['n'] = row.found_ratio_n
+        result.setdefault(row.dimension, {})[row.group_value] = group
+
+    for row in LikertCounts.query:
+        group = result.get(row.dimension, {}).get(row.group_value)
+        if group is None:
+            continue
+        counts = [getattr(row, f'level_{level}') for level in LIKERT_LEVELS]
+        answered = sum(counts)
+        group['likert'][row.item] = {
+            'counts': counts,
+            'n': answered,
+            'mean': sum(level * count for level, count in zip(LIKERT_LEVELS, counts)) / answered if answered else None,
+        }
+    return result
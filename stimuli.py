@@ -0,0 +1,314 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from lazy_import import lazy_import
+
+# Decoding happens on first use, not at import
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Stimulus images live alongside the rest of the static assets
+STIMULUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images')
+DEFAULT_STIMULUS = 'Computer_Room_Desk_2008'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Requested widths / longest sides are snapped up to one of these so each
+# stimulus is only ever resized to a handful of cached sizes
+SIZE_CLASSES = (320, 480, 640, 800, 1024, 1280, 1600, 1920, 2560)
+
+# Pre-rendered outputs (e.g. from scripts/generate_noisy_image.py) are not stimuli
+DERIVED_SUFFIXES = ('_noisy',)
+
+
+class StimulusNotFound(KeyError):
+    """Raised when a stimulus id is not present in the registry"""
+
+
+def quantize(value, step=0.01):
+    """Round a float parameter so nearby values share cache entries"""
+    return round(round(float(value) / step) * step, 6)
+
+
+def size_class(value):
+    """Smallest size class >= value, or None when larger than every class"""
+    for size in SIZE_CLASSES:
+        if size >= value:
+            return size
+    return None
+
+
+class FrameCache:
+    """
+    Thread-safe LRU cache keyed by tuples starting with the stimulus id,
+    bounded by the total size of its values (array bytes by default)
+    """
+
+    def __init__(self, max_bytes, sizeof=lambda value: value.nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # Too large to ever fit; hand it back uncached
+            return value
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= self.sizeof(previous)
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self.sizeof(evicted)
+        return value
+
+    def invalidate(self, stimulus_id):
+        """Drop every cached variant belonging to one stimulus"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == stimulus_id]:
+                self.current_bytes -= self.sizeof(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class StimulusRegistry:
+    """
+    Maps stimulus ids to image files and caches their decoded frames.
+
+    Every variant handed out (the decoded base frame, its float32 copy and
+    brightness-scaled versions) is read-only and shared between requests.
+    Cached variants are dropped as soon as the file's mtime changes.
+
+    With shared_dir set, decoded frames (full size and each resized size
+    class) are also written there as .npy files and memory-mapped, so
+    every worker process on the machine reads the same pages instead of
+    decoding and holding a private copy.
+    """
+
+    def __init__(self, directory=STIMULUS_DIR, max_cache_bytes=256 * 1024 * 1024, shared_dir=None):
+        self.directory = directory
+        self.shared_dir = shared_dir
+        # Mapped frames live in the page cache, shared by all workers, so
+        # they do not count against this process's budget
+        self.cache = FrameCache(max_cache_bytes, sizeof=lambda value: 0 if isinstance(value, np.memmap) else value.nbytes)
+        self._extra = {}
+        self._scanned = {}
+        self._scanned_mtime = None
+        self._mtimes = {}
+        self._lock = threading.Lock()
+
+    def register(self, stimulus_id, path):
+        """Register an image outside the stimulus directory"""
+        with self._lock:
+            self._extra[stimulus_id] = os.path.abspath(path)
+        self.cache.invalidate(stimulus_id)
+
+    def _scan(self):
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return {}
+        if dir_mtime != self._scanned_mtime:
+            found = {}
+            for filename in sorted(os.listdir(self.directory)):
+                stem, ext = os.path.splitext(filename)
+                if ext.lower() not in IMAGE_EXTENSIONS or stem.endswith(DERIVED_SUFFIXES):
+                    continue
+                found.setdefault(stem, os.path.join(self.directory, filename))
+            self._scanned = found
+            self._scanned_mtime = dir_mtime
+        return self._scanned
+
+    def ids(self):
+        """List all available stimulus ids"""
+        with self._lock:
+            return sorted(set(self._scan()) | set(self._extra))
+
+    def path(self, stimulus_id):
+        with self._lock:
+            path = self._extra.get(stimulus_id) or self._scan().get(stimulus_id)
+        if path is None:
+            raise StimulusNotFound(stimulus_id)
+        return path
+
+    def version(self, stimulus_id):
+        """Changes whenever the stimulus file is modified"""
+        self._check_fresh(stimulus_id)
+        return self._mtimes[stimulus_id]
+
+    def _check_fresh(self, stimulus_id):
+        """Invalidate cached variants if the file changed on disk"""
+        path = self.path(stimulus_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            raise StimulusNotFound(stimulus_id)
+        if self._mtimes.get(stimulus_id) != mtime:
+            self.cache.invalidate(stimulus_id)
+            self._mtimes[stimulus_id] = mtime
+        return path
+
+    def _cached(self, key, build):
+        value = self.cache.get(key)
+        if value is None:
+            value = build()
+            if value is None:
+                return None
+            value.flags.writeable = False
+            value = self.cache.put(key, value)
+        return value
+
+    def output_size(self, stimulus_id, width=None, max_dim=None):
+        """
+        (width, height) to render at for the requested width and/or longest
+        side, snapped to a size class; None means full resolution
+        """
+        frame = self.get_frame(stimulus_id)
+        if frame is None:
+            return None
+        height, full_width = frame.shape[:2]
+        scale = 1.0
+        if width:
+            snapped = size_class(width)
+            if snapped:
+                scale = min(scale, snapped / full_width)
+        if max_dim:
+            snapped = size_class(max_dim)
+            if snapped:
+                scale = min(scale, snapped / max(height, full_width))
+        if scale >= 1.0:
+            return None
+        return (max(1, round(full_width * scale)), max(1, round(height * scale)))
+
+    def get_frame(self, stimulus_id, size=None):
+        """
+        Decoded BGR uint8 frame, optionally resized to size=(width, height),
+        or None if the file cannot be decoded
+        """
+        path = self._check_fresh(stimulus_id)
+        if size is None:
+            return self._cached((stimulus_id, 'base'), lambda: self._shared(stimulus_id, size, lambda: cv2.imread(path)))
+
+        def build():
+            frame = self.get_frame(stimulus_id)
+            return None if frame is None else cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+        return self._cached((stimulus_id, 'base', size), lambda: self._shared(stimulus_id, size, build))
+
+    def _shared(self, stimulus_id, size, build):
+        """Map the frame from shared_dir, building and writing it there first if missing"""
+        if not self.shared_dir:
+            return build()
+        version = self._mtimes[stimulus_id]
+        label = 'full' if size is None else f'{size[0]}x{size[1]}'
+        path = os.path.join(self.shared_dir, f'{stimulus_id}-{version}-{label}.npy')
+        try:
+            return np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            # Truncated or unreadable; rewrite it below
+            pass
+
+        frame = build()
+        if frame is None:
+            return None
+        try:
+            os.makedirs(self.shared_dir, exist_ok=True)
+            # Written under a temporary name so other workers never map a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.shared_dir, prefix='.tmp-', suffix='.npy')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(frame))
+            os.replace(tmp_path, path)
+            self._prune(stimulus_id, version)
+            return np.load(path, mmap_mode='r')
+        except OSError:
+            # Read-only or full disk: keep a private copy instead
+            return frame
+
+    def _prune(self, stimulus_id, version):
+        """Remove mapped frames of older versions of a stimulus"""
+        for filename in os.listdir(self.shared_dir):
+            parts = filename[:-len('.npy')].rsplit('-', 2) if filename.endswith('.npy') else ()
+            if len(parts) == 3 and parts[0] == stimulus_id and parts[1] != str(version):
+                try:
+                    # Processes that still map the file keep reading it until they let go
+                    os.unlink(os.path.join(self.shared_dir, filename))
+                except FileNotFoundError:
+                    pass
+
+    def preload(self, widths=()):
+        """
+        Decode every stimulus at full size and at the size classes for
+        widths, e.g. in the gunicorn master before workers fork. Returns
+        how many frames were loaded.
+        """
+        loaded = 0
+        for stimulus_id in self.ids():
+            if self.get_frame(stimulus_id) is None:
+                continue
+            loaded += 1
+            for width in widths:
+                size = self.output_size(stimulus_id, width=width)
+                if size is not None and self.get_frame(stimulus_id, size) is not None:
+                    loaded += 1
+        return loaded
+
+    def get_float(self, stimulus_id, size=None):
+        """Decoded frame converted to float32"""
+        self._check_fresh(stimulus_id)
+
+        def build():
+            frame = self.get_frame(stimulus_id, size)
+            return None if frame is None else frame.astype(np.float32)
+
+        return self._cached((stimulus_id, 'float32', size), build)
+
+    def get_brightened(self, stimulus_id, brightness, dtype='uint8', size=None):
+        """Brightness-scaled frame, clipped to the uint8 range"""
+        brightness = quantize(brightness)
+        dtype = np.dtype(dtype)
+        self._check_fresh(stimulus_id)
+
+        def build():
+            frame = self.get_frame(stimulus_id, size)
+            if frame is None:
+                return None
+            if brightness == 1.0:
+                scaled = frame
+            else:
+                scaled = np.clip(frame.astype(np.float32) * brightness, 0, 255).astype(np.uint8)
+            return scaled.astype(dtype, copy=False)
+
+        return self._cached((stimulus_id, 'bright', brightness, dtype.str, size), build)
@@ -0,0 +1,262 @@
+"""
+Storing study submissions: validation, idempotent multi-row inserts and
+an optional write-behind buffer.
+
+Every stored session carries an idempotency key (client supplied, or
+generated here when absent). Inserts skip keys that already exist, so a
+client retrying after a timeout gets the original row back instead of a
+duplicate. The buffer groups single submissions arriving close together
+into one INSERT and one COMMIT; each request still waits for its batch
+to commit before it is answered.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from database import db, StudySession
+import stats
+
+REQUIRED_FIELDS = ['username', 'score', 'time', 'clicks', 'foundObjects', 'targetObjects']
+
+MAX_KEY_LENGTH = 64
+
+# Columns written for every row, in the multi-row INSERT
+COLUMNS = [
+    'username', 'score', 'time_ms', 'clicks', 'found_objects', 'target_objects', 'image_mode',
+    'timestamp', 'frustrated', 'challenged', 'happy', 'angry', 'upset', 'defeated', 'content',
+    'joyful', 'heard_visual_snow', 'have_visual_snow', 'stimulus_id', 'stimulus_seed',
+    'stimulus_width', 'idempotency_key'
+]
+
+
+class SubmissionError(Exception):
+    """A submission payload that cannot be stored"""
+
+
+INT_MAX = 2 ** 31 - 1
+SEED_MAX = 2 ** 63 - 1
+
+LIKERT_ITEMS = ['frustrated', 'challenged', 'happy', 'angry', 'upset', 'defeated', 'content', 'joyful']
+
+
+def _integer(data, field, low=-INT_MAX, high=INT_MAX, required=True):
+    """data[field] as an int within [low, high]; whole-number floats are accepted"""
+    value = data.get(field)
+    if value is None and not required:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise SubmissionError(f'{field} must be an integer between {low} and {high}')
+    return value
+
+
+def _string(data, field, max_length, required=True, choices=None):
+    value = data.get(field)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not 0 < len(value) <= max_length:
+        raise SubmissionError(f'{field} must be a string of 1 to {max_length} characters')
+    if choices is not None and value not in choices:
+        raise SubmissionError(f'{field} must be one of: {", ".join(choices)}')
+    return value
+
+
+def session_from_payload(data):
+    """A new, unsaved StudySession from a submission payload"""
+    if not isinstance(data, dict):
+        raise SubmissionError('Submission must be an object')
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            raise SubmissionError(f'Missing required field: {field}')
+
+    key = data.get('idempotencyKey')
+    if key is None:
+        key = uuid.uuid4().hex
+    elif not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise SubmissionError(f'idempotencyKey must be a string of at most {MAX_KEY_LENGTH} characters')
+
+    # Extract questionnaire data
+    questionnaire = data.get('questionnaire') or {}
+    if not isinstance(questionnaire, dict):
+        raise SubmissionError('questionnaire must be an object')
+    answers = {item: _integer(questionnaire, item, 1, 5, required=False) for item in LIKERT_ITEMS}
+    return StudySession(
+        username=_string(data, 'username', 50),
+        score=_integer(data, 'score'),
+        time_ms=_integer(data, 'time', 0),
+        clicks=_integer(data, 'clicks', 0),
+        found_objects=_integer(data, 'foundObjects', 0),
+        target_objects=_integer(data, 'targetObjects', 0),
+        image_mode=_string(data, 'imageMode', 20, required=False) or 'normal',
+        timestamp=datetime.utcnow(),
+        heard_visual_snow=_string(questionnaire, 'heardVisualSnow', 3, required=False, choices=('yes', 'no')),
+        have_visual_snow=_string(questionnaire, 'haveVisualSnow', 3, required=False, choices=('yes', 'no')),
+        stimulus_id=_string(data, 'stimulusId', 100, required=False),
+        stimulus_seed=_integer(data, 'stimulusSeed', 0, SEED_MAX, required=False),
+        stimulus_width=_integer(data, 'stimulusWidth', 1, required=False),
+        idempotency_key=key,
+        **answers
+    )
+
+
+def _insert_returning(rows):
+    """Insert rows, skipping existing keys; returns {key: id} for the rows inserted"""
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        table = StudySession.__table__
+        statement = (
+            insert(table)
+            .on_conflict_do_nothing(index_elements=['idempotency_key'])
+            .returning(table.c.idempotency_key, table.c.id)
+        )
+        # executemany with RETURNING is sent as batched multi-row INSERTs
+        # ("insertmanyvalues"), reusing one compiled statement
+        return dict(db.session.connection().execute(statement, rows).all())
+
+    inserted = {}
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                inserted[row['idempotency_key']] = db.session.execute(
+                    db.insert(StudySession).values(row).returning(StudySession.id)
+                ).scalar()
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def insert_sessions(sessions, chunk_size=500):
+    """
+    Store sessions with as few statements as possible, and fold the new
+    ones into the statistics rollups. Returns (id, created) per session,
+    in order; created is False when the idempotency key was already
+    stored, in which case id is the original row's. Does not commit.
+    """
+    results = {}
+    unique = []
+    for session in sessions:
+        # A key repeated within the batch is stored once
+        if session.idempotency_key not in results:
+            results[session.idempotency_key] = None
+            unique.append(session)
+
+    created = []
+    for start in range(0, len(unique), chunk_size):
+        chunk = unique[start:start + chunk_size]
+        inserted = _insert_returning([{name: getattr(s, name) for name in COLUMNS} for s in chunk])
+        for session in chunk:
+            if session.idempotency_key in inserted:
+                results[session.idempotency_key] = (inserted[session.idempotency_key], True)
+                created.append(session)
+
+    existing = [key for key, result in results.items() if result is None]
+    if existing:
+        rows = db.session.query(StudySession.idempotency_key, StudySession.id).filter(
+            StudySession.idempotency_key.in_(existing)
+        )
+        for key, session_id in rows:
+            results[key] = (session_id, False)
+
+    stats.record(created)
+    seen = set()
+    ordered = []
+    for session in sessions:
+        session_id, was_created = results[session.idempotency_key]
+        ordered.append((session_id, was_created and session.idempotency_key not in seen))
+        seen.add(session.idempotency_key)
+    return ordered
+
+
+class SubmissionBuffer:
+    """
+    Group commit for single submissions. submit() queues a session and
+    blocks until the batch holding it has been written by flush(sessions),
+    which runs on a background thread at most max_delay seconds after the
+    first queued item, or as soon as max_items are waiting.
+    """
+
+    def __init__(self, flush, max_delay=0.05, max_items=100):
+        self.flush = flush
+        self.max_delay = max_delay
+        self.max_items = max_items
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so start one lazily in each worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+            self._thread.start()
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = os.getpid()
+
+    def submit(self, session, timeout=10.0):
+        """(id, created) once the session is committed; raises on failure or timeout"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((session, future))
+        return future.result(timeout)
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            results = self.flush([session for session, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # Keep one bad submission from failing its neighbours
+                for job in batch:
+                    self._write([job])
+                return
+            batch[0][1].set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def shutdown(self, timeout=5.0):
+        """Write whatever is still queued, then stop the worker"""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
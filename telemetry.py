@@ -0,0 +1,255 @@
+"""
+Click and pointer-move telemetry from the study page.
+
+The page sends events in batches as column arrays. Each batch is packed
+into one compressed binary row of telemetry_chunks, keyed by the
+participant's submission idempotency key and a batch sequence number,
+and written by a background thread in bulk, so a request costs only
+validation and a queue put. Reads decode a session's chunks in sequence
+order and stream the events.
+
+Packed layout (FORMAT_VERSION 1): one version byte, then zlib-compressed
+little-endian columns one after another:
+
+    t        int32  ms since the task started, delta-encoded
+    x, y     int16  image pixel coordinates
+    kind     uint8  index into EVENT_KINDS
+    polygon  int32  polygon id under the pointer, -1 for none
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from database import db, TelemetryChunk
+from lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+# move: pointer position sample; hit: click that found a target;
+# miss: any other click (polygon is whatever it landed on, if anything)
+EVENT_KINDS = ['move', 'hit', 'miss']
+
+FIELDS = [('t', '<i4'), ('x', '<i2'), ('y', '<i2'), ('kind', 'u1'), ('polygon', '<i4')]
+
+FORMAT_VERSION = 1
+
+MAX_KEY_LENGTH = 64
+
+
+class TelemetryError(Exception):
+    """A telemetry batch that cannot be stored; carries an HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def chunk_from_payload(data, max_events):
+    """A telemetry_chunks row (as a dict) from a batch payload"""
+    if not isinstance(data, dict):
+        raise TelemetryError('Telemetry must be an object')
+    key = data.get('sessionKey')
+    if not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise TelemetryError(f'sessionKey must be a string of at most {MAX_KEY_LENGTH} characters')
+    seq = data.get('seq')
+    if not isinstance(seq, int) or isinstance(seq, bool) or not 0 <= seq < 2 ** 31:
+        raise TelemetryError('seq must be a non-negative integer')
+
+    columns = {}
+    for name, dtype in FIELDS:
+        values = data.get(name)
+        if not isinstance(values, list):
+            raise TelemetryError(f'{name} must be a list')
+        try:
+            column = np.asarray(values, dtype=np.int64)
+        except (TypeError, ValueError, OverflowError):
+            raise TelemetryError(f'{name} must contain integers') from None
+        limits = np.iinfo(dtype)
+        low = 0 if name == 't' else (-1 if name == 'polygon' else limits.min)
+        high = len(EVENT_KINDS) - 1 if name == 'kind' else limits.max
+        if column.ndim != 1 or (column.size and (column.min() < low or column.max() > high)):
+            raise TelemetryError(f'{name} values must be between {low} and {high}')
+        columns[name] = column
+
+    count = len(columns['t'])
+    if any(len(column) != count for column in columns.values()):
+        raise TelemetryError('Event columns must have equal lengths')
+    if count == 0:
+        raise TelemetryError('No events')
+    if count > max_events:
+        raise TelemetryError(f'At most {max_events} events per batch', 413)
+    return {
+        'session_key': key,
+        'seq': seq,
+        'event_count': count,
+        'received_at': datetime.utcnow(),
+        'data': pack(columns),
+    }
+
+
+def pack(columns):
+    # Timestamps grow slowly, so their deltas are small and compress well
+    deltas = np.diff(columns['t'], prepend=0)
+    parts = [(deltas if name == 't' else columns[name]).astype(dtype).tobytes() for name, dtype in FIELDS]
+    return bytes([FORMAT_VERSION]) + zlib.compress(b''.join(parts))
+
+
+def unpack(data, count):
+    """Column name -> numpy array for a packed chunk of count events"""
+    if not data or data[0] != FORMAT_VERSION:
+        raise ValueError('Unknown telemetry chunk format')
+    body = zlib.decompress(data[1:])
+    columns = {}
+    offset = 0
+    for name, dtype in FIELDS:
+        dtype = np.dtype(dtype)
+        columns[name] = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+    columns['t'] = np.cumsum(columns['t'], dtype=np.int64)
+    return columns
+
+
+def write_chunks(rows):
+    """Insert chunk rows, skipping (session_key, seq) pairs already stored. Does not commit."""
+    table = TelemetryChunk.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(table).on_conflict_do_nothing(index_elements=['session_key', 'seq'])
+        db.session.connection().execute(statement, rows)
+        return
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(table).values(row))
+        except IntegrityError:
+            pass
+
+
+def session_chunks(session_key):
+    return TelemetryChunk.query.filter_by(session_key=session_key).order_by(TelemetryChunk.seq)
+
+
+def ndjson_events(session_key, batch_size=100):
+    """One NDJSON string per stored chunk, events in order"""
+    for chunk in session_chunks(session_key).yield_per(batch_size):
+        columns = unpack(chunk.data, chunk.event_count)
+        lines = []
+        for t, x, y, kind, polygon in zip(*(columns[name].tolist() for name, _ in FIELDS)):
+            lines.append(json.dumps({
+                't': t, 'x': x, 'y': y, 'kind': EVENT_KINDS[kind],
+                'polygon': polygon if polygon >= 0 else None
+            }) + '\n')
+        yield ''.join(lines)
+
+
+class TelemetryBuffer:
+    """
+    Write-behind queue for chunk rows. add() returns at once; a background
+    thread collects rows for up to max_delay seconds and writes them with
+    flush(rows). Beyond max_pending unwritten rows add() returns False,
+    so the caller can ask the client to retry later. Telemetry is best
+    effort: when a batch fails its rows are written one at a time, so a
+    bad row only loses itself; rows that still fail are logged and
+    reported to on_drop(count).
+    """
+
+    def __init__(self, flush, max_delay=0.5, max_pending=10000, max_batch=1000, on_drop=None):
+        self.flush = flush
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.on_drop = on_drop
+        self.pending = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so start one lazily in each worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self.pending = 0
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+            self._thread.start()
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = os.getpid()
+
+    def add(self, row):
+        self._ensure_worker()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+        self._queue.put(row)
+        return True
+
+    def _run(self, rows):
+        while True:
+            row = rows.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = rows.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        try:
+            self._write_rows(batch)
+        finally:
+            with self._lock:
+                self.pending -= len(batch)
+
+    def _write_rows(self, batch):
+        try:
+            self.flush(batch)
+            return
+        except Exception as e:
+            if len(batch) > 1:
+                # Keep one bad row from losing its neighbours
+                for row in batch:
+                    self._write_rows([row])
+                return
+            print(f"Error writing telemetry chunk {batch[0].get('session_key')}#{batch[0].get('seq')}: {e}")
+        with self._lock:
+            self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(1)
+
+    def shutdown(self, timeout=5.0):
+        """Write whatever is still queued, then stop the worker"""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
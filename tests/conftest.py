@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app reads its configuration at import time
+_tmp = tempfile.mkdtemp(prefix='visual-snow-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "test.db")}'
+os.environ.setdefault('METRICS_DIR', os.path.join(_tmp, 'metrics'))
+os.environ.setdefault('SHARED_FRAMES_DIR', os.path.join(_tmp, 'frames'))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    from database import db, init_db
+    with flask_app.app_context():
+        init_db()
+    yield flask_app
+
+
+@pytest.fixture
+def db_session(app):
+    """An app context over empty tables"""
+    from database import db
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        import app as app_module
+        app_module.study_cache.clear()
+        yield db.session
+        db.session.rollback()
+
+
+@pytest.fixture
+def client(app, db_session):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(client):
+    with client.session_transaction() as flask_session:
+        flask_session['admin_authenticated'] = True
+    return client
@@ -0,0 +1,32 @@
+import pytest
+
+import polygon_store
+from database import StoredCoordinate
+
+SQUARE = [[0, 0], [10, 0], [10, 10], [0, 10]]
+
+
+@pytest.mark.parametrize('method, body', [
+    ('post', [1, 2]),
+    ('post', {'points': SQUARE, 'label': ['a']}),
+    ('patch', [1]),
+    ('patch', {'create': [1]}),
+    ('patch', {'create': {'points': SQUARE}}),
+    ('patch', {'update': [[1]]}),
+    ('patch', {'delete': 'all'}),
+])
+def test_malformed_bodies_are_rejected(admin_client, method, body):
+    response = getattr(admin_client, method)('/api/coordinates', json=body)
+    assert response.status_code == 400
+    assert StoredCoordinate.query.count() == 0
+
+
+def test_bulk_create_bumps_the_version_once(admin_client):
+    before = polygon_store.current_version()
+    response = admin_client.patch('/api/coordinates', json={
+        'create': [{'label': f'p{i}', 'points': SQUARE} for i in range(20)]
+    })
+    assert response.status_code == 200
+    assert len(response.json['created']) == 20
+    assert polygon_store.current_version() == before + 1
+    assert len(polygon_store.active_coordinates()) == 20
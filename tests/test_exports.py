@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from flask import jsonify
+
+import exports
+from database import db, StudySession
+
+
+def test_parse_timestamp_converts_offsets_to_utc():
+    assert exports.parse_timestamp('2024-01-01T09:00+09:00') == datetime(2024, 1, 1, 0, 0)
+    assert exports.parse_timestamp('2024-01-01T09:00Z') == datetime(2024, 1, 1, 9, 0)
+    assert exports.parse_timestamp('2024-01-01T09:00') == datetime(2024, 1, 1, 9, 0)
+    assert exports.parse_timestamp(None) is None
+
+
+def test_export_since_with_offset(client):
+    db.session.add(StudySession(
+        username='p1', score=1, time_ms=1000, clicks=1, found_objects=1, target_objects=5,
+        image_mode='normal', timestamp=datetime(2024, 1, 1, 3, 0)
+    ))
+    db.session.commit()
+    # 09:00+09:00 is 00:00 UTC, before the session
+    response = client.get('/api/export-data?format=ndjson&since=2024-01-01T09:00%2B09:00')
+    assert len(response.get_data(as_text=True).strip().splitlines()) == 1
+    response = client.get('/api/export-data?format=ndjson&since=2024-01-01T04:00%2B00:00')
+    assert response.get_data(as_text=True).strip() == ''
+
+
+def test_json_export_matches_jsonify(client):
+    for hour, username in enumerate(('p1', 'p2')):
+        db.session.add(StudySession(
+            username=username, score=1, time_ms=1000, clicks=1, found_objects=1, target_objects=5,
+            image_mode='normal', timestamp=datetime(2024, 1, 1, hour, 0)
+        ))
+    db.session.commit()
+    sessions = StudySession.query.order_by(StudySession.timestamp.desc()).all()
+    expected = jsonify([session.to_dict() for session in sessions]).get_data()
+    assert client.get('/api/export-data').get_data() == expected
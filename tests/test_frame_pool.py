@@ -0,0 +1,57 @@
+import threading
+
+from frame_pool import FramePool
+
+
+def blocking_pool(**kwargs):
+    """A pool whose single worker holds its first render until released"""
+    release = threading.Event()
+
+    def render(key):
+        release.wait(5)
+        return f'{key}'.encode()
+
+    return FramePool(render, workers=1, **kwargs), release
+
+
+def test_refills_beyond_the_queue_are_dropped():
+    pool, release = blocking_pool(pool_size=8, max_queue=4)
+    try:
+        for key in range(5):
+            assert pool.get(key) is None
+        stats = pool.stats()
+        # One job is taken by the worker, the rest wait in the bounded queue
+        assert stats['queued'] <= 4
+        assert stats['dropped'] > 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_pools_are_bounded_least_recently_used_first():
+    pool, release = blocking_pool(pool_size=2, max_pools=3)
+    try:
+        for key in ['a', 'b', 'c']:
+            pool.get(key)
+        pool.get('a')
+        pool.get('d')
+        assert set(pool._pools) == {'a', 'c', 'd'}
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_dropped_refills_are_retried():
+    pool, release = blocking_pool(pool_size=4, max_queue=1)
+    release.set()
+    try:
+        pool.get('k')
+        assert pool.stats()['dropped'] > 0
+        for _ in range(500):
+            if all(pool._pools['k'].slots):
+                break
+            pool.get('k')
+            threading.Event().wait(0.005)
+        assert pool._pools['k'].slots == [b'k'] * 4
+    finally:
+        pool.shutdown()
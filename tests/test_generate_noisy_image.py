@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import generate_noisy_image
+
+
+def test_sources_differing_in_extension_get_distinct_names():
+    names = {generate_noisy_image.output_name(f'/in/photo.{ext}', 1.0, 0.35, 0.18, 0, 'jpeg') for ext in ('jpg', 'png')}
+    assert len(names) == 2
+
+
+def test_same_file_name_in_two_directories_is_refused(tmp_path, capsys):
+    for directory in ('a', 'b'):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'photo.jpg').write_bytes(b'')
+    output_dir = tmp_path / 'out'
+    assert not generate_noisy_image.main([str(tmp_path / 'a'), str(tmp_path / 'b'), '-o', str(output_dir)])
+    assert 'overwrite' in capsys.readouterr().out
+    assert not output_dir.exists()
+
+
+def test_manifest_sources_resolve_from_another_cwd(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'in').mkdir()
+    cv2.imwrite(str(tmp_path / 'in' / 'photo.png'), np.zeros((8, 8, 3), np.uint8))
+    argv = ['in', '-o', 'out', '--workers', '1', '--format', 'png']
+    monkeypatch.chdir(tmp_path)
+    assert generate_noisy_image.main(argv)
+
+    # Same inputs named from the parent directory are the same source
+    monkeypatch.chdir(tmp_path.parent)
+    argv = [str(tmp_path.name + '/in'), '-o', str(tmp_path.name + '/out'), '--workers', '1', '--format', 'png']
+    assert generate_noisy_image.main(argv)
+    assert '0 variants to render, 1 already rendered' in capsys.readouterr().out
+    manifest = json.loads((tmp_path / 'out' / 'manifest.json').read_text())
+    assert [entry['source'] for entry in manifest['entries'].values()] == [os.path.join('..', 'in', 'photo.png')]
+
+
+def test_a_failing_variant_does_not_drop_the_others(tmp_path, capsys):
+    (tmp_path / 'in').mkdir()
+    cv2.imwrite(str(tmp_path / 'in' / 'good.png'), np.zeros((8, 8, 3), np.uint8))
+    (tmp_path / 'in' / 'broken.png').write_bytes(b'not an image')
+    output_dir = tmp_path / 'out'
+    assert not generate_noisy_image.main([str(tmp_path / 'in'), '-o', str(output_dir), '--workers', '1', '--format', 'png'])
+    manifest = json.loads((output_dir / 'manifest.json').read_text())
+    assert [entry['source'] for entry in manifest['entries'].values()] == [os.path.join('..', 'in', 'good.png')]
+    assert '1 of 2 variants failed' in capsys.readouterr().out
+
+
+def test_render_job_reports_exceptions(tmp_path):
+    cv2.imwrite(str(tmp_path / 'photo.png'), np.zeros((8, 8, 3), np.uint8))
+    job = {
+        'name': 'x.png', 'path': str(tmp_path / 'missing' / 'x.png'), 'source': str(tmp_path / 'photo.png'),
+        'brightness': 1.0, 'noise': 0.35, 'density': 0.18, 'seed': 0, 'format': 'png', 'quality': None
+    }
+    assert generate_noisy_image.render_job(job)['error'].startswith('FileNotFoundError')
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import geometry
+
+
+@pytest.mark.parametrize('points, fmt', [
+    ([[50, 60], [100, 0], [0, 100]], geometry.INT16),
+    ([[50, 60.25], [-100, 0.5], [40000, 100]], geometry.CENTI),
+    ([[50, 60.123456], [100, 0], [0, 100]], geometry.FLOAT32),
+])
+def test_round_trip_keeps_whole_pixels_as_ints(points, fmt):
+    data = geometry.pack(points)
+    assert data[0] == fmt
+    flat = geometry.unpack(data)
+    assert flat[0] == 50 and type(flat[0]) is int
+    assert json.dumps(flat[0]) == '50'
+
+
+def test_centi_round_trip_is_exact():
+    points = [[50, 60.25], [-100, 0.5], [40000, -0.07], [-2.5, 12345.67]]
+    flat = geometry.unpack(geometry.pack(points))
+    assert flat == [value for point in points for value in point]
+    assert [type(value) for value in flat[:4]] == [int, float, int, float]
+
+
+def test_coordinate_vertices_are_cached_read_only():
+    from database import StoredCoordinate
+
+    coord = StoredCoordinate(label='a', points=[[0, 0], [10, 0], [10, 10]])
+    vertices = coord.vertices
+    assert coord.vertices is vertices
+    assert not vertices.flags.writeable
+    with pytest.raises(ValueError):
+        vertices[0, 0] = 5
+
+    coord.points = [[1, 1], [20, 1], [20, 20]]
+    assert coord.vertices is not vertices
+    assert coord.vertices.tolist() == [[1, 1], [20, 1], [20, 20]]
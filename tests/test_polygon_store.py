@@ -0,0 +1,72 @@
+import polygon_store
+from database import db, PolygonSet, StoredCoordinate, StudyState
+
+
+def add(label):
+    coord = StoredCoordinate(label=label)
+    coord.points = [[0, 0], [10, 0], [10, 10]]
+    return polygon_store.add_coordinate(coord)
+
+
+def test_deleting_a_set_deletes_rows_only_it_referenced(db_session):
+    kept = add('kept')
+    dropped = add('dropped')
+    polygon_store.save_set('old')
+    polygon_store.remove_coordinates([dropped.id])
+    polygon_store.save_set('new')
+    db_session.commit()
+    dropped_id = dropped.id
+
+    polygon_store.delete_set('old')
+    db_session.commit()
+    assert db.session.get(StoredCoordinate, dropped_id) is None
+    assert db.session.get(StoredCoordinate, kept.id) is not None
+
+
+def test_concurrent_fork_keeps_the_other_editors_draft(db_session):
+    add('a')
+    frozen = polygon_store.save_set('saved')
+    db_session.commit()
+    state = polygon_store.get_state()
+    assert state.active_set_id == frozen.id
+
+    # Another editor forks a draft and moves the pointer behind this
+    # session's back, after it read the state
+    theirs = polygon_store._new_draft()
+    db_session.execute(
+        db.update(StudyState).where(StudyState.id == 1).values(active_set_id=theirs.id)
+        .execution_options(synchronize_session=False)
+    )
+
+    draft = polygon_store.editable_set()
+    db_session.commit()
+    assert draft.id == theirs.id
+    assert polygon_store.get_state().active_set_id == theirs.id
+    assert PolygonSet.query.filter(PolygonSet.frozen.is_(False)).count() == 1
+
+
+def test_malformed_created_at_is_rejected(admin_client):
+    response = admin_client.post('/api/polygon-sets', json={'name': 'x', 'created_at': 'yesterday'})
+    assert response.status_code == 400
+    response = admin_client.post('/api/polygon-sets', json={'name': 'x', 'created_at': '2026-01-02T03:04:05+02:00'})
+    assert response.status_code == 200
+    assert PolygonSet.query.filter_by(name='x').one().created_at.hour == 1
+
+
+def test_set_versions_come_from_the_state_counter(db_session):
+    # Sets versioned before the counter existed seed it
+    db_session.add(PolygonSet(name='legacy', frozen=True, version=7))
+    add('a')
+    assert polygon_store.save_set('first').version == 8
+    add('b')
+    assert polygon_store.save_set('second').version == 9
+    db_session.commit()
+
+    # A number is never handed out twice, even once its set is gone
+    polygon_store.activate_set('first')
+    polygon_store.delete_set('second')
+    db_session.commit()
+    add('c')
+    assert polygon_store.save_set('third').version == 10
+    db_session.commit()
+    assert db.session.get(StudyState, 1).set_version == 10
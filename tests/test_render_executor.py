@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from render_executor import RenderExecutor, Saturated
+
+
+def blocked_render(release):
+    def render():
+        release.wait(5)
+        return 'done'
+    return render
+
+
+def start_waiters(executor, count, key, release):
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(executor.submit(blocked_render(release), key=key, timeout=5)))
+        for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_waiters(executor, count):
+    for _ in range(500):
+        if executor.stats()['waiters'] == count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f'expected {count} waiters, have {executor.stats()["waiters"]}')
+
+
+def test_coalesced_waiters_count_against_the_limit():
+    executor = RenderExecutor(workers=1, max_queue=4, max_waiters=3)
+    release = threading.Event()
+    try:
+        threads, results = start_waiters(executor, 3, 'same-key', release)
+        wait_for_waiters(executor, 3)
+        # Same key, so the queue has room, but every allowed waiter is taken
+        with pytest.raises(Saturated):
+            executor.submit(blocked_render(release), key='same-key', timeout=5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        assert results == ['done'] * 3
+        assert executor.stats()['waiters'] == 0
+        assert executor.submit(lambda: 'again', key='same-key', timeout=5) == 'again'
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_streams_and_render_waiters_leave_a_thread_for_submissions(client, monkeypatch):
+    import app as app_module
+    from concurrent.futures import ThreadPoolExecutor
+
+    release = threading.Event()
+
+    def held_stream(render_frame, fps, max_seconds, cpu_budget):
+        release.wait(10)
+        yield b''
+
+    def held_render(*args, **kwargs):
+        release.wait(10)
+        return b'frame'
+
+    monkeypatch.setattr(app_module, 'mjpeg_stream', held_stream)
+    monkeypatch.setattr(app_module, 'render_encoded_image', held_render)
+
+    def get(url):
+        response = app_module.app.test_client().get(url)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    # One pool thread per gunicorn request thread
+    pool = ThreadPoolExecutor(app_module.REQUEST_THREADS)
+    try:
+        held = [pool.submit(get, '/api/stream') for _ in range(app_module.STREAM_MAX_CONCURRENT)]
+        held += [pool.submit(get, f'/api/generate-image?seed={seed}') for seed in range(app_module.RENDER_MAX_WAITERS)]
+        for _ in range(500):
+            if (app_module.stream_limiter.active == app_module.STREAM_MAX_CONCURRENT
+                    and app_module.render_executor.stats()['waiters'] == app_module.RENDER_MAX_WAITERS):
+                break
+            threading.Event().wait(0.01)
+        assert len(held) < app_module.REQUEST_THREADS
+
+        # Both budgets are spent, so more of either is turned away at once...
+        assert pool.submit(get, '/api/stream').result(5) == 503
+        assert pool.submit(get, '/api/generate-image?seed=999').result(5) == 503
+        # ...and a submission still finds a free thread
+        submit = pool.submit(lambda: app_module.app.test_client().post('/api/submit-score', json={
+            'username': 'p1', 'score': 1, 'time': 1000, 'clicks': 1, 'foundObjects': 1, 'targetObjects': 1,
+        }).status_code)
+        assert submit.result(5) == 200
+    finally:
+        release.set()
+        pool.shutdown(wait=True)
+    assert all(future.result() == 200 for future in held)
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+import results_query
+from database import db, StudySession
+
+
+def add_sessions(count, undated_every=4):
+    base = datetime(2025, 1, 1)
+    for i in range(count):
+        db.session.add(StudySession(
+            username=f'p{i}', score=1, time_ms=1000, clicks=1, found_objects=1, target_objects=5,
+            image_mode='normal' if i % 2 else 'visual_snow',
+            # Some sessions share a timestamp, so ties are broken on id
+            timestamp=None if i % undated_every == 0 else base + timedelta(minutes=i // 2)
+        ))
+    db.session.flush()
+    # create() applies the default; legacy rows have no timestamp
+    db.session.execute(db.update(StudySession).where(StudySession.username.in_(
+        [f'p{i}' for i in range(0, count, undated_every)]
+    )).values(timestamp=None))
+    db.session.commit()
+
+
+def expected_order(sessions):
+    dated = sorted((s for s in sessions if s.timestamp), key=lambda s: (s.timestamp, s.id), reverse=True)
+    undated = sorted((s for s in sessions if not s.timestamp), key=lambda s: s.id, reverse=True)
+    return [s.id for s in dated + undated]
+
+
+def collect(query, limit):
+    ids, cursor = [], None
+    while True:
+        rows, cursor = results_query.page(query, limit=limit, cursor=cursor)
+        ids += [row.id for row in rows]
+        if cursor is None:
+            return ids
+
+
+def test_pages_cover_dated_then_undated_rows(db_session):
+    add_sessions(37)
+    expected = expected_order(StudySession.query.all())
+    for limit in (1, 5, 9, 100):
+        assert collect(StudySession.query, limit) == expected
+    filtered = results_query.filtered_query(image_mode='normal')
+    assert collect(filtered, 4) == expected_order(filtered.all())
+
+
+def test_page_queries_use_the_index_order(db_session):
+    add_sessions(20)
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        _, cursor = results_query.page(StudySession.query, limit=3)
+        results_query.page(StudySession.query, limit=3, cursor=cursor)
+        _, cursor = results_query.page(results_query.filtered_query(image_mode='normal'), limit=3)
+        results_query.page(results_query.filtered_query(image_mode='normal'), limit=3, cursor=cursor)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    assert statements
+    for statement, parameters in statements:
+        plan = ' '.join(row[-1] for row in db.session.connection().exec_driver_sql(
+            f'EXPLAIN QUERY PLAN {statement}', parameters
+        ))
+        assert 'TEMP B-TREE' not in plan, plan
+        assert 'USING INDEX' in plan or 'USING COVERING INDEX' in plan, plan
+
+
+def test_page_sql_for_postgres_has_no_nulls_last_or_or_branch(db_session):
+    add_sessions(10)
+    statements = []
+
+    def capture(state):
+        statements.append(state.statement)
+
+    event.listen(db.session, 'do_orm_execute', capture)
+    try:
+        _, cursor = results_query.page(StudySession.query, limit=3)
+        results_query.page(StudySession.query, limit=3, cursor=cursor)
+    finally:
+        event.remove(db.session, 'do_orm_execute', capture)
+
+    assert statements
+    for statement in statements:
+        sql = str(statement.compile(dialect=postgresql.dialect())).upper()
+        assert 'NULLS LAST' not in sql
+        assert ' OR ' not in sql
+
+
+def test_username_search_defaults_to_case_insensitive_substring(db_session):
+    add_sessions(12)
+    db.session.add(StudySession(
+        username='Lab-Alice', score=1, time_ms=1000, clicks=1, found_objects=1, target_objects=5,
+        image_mode='normal', timestamp=datetime(2025, 2, 1)
+    ))
+    db.session.commit()
+    assert [s.username for s in results_query.filtered_query(username='alice')] == ['Lab-Alice']
+
+
+def test_csv_export_applies_the_results_filters(admin_client):
+    add_sessions(12)
+    response = admin_client.get('/api/export-data?format=csv&image_mode=normal&username=P1')
+    lines = response.get_data(as_text=True).strip().splitlines()
+    usernames = {line.split(',')[1] for line in lines[1:]}
+    assert usernames == {'p1', 'p11'}
+
+
+def test_count_estimate_keeps_filters_as_bound_parameters(db_session):
+    username = "a:b 100%"
+    query = results_query.filtered_query(username=username)
+    sql, params = results_query.explain_sql(
+        query.order_by(None).with_entities(StudySession.id).statement, postgresql.psycopg2.dialect()
+    )
+    assert sql.startswith('EXPLAIN (FORMAT JSON) SELECT')
+    assert ':b' not in sql and username not in sql
+    # autoescape escapes the LIKE wildcard; the colon is passed through untouched
+    assert list(params.values()) == ['a:b 100/%']
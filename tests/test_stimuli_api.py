@@ -0,0 +1,17 @@
+import pytest
+
+
+def test_stimuli_lists_the_default(client):
+    response = client.get('/api/stimuli')
+    assert response.status_code == 200
+    assert response.json['default'] in response.json['stimuli']
+
+
+@pytest.mark.parametrize('query', [
+    'brightness=inf', 'brightness=-inf', 'noise=1e400', 'noise=nan', 'brightness=abc',
+])
+@pytest.mark.parametrize('route', ['/api/generate-image', '/api/stream'])
+def test_non_finite_render_parameters_are_rejected(client, route, query):
+    response = client.get(f'{route}?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.json
@@ -0,0 +1,23 @@
+import pytest
+
+import app as app_module
+
+
+@pytest.mark.parametrize('fps', ['abc', 'nan', 'inf', '-inf'])
+def test_bad_fps_is_rejected(client, fps):
+    assert client.get(f'/api/stream?fps={fps}').status_code == 400
+
+
+@pytest.mark.parametrize('fps, expected', [('-5', 1.0), ('0', 1.0), ('0.2', 1.0), ('5', 5.0), ('1000', app_module.STREAM_MAX_FPS)])
+def test_fps_is_clamped(client, monkeypatch, fps, expected):
+    used = []
+
+    def fake_stream(render_frame, fps, max_seconds, cpu_budget):
+        used.append(fps)
+        yield b''
+
+    monkeypatch.setattr(app_module, 'mjpeg_stream', fake_stream)
+    response = client.get(f'/api/stream?fps={fps}')
+    assert response.status_code == 200
+    response.close()
+    assert used == [expected]
@@ -0,0 +1,63 @@
+import pytest
+
+import submissions
+from database import StudySession
+
+
+def payload(**overrides):
+    data = {
+        'username': 'p1', 'score': 3, 'time': 42000, 'clicks': 7, 'foundObjects': 4, 'targetObjects': 5,
+        'imageMode': 'visual_snow', 'stimulusId': 'Computer_Room_Desk_2008', 'stimulusSeed': 12345,
+        'stimulusWidth': 1600,
+        'questionnaire': {'frustrated': 2, 'joyful': 4, 'heardVisualSnow': 'no', 'haveVisualSnow': 'yes'},
+    }
+    data.update(overrides)
+    return data
+
+
+@pytest.mark.parametrize('overrides', [
+    {'score': 'abc'},
+    {'score': True},
+    {'time': -1},
+    {'clicks': 1.5},
+    {'username': ''},
+    {'username': 'x' * 51},
+    {'imageMode': 7},
+    {'stimulusSeed': 'zz'},
+    {'stimulusSeed': -3},
+    {'stimulusWidth': 0},
+    {'stimulusId': ['a']},
+    {'questionnaire': {'happy': 9}},
+    {'questionnaire': {'heardVisualSnow': 'maybe'}},
+    {'questionnaire': 'yes'},
+])
+def test_malformed_fields_are_rejected(overrides):
+    with pytest.raises(submissions.SubmissionError):
+        submissions.session_from_payload(payload(**overrides))
+
+
+def test_valid_payload_is_converted():
+    session = submissions.session_from_payload(payload(score=-2.0, stimulusSeed=None))
+    assert session.score == -2 and session.stimulus_seed is None
+    assert session.frustrated == 2 and session.happy is None
+
+
+def test_bad_item_in_batch_is_reported_not_fatal(client):
+    response = client.post('/api/submit-scores', json={'sessions': [
+        payload(idempotencyKey='good-1'),
+        payload(idempotencyKey='bad-1', score='abc'),
+        payload(idempotencyKey='bad-2', stimulusSeed='zz'),
+    ]})
+    assert response.status_code == 200
+    statuses = [result['status'] for result in response.json['results']]
+    assert statuses == ['created', 'invalid', 'invalid']
+    assert [s.idempotency_key for s in StudySession.query.all()] == ['good-1']
+
+
+def test_rendered_width_is_stored_with_the_seed(client):
+    # The noise depends on the rendered width, so a trial is only
+    # reproducible with it
+    assert client.post('/api/submit-score', json=payload()).status_code in (200, 201)
+    session = StudySession.query.one()
+    assert (session.stimulus_seed, session.stimulus_width) == (12345, 1600)
+    assert session.to_dict()['stimulus_width'] == 1600
@@ -0,0 +1,32 @@
+import metrics
+import telemetry
+
+
+def test_failing_row_does_not_drop_its_batch():
+    written = []
+    drops = []
+
+    def flush(rows):
+        if any(row['seq'] == 2 for row in rows):
+            raise ValueError('bad row')
+        written.extend(row['seq'] for row in rows)
+
+    buffer = telemetry.TelemetryBuffer(flush, max_delay=0.05, on_drop=drops.append)
+    for seq in range(5):
+        assert buffer.add({'session_key': 'k', 'seq': seq})
+    buffer.shutdown()
+
+    assert sorted(written) == [0, 1, 3, 4]
+    assert buffer.dropped == 1 and drops == [1]
+    assert buffer.pending == 0
+
+
+def test_drops_are_exported_as_a_counter(tmp_path):
+    registry = metrics.Registry(directory=str(tmp_path))
+    registry.increment(metrics.TELEMETRY_DROPPED_METRIC, {}, 2)
+    registry.increment(metrics.TELEMETRY_DROPPED_METRIC, {}, 1)
+    registry.observe(metrics.SPAN_METRIC, {'route': '/x', 'span': 'render'}, 0.01)
+    text = registry.render()
+    assert f'# TYPE {metrics.TELEMETRY_DROPPED_METRIC} counter' in text
+    assert f'{metrics.TELEMETRY_DROPPED_METRIC}{{}} 3' in text
+    assert f'# TYPE {metrics.SPAN_METRIC} histogram' in text
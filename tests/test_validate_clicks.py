@@ -0,0 +1,36 @@
+import hit_map
+
+
+def square(x, y, size=50):
+    return [{'x': x, 'y': y}, {'x': x + size, 'y': y}, {'x': x + size, 'y': y + size}, {'x': x, 'y': y + size}]
+
+
+def add_polygons(client, *polygons):
+    response = client.patch('/api/coordinates', json={
+        'create': [{'label': f'object {i}', 'points': points} for i, points in enumerate(polygons)]
+    })
+    return [coord['id'] for coord in response.json['created']]
+
+
+def test_replay_scores_hits_and_misses_like_the_client():
+    # miss, hit 1, repeat of 1 (a miss), hit 2, then a click after the task ended
+    found, score = hit_map.replay([[], [1], [1], [2, 1], [3]], [1, 2])
+    assert found == [1, 2]
+    assert score == 1 + 1 - 1 - 1
+
+
+def test_validate_clicks_counts_misses(admin_client):
+    first, second, other = add_polygons(admin_client, square(100, 100), square(300, 300), square(500, 100))
+    response = admin_client.post('/api/validate-clicks', json={
+        'points': [
+            {'x': 10, 'y': 10},      # nothing
+            {'x': 120, 'y': 120},    # first target
+            {'x': 520, 'y': 120},    # a polygon that is not a target
+            {'x': 320, 'y': 320},    # second target
+        ],
+        'targets': [first, second]
+    })
+    assert response.status_code == 200
+    assert response.json['hits'] == [[], [first], [other], [second]]
+    assert response.json['found'] == [first, second]
+    assert response.json['score'] == 0